@@ -0,0 +1,63 @@
+# startup budget of the cdakit CLI, exits 1 if building the parser got slower
+# or pulls in a heavy dependency
+#
+#   python benchmarks/bench_import_time.py --budget-ms 100
+
+import argparse
+import subprocess
+import sys
+import time
+
+# none of them is needed before a subcommand is dispatched
+HEAVY_MODULES = ("pymatgen", "ase", "spglib", "pandas", "numpy", "joblib", "pyarrow", "scipy", "tqdm")
+
+STARTUP = "from cdakit.main import get_parser; get_parser()"
+
+
+def importtime(code: str) -> dict[str, int]:
+    """cumulative import time in us of every module imported by code, by -X importtime"""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, check=True)
+    cumulative = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cum, name = line[len("import time:"):].split("|")
+        if cum.strip().isdigit():
+            cumulative[name.strip()] = int(cum)
+    return cumulative
+
+
+def wall_time(argv: list[str], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        subprocess.run(argv, capture_output=True, check=True)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--budget-ms", type=float, default=100, help="max cumulative import time of cdakit.main")
+    parser.add_argument("--repeat", type=int, default=5, help="runs of `cdakit --help`, the best is reported")
+    args = parser.parse_args()
+
+    cumulative = importtime(STARTUP)
+    t_main = cumulative["cdakit.main"] / 1000
+    heavy = sorted(name for name in cumulative if name.split(".")[0] in HEAVY_MODULES)
+    t_help = wall_time([sys.executable, "-m", "cdakit.main", "--help"], args.repeat)
+
+    print(f"import cdakit.main      {t_main:8.1f} ms (budget {args.budget_ms:.0f} ms)")
+    print(f"cdakit --help wall time {t_help * 1000:8.1f} ms")
+    failed = False
+    if t_main > args.budget_ms:
+        print(f"FAIL: import of cdakit.main is over budget by {t_main - args.budget_ms:.1f} ms")
+        failed = True
+    if heavy:
+        print(f"FAIL: heavy modules imported at startup: {', '.join(heavy[:10])}{' ...' if len(heavy) > 10 else ''}")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
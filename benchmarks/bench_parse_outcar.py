@@ -0,0 +1,146 @@
+# benchmark parse_outcar against the line-by-line text parser on a synthetic OUTCAR
+#
+#   python benchmarks/bench_parse_outcar.py --size 2G --natoms 64 --workdir /tmp/outcar_bench
+
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from cdakit.parse_outcar import parse_one_outcar, read_outcar_arrays, summarize_one_outcar
+
+
+def parse_size(size: str) -> int:
+    units = {"K": 2**10, "M": 2**20, "G": 2**30}
+    if size[-1].upper() in units:
+        return int(float(size[:-1]) * units[size[-1].upper()])
+    return int(size)
+
+
+def fake_step(rng, natoms, lattice, pstress=0.0):
+    pos = rng.random((natoms, 3)) @ lattice
+    forces = rng.normal(0, 0.1, (natoms, 3))
+    stress = rng.normal(0, 5, 6)
+    volume = abs(np.linalg.det(lattice))
+    energy = -5.0 * natoms + rng.normal(0, 0.1)
+    pv = pstress * volume / 1602.1766208
+    return (
+        "  FORCE on cell =-STRESS in cart. coord.  units (eV):\n"
+        "  Direction    XX          YY          ZZ          XY          YZ          ZX\n"
+        "  in kB   " + "".join(f"{x:12.5f}" for x in stress) + "\n"
+        f"  external pressure =   {stress[:3].mean():10.2f} kB  Pullay stress =        0.00 kB\n\n"
+        " VOLUME and BASIS-vectors are now :\n"
+        " -----------------------------------------------------------------------------\n"
+        "  energy-cutoff  :      520.00\n"
+        f"  volume of cell :   {volume:10.2f}\n"
+        "      direct lattice vectors                 reciprocal lattice vectors\n"
+        + "".join(
+            "  " + "".join(f"{x:13.9f}" for x in row) + "".join(f"{x:13.9f}" for x in rec) + "\n"
+            for row, rec in zip(lattice, np.linalg.inv(lattice).T)
+        )
+        + "\n POSITION                                       TOTAL-FORCE (eV/Angst)\n"
+        " -----------------------------------------------------------------------------------\n"
+        + "".join(
+            "".join(f"{x:13.5f}" for x in p) + "   " + "".join(f"{x:14.6f}" for x in f) + "\n"
+            for p, f in zip(pos, forces)
+        )
+        + " -----------------------------------------------------------------------------------\n"
+        "    total drift:                                0.000000     -0.000000      0.000000\n\n"
+        "  FREE ENERGIE OF THE ION-ELECTRON SYSTEM (eV)\n"
+        "  ---------------------------------------------------\n"
+        f"  free  energy   TOTEN  =   {energy:18.8f} eV\n\n"
+        f"  energy  without entropy=   {energy:18.8f}  energy(sigma->0) =   {energy:18.8f}\n"
+        f"  enthalpy is  TOTEN    =   {energy + pv:18.8f} eV   P V=   {pv:14.8f}\n\n"
+        "     LOOP+:  cpu time     12.3456: real time     12.4567\n"
+    )
+
+
+def write_fake_outcar(taskdir: Path, size: int, natoms=64, seed=0):
+    """Write OUTCAR of at least ``size`` bytes and the matching CONTCAR"""
+    rng = np.random.default_rng(seed)
+    taskdir.mkdir(parents=True, exist_ok=True)
+    lattice = np.diag([10.0, 10.0, 10.0])
+    with open(taskdir / "OUTCAR", "w") as f:
+        f.write(
+            " vasp.6.3.0 18Jan22 (build Feb 23 2022 13:08:53) complex\n"
+            f"   number of dos      NEDOS =    301   number of ions     NIONS = {natoms:6d}\n"
+            f"  volume of cell :   {np.linalg.det(lattice):10.2f}\n"
+            "      direct lattice vectors                 reciprocal lattice vectors\n"
+            + "".join("  " + "".join(f"{x:13.9f}" for x in row) * 2 + "\n" for row in lattice)
+        )
+        while f.tell() < size:
+            lattice = lattice + rng.normal(0, 0.01, (3, 3))
+            f.write(fake_step(rng, natoms, lattice, pstress=10))
+        f.write(
+            " reached required accuracy - stopping structural energy minimisation\n"
+            "                  Total CPU time used (sec):      123.456\n"
+        )
+    with open(taskdir / "CONTCAR", "w") as f:
+        f.write("fake\n1.0\n" + "".join(" ".join(map(str, row)) + "\n" for row in lattice))
+        f.write(f"Si\n{natoms}\nDirect\n" + "0.0 0.0 0.0\n" * natoms)
+
+
+def legacy_parse(foutcar: Path):
+    energylist, Vlist, PVlist, extpres = [], [], [], []
+    converge, cputime = False, pd.NA
+    with open(foutcar, "r") as f:
+        for line in f:
+            if "energy  without" in line:
+                energylist.append(float(line.strip().split()[-1]))
+            elif "P V=" in line:
+                PVlist.append(float(line.strip().split()[-1]))
+            elif "volume of cell" in line:
+                Vlist.append(line.strip().split()[-1])
+            elif "external pressure" in line:
+                extpres.append(line.strip().split()[3])
+            elif "reached required" in line:
+                converge = True
+            elif "CPU" in line:
+                cputime = float(line.strip().split()[-1])
+    return energylist, Vlist, PVlist, extpres, converge, cputime
+
+
+def timeit(func, *args):
+    t0 = time.perf_counter()
+    ret = func(*args)
+    return time.perf_counter() - t0, ret
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--size", default="256M", help="OUTCAR size, suffix K/M/G allowed")
+    parser.add_argument("--natoms", type=int, default=64)
+    parser.add_argument("--workdir", default="outcar_bench")
+    args = parser.parse_args()
+
+    taskdir = Path(args.workdir)
+    foutcar = taskdir / "OUTCAR"
+    size = parse_size(args.size)
+    if not foutcar.exists() or foutcar.stat().st_size < size:
+        print(f"writing {foutcar} ...")
+        write_fake_outcar(taskdir, size, args.natoms)
+    nbytes = foutcar.stat().st_size
+
+    t_legacy, legacy = timeit(legacy_parse, foutcar)
+    t_df, df = timeit(parse_one_outcar, foutcar)
+    t_arr, arrays = timeit(read_outcar_arrays, foutcar)
+    t_sum, summary = timeit(summarize_one_outcar, foutcar)
+    assert len(df) == len(legacy[0]) and np.allclose(df["energy"], legacy[0])
+    assert arrays["forces"].shape == (len(df), args.natoms, 3)
+    assert summary["ion_steps"] == len(df)
+
+    print(f"{nbytes / 2**20:.0f} MiB, {len(df)} steps, {args.natoms} atoms")
+    timings = [
+        ("legacy text", t_legacy),
+        ("parse_one_outcar", t_df),
+        ("read_outcar_arrays", t_arr),
+        ("summarize_one_outcar", t_sum),
+    ]
+    for label, t in timings:
+        print(f"{label:20s} {t:8.3f} s {nbytes / 2**20 / t:10.1f} MiB/s")
+
+
+if __name__ == "__main__":
+    main()
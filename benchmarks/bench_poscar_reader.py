@@ -0,0 +1,67 @@
+# benchmark the per-file latency of cdakit.poscar against the ase and pymatgen readers
+#
+#   python benchmarks/bench_poscar_reader.py --nstructs 2000 --natoms 4 64 --workdir /tmp/poscar_bench
+
+import argparse
+import time
+import warnings
+from pathlib import Path
+
+import numpy as np
+from ase.io import read
+from pymatgen.core.structure import Structure
+
+from cdakit.poscar import read_poscar
+from datasets import write_poscar_dir
+
+READERS = {
+    "ase.io.read": lambda f: read(f, format="vasp"),
+    "Structure.from_file": Structure.from_file,
+    "read_poscar": read_poscar,
+    "read_poscar + to_atoms": lambda f: read_poscar(f).to_atoms(),
+    "read_poscar + to_structure": lambda f: read_poscar(f).to_structure(),
+}
+
+
+def check(fnames):
+    """the cells of read_poscar are those of ase"""
+    for fname in fnames:
+        atoms = read(fname, format="vasp")
+        cell = read_poscar(fname)
+        assert np.array_equal(atoms.cell[:], cell.lattice), fname
+        assert np.allclose(atoms.get_scaled_positions(wrap=False), cell.positions, rtol=0, atol=1e-12), fname
+        assert np.array_equal(atoms.numbers, cell.numbers), fname
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--nstructs", type=int, default=2000)
+    parser.add_argument("--natoms", type=int, nargs=2, default=[4, 64], help="range of atoms per structure")
+    parser.add_argument("--workdir", default="poscar_bench", help="where the POSCAR are generated")
+    parser.add_argument("--repeat", type=int, default=3, help="best of repeat runs per reader")
+    args = parser.parse_args()
+
+    gen = Path(args.workdir) / "gen"
+    if len(list(gen.glob("*.vasp"))) != args.nstructs:
+        write_poscar_dir(gen, args.nstructs, natoms=tuple(args.natoms))
+    fnames = sorted(gen.glob("*.vasp"))
+    check(fnames)
+
+    print(f"{len(fnames)} POSCAR of {args.natoms[0]}-{args.natoms[1]} atoms, best of {args.repeat}")
+    base = None
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for label, reader in READERS.items():
+            best = np.inf
+            for _ in range(args.repeat):
+                t0 = time.perf_counter()
+                for fname in fnames:
+                    reader(fname)
+                best = min(best, time.perf_counter() - t0)
+            latency = best / len(fnames) * 1e6
+            base = latency if base is None else base
+            print(f"{label:28s} {latency:9.1f} us/file  x{base / latency:5.1f} vs ase.io.read")
+
+
+if __name__ == "__main__":
+    main()
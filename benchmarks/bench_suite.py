@@ -0,0 +1,203 @@
+# benchmark every subcommand on synthetic datasets and append the results
+#
+#   python benchmarks/bench_suite.py --scale 1k 10k -j 8 --workdir /tmp/cdakit_bench
+#   python benchmarks/bench_suite.py --scale 1k --check   # exit 1 on a regression
+#
+# Datasets are generated once per scale under --workdir (see datasets.py) and
+# reused. Each case runs in a fresh interpreter through cdakit.api with
+# profile=True, so the peak RSS is that of the case alone. One JSON line per
+# case is appended to --results, with the git commit to compare runs.
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from datasets import write_outcar_tree, write_poscar_dir
+
+SCALES = {"1k": 1000, "10k": 10000, "100k": 100000}
+CASES = ["find_spg", "match_unique", "match_target", "parse_outcar", "standardize", "prepare_vasp"]
+
+
+def dataset(workdir: Path, kind: str, n: int) -> Path:
+    """Generate the dataset of kind and size n unless it is already there"""
+    root = workdir / f"{kind}_{n}"
+    marker = root / ".dataset.json"
+    params = {"kind": kind, "n": n, "seed": 0}
+    if marker.exists() and json.loads(marker.read_text()) == params:
+        return root
+    shutil.rmtree(root, ignore_errors=True)
+    t0 = time.perf_counter()
+    if kind == "outcar":
+        write_outcar_tree(root / "calc", n)
+    else:
+        write_poscar_dir(root / "gen", n, kind=kind)
+    marker.write_text(json.dumps(params))
+    print(f"generated {root} in {time.perf_counter() - t0:.1f} s", file=sys.stderr)
+    return root
+
+
+def task_latency(report: dict):
+    """mean seconds per task of the worker task stages, None if no task ran in a worker"""
+    seconds = calls = 0
+    for worker in report.get("workers", {}).values():
+        for name in worker["task_stages"]:
+            seconds += worker["stages"][name]["seconds"]
+            calls += worker["stages"][name]["calls"]
+    return seconds / calls if calls > 0 else None
+
+
+def run_case(case: str, root: Path, n: int, njobs: int) -> dict:
+    """Run one case in this process, return the measured numbers"""
+    from cdakit import api
+
+    gen = root / "gen"
+    report = None
+    t0 = time.perf_counter()
+    if case == "find_spg":
+        api.find_spg([gen], njobs=njobs, profile=True)
+        report = root / "find_spg.profile.json"
+    elif case == "match_unique":
+        api.match_structure(gen, unique=True, njobs=njobs, profile=True)
+        report = root / "match_structure.profile.json"
+    elif case == "match_target":
+        api.match_structure(gen, target=gen / "0.vasp", rematch=True, njobs=njobs, profile=True)
+        report = root / "match_structure.profile.json"
+    elif case == "parse_outcar":
+        api.parse_outcar(root / "calc", use_cache=False, njobs=njobs, profile=True)
+        report = root / "calc" / "parse_outcar.profile.json"
+    elif case == "standardize":
+        # the per-file outputs go next to the inputs, so they are copied to a scratch dir
+        scratch = root / "standardize"
+        shutil.rmtree(scratch, ignore_errors=True)
+        scratch.mkdir()
+        for fname in sorted(gen.glob("*.vasp"))[:n]:
+            shutil.copy(fname, scratch)
+        api.standardize([scratch], output=root / "standardize.extxyz", njobs=njobs, profile=True)
+        report = root / "standardize.extxyz" / "standardize.profile.json"
+    elif case == "prepare_vasp":
+        from pymatgen.core import SETTINGS
+        if SETTINGS.get("PMG_VASP_PSP_DIR") is None:
+            return {"skipped": "PMG_VASP_PSP_DIR is not set, POTCAR are needed"}
+        shutil.rmtree(root / "gen.scf", ignore_errors=True)
+        api.prepare_vasp(gen, njobs=njobs, profile=True)
+        report = root / "prepare_vasp.profile.json"
+    wall = time.perf_counter() - t0
+    result = {
+        "wall_seconds": wall,
+        "items_per_second": n / wall,
+        "latency_ms": wall / n * 1000,
+        "peak_rss_mb": {
+            "main": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+        },
+    }
+    if report is not None and report.exists():
+        report = json.loads(report.read_text())
+        latency = task_latency(report)
+        if latency is not None:
+            # time a worker spends on one item, the wall latency above is divided by njobs
+            result["latency_ms"] = latency * 1000
+        result["stages"] = {name: st["seconds"] for name, st in report["stages"].items()}
+        result["worker_stages"] = {name: st["seconds"] for name, st in report["worker_stages"].items()}
+    return result
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def previous(results: Path, record: dict):
+    """last comparable record in results: same case, size and njobs"""
+    if not results.exists():
+        return None
+    last = None
+    with open(results) as f:
+        for line in f:
+            old = json.loads(line)
+            if all(old.get(k) == record[k] for k in ("case", "n", "njobs", "host")) and "wall_seconds" in old:
+                last = old
+    return last
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--scale", nargs="+", default=["1k"], help=f"dataset sizes, {'/'.join(SCALES)} or a number")
+    parser.add_argument("--cases", nargs="+", default=CASES, choices=CASES)
+    parser.add_argument("-j", "--njobs", type=int, default=1)
+    parser.add_argument("--workdir", default="cdakit_bench", help="where datasets are generated and kept")
+    parser.add_argument("--results", default="bench_results.jsonl", help="JSON lines file the results are appended to")
+    parser.add_argument("--check", action="store_true", help="exit 1 if a case is slower than the previous comparable result")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="wall time ratio to the previous result counted as a regression")
+    parser.add_argument("-v", "--verbose", action="store_true", help="show the output of the cases, else only of failed ones")
+    parser.add_argument("--run-case", nargs=3, metavar=("CASE", "ROOT", "N"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case is not None:
+        case, root, n = args.run_case
+        print(json.dumps(run_case(case, Path(root), int(n), args.njobs)))
+        return
+
+    workdir = Path(args.workdir).resolve()
+    results = Path(args.results)
+    regressions = []
+    for scale in args.scale:
+        n = SCALES.get(scale, None) or int(scale)
+        for case in args.cases:
+            kind = {"parse_outcar": "outcar", "match_unique": "duplicates", "match_target": "duplicates"}.get(case, "mixed")
+            root = dataset(workdir, kind, n)
+            proc = subprocess.run(
+                [sys.executable, __file__, "-j", str(args.njobs), "--run-case", case, str(root), str(n)],
+                stdout=subprocess.PIPE, stderr=None if args.verbose else subprocess.PIPE, text=True,
+            )
+            record = {
+                "case": case,
+                "scale": scale,
+                "n": n,
+                "njobs": args.njobs,
+                "commit": git_commit(),
+                "host": platform.node(),
+                "python": platform.python_version(),
+                "cpus": os.cpu_count(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            }
+            if proc.returncode != 0:
+                record["error"] = f"exit code {proc.returncode}"
+                if not args.verbose:
+                    print(proc.stderr, file=sys.stderr)
+            else:
+                record.update(json.loads(proc.stdout.strip().splitlines()[-1]))
+            last = previous(results, record)
+            with open(results, "a") as f:
+                f.write(json.dumps(record) + "\n")
+
+            if "wall_seconds" not in record:
+                print(f"{case:14s} {n:>7d}  {record.get('skipped', record.get('error'))}")
+                continue
+            ratio = record["wall_seconds"] / last["wall_seconds"] if last is not None else None
+            print(
+                f"{case:14s} {n:>7d} {record['wall_seconds']:9.2f} s {record['items_per_second']:10.1f} items/s"
+                f" {record['latency_ms']:9.3f} ms/item {record['peak_rss_mb']['main'] + record['peak_rss_mb']['children']:8.0f} MiB"
+                + ("" if ratio is None else f"  x{ratio:.2f} vs {last['commit']}")
+            )
+            if ratio is not None and ratio > args.tolerance:
+                regressions.append(f"{case} n={n}: x{ratio:.2f} vs {last['commit']}")
+    if args.check and regressions:
+        print("regressions:\n  " + "\n  ".join(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
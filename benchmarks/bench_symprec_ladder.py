@@ -0,0 +1,94 @@
+# benchmark the symprec ladder of cdakit.symmetry against independent spglib calls
+#
+#   python benchmarks/bench_symprec_ladder.py --nstructs 500 --natoms 32 --symprec 0.5 0.1 0.01 0.001
+
+import argparse
+import time
+
+import numpy as np
+import spglib
+
+from cdakit.symmetry import _dataset_cache, std_cell, symmetry_ladder
+
+
+def fake_cells(nstructs, natoms, seed=0):
+    """half perturbed fcc supercells (symmetric at loose symprec), half random P1 cells"""
+    rng = np.random.default_rng(seed)
+    ncell = max(1, round((natoms / 4) ** (1 / 3)))
+    base = np.array([[0, 0, 0], [0.5, 0.5, 0], [0.5, 0, 0.5], [0, 0.5, 0.5]])
+    grid = np.stack(np.meshgrid(*[np.arange(ncell)] * 3, indexing="ij"), -1).reshape(-1, 1, 3)
+    fcc = ((grid + base) / ncell).reshape(-1, 3)
+    cells = []
+    for i in range(nstructs):
+        if i % 2 == 0:
+            lattice = np.eye(3) * 3.6 * ncell
+            positions = fcc + rng.normal(0, 10 ** rng.uniform(-4, -1.5), fcc.shape)
+        else:
+            lattice = np.eye(3) * 3.6 * ncell + rng.normal(0, 0.3, (3, 3))
+            positions = rng.random((len(fcc), 3))
+        cells.append((lattice, positions % 1.0, np.full(len(fcc), 6)))
+    return cells
+
+
+def legacy_find_spg(cells, symprec_list, angle_tolerance):
+    return [{symprec: spglib.get_symmetry_dataset(cell, symprec, angle_tolerance) for symprec in symprec_list} for cell in cells]
+
+
+def legacy_standardize(cells, symprec_list):
+    for cell in cells:
+        for symprec in symprec_list:
+            spglib.standardize_cell(cell, False, symprec=symprec)
+            spglib.standardize_cell(cell, True, symprec=symprec)
+
+
+def ladder_find_spg(cells, symprec_list, angle_tolerance, short_circuit=False):
+    return [symmetry_ladder(cell, symprec_list, angle_tolerance, short_circuit) for cell in cells]
+
+
+def ladder_standardize(cells, symprec_list, short_circuit=False):
+    for cell in cells:
+        for symds in symmetry_ladder(cell, symprec_list, -1.0, short_circuit).values():
+            if symds is not None:
+                std_cell(symds, False)
+                std_cell(symds, True)
+
+
+def timeit(func, *args):
+    t0 = time.perf_counter()
+    ret = func(*args)
+    return time.perf_counter() - t0, ret
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--nstructs", type=int, default=500)
+    parser.add_argument("--natoms", type=int, default=32)
+    parser.add_argument("-s", "--symprec", type=float, nargs="+", default=[0.5, 0.1, 0.01, 0.001])
+    args = parser.parse_args()
+
+    cells = fake_cells(args.nstructs, args.natoms)
+    timings = []
+    timings.append(("find_spg spglib", timeit(legacy_find_spg, cells, args.symprec, 10)[0]))
+    t, exact = timeit(ladder_find_spg, cells, args.symprec, 10)
+    timings.append(("find_spg ladder", t))
+    timings.append(("find_spg ladder (memo hit)", timeit(ladder_find_spg, cells, args.symprec, 10)[0]))
+    _dataset_cache.clear()
+    t, short = timeit(ladder_find_spg, cells, args.symprec, 10, True)
+    timings.append(("find_spg ladder --short-circuit", t))
+    timings.append(("standardize spglib", timeit(legacy_standardize, cells, args.symprec)[0]))
+    _dataset_cache.clear()
+    timings.append(("standardize ladder", timeit(ladder_standardize, cells, args.symprec)[0]))
+
+    ndiff = sum(
+        (e[s] is None) != (c[s] is None) or (e[s] is not None and e[s].number != c[s].number)
+        for e, c in zip(exact, short)
+        for s in args.symprec
+    )
+    print(f"{len(cells)} structures, {args.natoms} atoms, symprec {args.symprec}")
+    for label, t in timings:
+        print(f"{label:32s} {t:8.3f} s {len(cells) / t:10.1f} structs/s")
+    print(f"--short-circuit changed {ndiff} of {len(cells) * len(args.symprec)} space groups")
+
+
+if __name__ == "__main__":
+    main()
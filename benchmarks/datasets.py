@@ -0,0 +1,126 @@
+# synthetic, reproducible datasets for the benchmarks, no network or VASP needed
+#
+# Every generator is seeded, the same arguments give byte-identical files.
+
+from pathlib import Path
+
+import numpy as np
+from ase.build import bulk
+
+from bench_parse_outcar import fake_step
+
+# prototype builders of known space groups
+PROTOTYPES = {
+    "fcc": lambda: bulk("Cu", "fcc", a=3.6, cubic=True),  # Fm-3m
+    "bcc": lambda: bulk("Fe", "bcc", a=2.87, cubic=True),  # Im-3m
+    "hcp": lambda: bulk("Mg", "hcp", a=3.21, c=5.21),  # P6_3/mmc
+    "diamond": lambda: bulk("Si", "diamond", a=5.43, cubic=True),  # Fd-3m
+    "rocksalt": lambda: bulk("NaCl", "rocksalt", a=5.64, cubic=True),  # Fm-3m
+    "cscl": lambda: bulk("CsCl", "cesiumchloride", a=4.12),  # Pm-3m
+}
+
+
+def poscar_str(symbols, lattice, scaled_positions, comment="synthetic"):
+    """POSCAR text with species grouped, as written by VASP"""
+    symbols = np.asarray(symbols)
+    order = np.argsort(symbols, kind="stable")
+    species, counts = np.unique(symbols[order], return_counts=True)
+    lines = [comment, "1.0"]
+    lines += [" ".join(f"{x:.10f}" for x in row) for row in lattice]
+    lines += [" ".join(species), " ".join(map(str, counts)), "Direct"]
+    lines += [" ".join(f"{x:.10f}" for x in row) for row in np.asarray(scaled_positions)[order]]
+    return "\n".join(lines) + "\n"
+
+
+def random_structure(rng, natoms, species=("Si", "O"), vpa=12.0):
+    """P1 cell, random lattice around the volume of vpa per atom and random sites"""
+    a = (natoms * vpa) ** (1 / 3)
+    lattice = np.eye(3) * a + rng.normal(0, 0.15 * a, (3, 3))
+    lattice *= (natoms * vpa / abs(np.linalg.det(lattice))) ** (1 / 3)
+    symbols = rng.choice(species, natoms)
+    return symbols, lattice, rng.random((natoms, 3))
+
+
+def symmetric_structure(rng, max_natoms=64, noise=1e-3):
+    """A prototype of known space group in a random supercell, slightly perturbed"""
+    atoms = PROTOTYPES[rng.choice(sorted(PROTOTYPES))]()
+    reps = [1, 1, 1]
+    while len(atoms) * np.prod(reps) * 2 <= max_natoms and rng.random() < 0.6:
+        reps[rng.integers(3)] += 1
+    atoms = atoms.repeat(reps)
+    lattice = atoms.cell[:]
+    cart = atoms.positions + rng.normal(0, noise, atoms.positions.shape)
+    return np.array(atoms.get_chemical_symbols()), lattice, np.linalg.solve(lattice.T, cart.T).T % 1.0
+
+
+def rotation(rng):
+    q, r = np.linalg.qr(rng.normal(size=(3, 3)))
+    q *= np.sign(np.diag(r))
+    return q if np.linalg.det(q) > 0 else -q
+
+
+def duplicate(rng, structure, noise=0.01):
+    """Same structure in another setting: rotated, shifted, permuted and perturbed"""
+    symbols, lattice, scaled = structure
+    perm = rng.permutation(len(symbols))
+    lattice = lattice @ rotation(rng).T
+    scaled = (scaled[perm] + rng.random(3)) % 1.0
+    scaled = scaled + np.linalg.solve(lattice.T, rng.normal(0, noise, scaled.shape).T).T
+    return symbols[perm], lattice, scaled % 1.0
+
+
+def write_poscar_dir(outdir, n, kind="mixed", natoms=(4, 32), nbase=None, seed=0):
+    """Write n POSCAR as <outdir>/<i>.vasp
+
+    kind is "random" (P1), "symmetric" (perturbed prototypes), "mixed" (half
+    each) or "duplicates" (perturbed copies of nbase mixed structures, for
+    match_structure).
+    """
+    rng = np.random.default_rng(seed)
+    outdir = Path(outdir)
+    outdir.mkdir(parents=True, exist_ok=True)
+
+    def one(i):
+        if kind == "random" or (kind == "mixed" and i % 2 == 1):
+            return random_structure(rng, int(rng.integers(natoms[0], natoms[1] + 1)))
+        return symmetric_structure(rng, max_natoms=natoms[1])
+
+    if kind == "duplicates":
+        nbase = nbase or max(1, n // 10)
+        bases = [one(i) for i in range(nbase)]
+        structures = (duplicate(rng, bases[rng.integers(nbase)]) for _ in range(n))
+    else:
+        structures = (one(i) for i in range(n))
+    for i, (symbols, lattice, scaled) in enumerate(structures):
+        with open(outdir / f"{i}.vasp", "w") as f:
+            f.write(poscar_str(symbols, lattice, scaled, comment=f"{kind} {i}"))
+    return outdir
+
+
+def write_outcar_tree(outdir, n, nsteps=5, natoms=8, seed=0):
+    """Write n task dirs <outdir>/<i>/ with a converged OUTCAR of nsteps and its CONTCAR"""
+    rng = np.random.default_rng(seed)
+    outdir = Path(outdir)
+    for i in range(n):
+        taskdir = outdir / str(i)
+        taskdir.mkdir(parents=True, exist_ok=True)
+        lattice = np.eye(3) * (natoms * 12.0) ** (1 / 3)
+        with open(taskdir / "OUTCAR", "w") as f:
+            f.write(
+                " vasp.6.3.0 18Jan22 (build Feb 23 2022 13:08:53) complex\n"
+                f"   number of dos      NEDOS =    301   number of ions     NIONS = {natoms:6d}\n"
+                f"  volume of cell :   {np.linalg.det(lattice):10.2f}\n"
+                "      direct lattice vectors                 reciprocal lattice vectors\n"
+                + "".join("  " + "".join(f"{x:13.9f}" for x in row) * 2 + "\n" for row in lattice)
+            )
+            for _ in range(nsteps):
+                lattice = lattice + rng.normal(0, 0.01, (3, 3))
+                f.write(fake_step(rng, natoms, lattice, pstress=10))
+            f.write(
+                " reached required accuracy - stopping structural energy minimisation\n"
+                "                  Total CPU time used (sec):      123.456\n"
+            )
+        symbols = rng.choice(["Si", "O"], natoms)
+        with open(taskdir / "CONTCAR", "w") as f:
+            f.write(poscar_str(symbols, lattice, rng.random((natoms, 3))))
+    return outdir
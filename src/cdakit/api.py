@@ -0,0 +1,68 @@
+# subcommands as a Python API, run in the calling process
+#
+#   from cdakit import api
+#   api.find_spg(["gen"], njobs=4)
+#   api.run("parse_outcar", indir="calc", summary_only=True)
+#
+# Arguments not given take the defaults of the command line. Logs of the call
+# and its workers go through a queue to a listener thread, as `cdakit --exec
+# inprocess` does, so profile=True reports the worker timings too.
+
+import argparse
+import multiprocessing
+
+from cdakit.log import threaded_loglistener
+from cdakit.subcommands import SUBCOMMANDS
+
+GLOBAL_DEFAULTS = {"njobs": 1, "verbose": 0, "profile": False, "profiler": None}
+
+
+def get_defaults(subcommand: str) -> dict:
+    """defaults of the arguments of subcommand as declared for the command line"""
+    subparsers = argparse.ArgumentParser().add_subparsers()
+    SUBCOMMANDS[subcommand](subparsers)
+    subparser = subparsers.choices[subcommand]
+    defaults = dict(GLOBAL_DEFAULTS)
+    for action in subparser._actions:
+        if action.default is not argparse.SUPPRESS and not action.required:
+            defaults[action.dest] = action.default
+    defaults.update(subparser._defaults)
+    return defaults
+
+
+def run(subcommand: str, **kwargs):
+    """Run subcommand in this process and return what it returns"""
+    if subcommand not in SUBCOMMANDS:
+        raise KeyError(f"unknown subcommand '{subcommand}', choose from {list(SUBCOMMANDS)}")
+    kwargs = {**get_defaults(subcommand), **kwargs}
+    verbose = kwargs.pop("verbose")
+    logconf = {"level": 20 - 10 * verbose, "profile": kwargs.pop("profile"), "profiler": kwargs.pop("profiler")}
+    kwargs.setdefault("logconf", logconf)
+    if "logqueue" in kwargs:
+        return kwargs["func"](**kwargs)
+    kwargs["logqueue"] = multiprocessing.Queue(-1)
+    listener = threaded_loglistener(kwargs["logqueue"])
+    try:
+        return kwargs["func"](**kwargs)
+    finally:
+        listener.stop()
+
+
+def _bind(subcommand: str, *positionals: str):
+    def func(*args, **kwargs):
+        kwargs.update(zip(positionals, args))
+        return run(subcommand, **kwargs)
+    func.__name__ = subcommand
+    func.__doc__ = f"Run {subcommand} in this process, positional arguments are {', '.join(positionals)}"
+    return func
+
+
+find_spg = _bind("find_spg", "indirs")
+landscape = _bind("landscape", "outcar")
+match_structure = _bind("match_structure", "indir")
+pack = _bind("pack", "indir")
+parse_outcar = _bind("parse_outcar", "indir")
+prepare_calypso = _bind("prepare_calypso", "indir")
+prepare_vasp = _bind("prepare_vasp", "indir")
+standardize = _bind("standardize", "paths")
+unpack = _bind("unpack", "store")
@@ -1,116 +1,240 @@
 # find the symmetry and standardlized cell of a given dir
-
-import argparse
-import io
+#
+# Each structure gets a fingerprint at the tightest symprec: space group,
+# Wyckoff orbits, reduced formula and volume per atom, plus a digest of its rounded
+# standardized cell. Once a dir is done, structures with the fingerprint and
+# digest of an earlier one (by name) are marked duplicate_of it. The others with
+# a space group other than P1 at some symprec are written to
+# sympart/spg_<number>/gen, number at the tightest symprec finding one.
+
+import hashlib
+import logging
+import multiprocessing
+import os
 import subprocess
 import sys
-import shutil
-from contextlib import redirect_stdout
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
-import spglib
 from ase import Atoms
-from ase.io import read, write
-from joblib import Parallel, delayed
+from ase.io import write
+from joblib import effective_n_jobs
 from tqdm import tqdm
 
-from cdakit.iotools import to_format_table
+from cdakit.iotools import natural_order, write_format_table
 from cdakit.log import logit
+from cdakit.poscar import Cell
+from cdakit.profiling import profiled, set_report, stage
+from cdakit.store import copy_vasp, glob_vasp, read_cell
+from cdakit.symmetry import std_cell, std_digest, symmetry_ladder, wyckoff_sequence
+
+logger = logging.getLogger(__name__)
+
+VPA_DECIMALS = 2
+
+
+def get_std_dir(indir, prec: str):
+    return Path(indir).with_name(f"std_{prec}")
+
+
+def get_sympart_dir(indir):
+    return Path(indir).parent.joinpath("sympart")
 
 
-def atoms2cif(atoms):
-    with io.BytesIO() as buffer, redirect_stdout(buffer):
-        write('-', atoms, format='cif')
-        cif = buffer.getvalue().decode()  # byte to string
-    return cif
+def get_shard_dir(sympart, spg):
+    return Path(sympart).joinpath(f"spg_{spg}", "gen")
 
 
-def atoms2vasp(atoms):
-    with io.StringIO() as buffer, redirect_stdout(buffer):
-        write('-', atoms, format='vasp')
-        vasp = buffer.getvalue()  # byte to string
-    return vasp
+def get_spg_cells(cell, symprec_list, angle_tolerance=10, short_circuit=False):
+    """Symmetry datasets and standardized cells of the spglib cell under each symprec
 
+    Returns
+    -------
+    dict
+        {symprec: (symds, (std_lattice, std_positions, std_types))}, symds
+        and the cell are None if spglib cannot find the symmetry
+    """
+    datasets = symmetry_ladder(cell, symprec_list, angle_tolerance, short_circuit)
+    return {symprec: (None, None) if symds is None else (symds, std_cell(symds)) for symprec, symds in datasets.items()}
 
-def get_spg_one(name: Path, atoms, symprec_list, angle_tolerance=10):
+
+def get_spg_one(name: Path, cell: Cell, symprec_list, angle_tolerance=10, write_std=True, write_cif=False, short_circuit=False):
     spg_dict = {
         "name": name.name,
-        "formula": atoms.get_chemical_formula("metal"),
+        "formula": cell.formula,
     }
-    cell = (atoms.cell[:], atoms.get_scaled_positions(), atoms.get_atomic_numbers())
-    for symprec in symprec_list:
-        symds = spglib.get_symmetry_dataset(cell, symprec, angle_tolerance)
+    with stage("spglib"):
+        cells = get_spg_cells(cell, symprec_list, angle_tolerance, short_circuit)
+    for symprec, (symds, stdcell) in cells.items():
+        prec = "{:.0e}".format(symprec)
         # ---- record
         if symds is not None:
-            std_atoms = Atoms(
-                symds["std_types"],
-                cell=symds["std_lattice"],
-                scaled_positions=symds["std_positions"],
-            )
-            spg_dict["{:.0e}".format(symprec)] = symds['number']
-            spg_dict["{:.0e}".format(symprec) + "_symbol"] = symds['international']
-            spg_dict["{:.0e}".format(symprec) + "_std_natoms"] = len(symds['std_types'])
-            spg_dict["{:.0e}".format(symprec) + "_std_cif"] = atoms2cif(std_atoms)
-            spg_dict["{:.0e}".format(symprec) + "_std_vasp"] = atoms2vasp(std_atoms)
+            std_atoms = Atoms(stdcell[2], cell=stdcell[0], scaled_positions=stdcell[1])
+            spg_dict[prec] = symds.number
+            spg_dict[prec + "_symbol"] = symds.international
+            spg_dict[prec + "_std_natoms"] = len(stdcell[2])
         else:
             print(name, symprec, "Cannot find symmetry", file=sys.stderr)
-            spg_dict["{:.0e}".format(symprec)] = 0
-            spg_dict["{:.0e}".format(symprec) + "_symbol"] = "-"
-            spg_dict["{:.0e}".format(symprec) + "_std_natoms"] = 0
-            spg_dict["{:.0e}".format(symprec) + "_std_cif"] = atoms2cif(atoms)
-            spg_dict["{:.0e}".format(symprec) + "_std_vasp"] = atoms2vasp(atoms)
-    # ---- filter P1
-    if any(spg_dict["{:.0e}".format(symprec)] > 1 for symprec in symprec_list):
-        sympart = name.parent.parent.joinpath("sympart/gen")
-        sympart.mkdir(exist_ok=True, parents=True)
-        shutil.copy(name, sympart / name.name)
+            std_atoms = cell.to_atoms()
+            spg_dict[prec] = 0
+            spg_dict[prec + "_symbol"] = "-"
+            spg_dict[prec + "_std_natoms"] = 0
+        # ---- write std cell directly, nothing is carried back to the parent
+        with stage("write_std"):
+            if write_std:
+                write(get_std_dir(name.parent, prec) / name.name, std_atoms, format="vasp")
+            if write_cif:
+                write(get_std_dir(name.parent, prec) / (name.stem + ".cif"), std_atoms, format="cif")
+    spg_dict.update(fingerprint(cell, cells))
     return pd.Series(spg_dict)
 
 
-def get_spg_df(fdir, symprec_list=(0.5, 0.1, 0.01)):
-    flist = list(Path(fdir).glob("*.vasp"))
+def fingerprint(cell: Cell, cells) -> dict:
+    """fp_* columns and fingerprint from the datasets of get_spg_cells
+
+    Taken at the tightest symprec, so structures only close to each other
+    within a looser one are not taken as the same, "-" if spglib fails there.
+    """
+    symds, stdcell = cells[min(cells)]
+    if symds is None:
+        return {"fp_spg": 0, "fp_wyckoffs": "-", "fp_vpa": np.nan, "fp_std": "-", "fingerprint": "-"}
+    formula = cell.reduced_formula  # a supercell has the key of its primitive cell
+    wyckoffs = wyckoff_sequence(symds, cell.numbers)
+    vpa = round(abs(np.linalg.det(cell.lattice)) / len(cell.numbers), VPA_DECIMALS)
+    key = f"{formula}|{symds.number}|{wyckoffs}|{vpa:.{VPA_DECIMALS}f}"
+    return {
+        "fp_spg": symds.number,
+        "fp_wyckoffs": wyckoffs,
+        "fp_vpa": vpa,
+        "fp_std": std_digest(stdcell)[:16],
+        "fingerprint": hashlib.sha1(key.encode()).hexdigest()[:16],
+    }
+
+
+def mark_duplicates(df) -> pd.DataFrame:
+    """duplicate_of, the first structure by name with the same fingerprint and fp_std, "-" for the first"""
+    ordered = df.iloc[natural_order(pd.Index(df["name"].str.removesuffix(".vasp")))]
+    first = ordered["name"].groupby([ordered["fingerprint"], ordered["fp_std"]], sort=False).transform("first")
+    duplicate = (first != ordered["name"]) & (ordered["fingerprint"] != "-")
+    return df.assign(duplicate_of=first.where(duplicate, "-").reindex(df.index))
+
+
+def get_manifest(sympart, fdir):
+    """file listing the shard files written from fdir by the last run"""
+    return Path(sympart).joinpath(f".{Path(fdir).name}.written")
+
+
+def read_manifest(fmanifest) -> set:
+    if not fmanifest.exists():
+        return set()
+    return set(fmanifest.read_text().split())
+
+
+def write_sympart(fdir, df, symprec_list):
+    """Write the distinct structures with symmetry to sympart/spg_<number>/gen
+
+    Each file is written to a temporary name and moved in place. The files
+    written from fdir are listed in sympart/.<name of fdir>.written, those
+    of the previous run not written again (now in another shard, duplicates
+    or P1) are removed unless another dir sharing sympart lists them.
+    """
+    sympart = get_sympart_dir(fdir)
+    shard_spg = pd.Series(0, index=df.index)
+    for symprec in sorted(symprec_list, reverse=True):
+        spg = df["{:.0e}".format(symprec)]
+        shard_spg = shard_spg.where(spg <= 1, spg)
+    keep = df[(shard_spg > 1) & (df["duplicate_of"] == "-")]
+    shard_spg = shard_spg[keep.index]
+    written = set()
+    for name, spg in zip(keep["name"], shard_spg):
+        shard = get_shard_dir(sympart, spg)
+        shard.mkdir(exist_ok=True, parents=True)
+        ftmp = shard / f".{name}.{os.getpid()}.tmp"
+        copy_vasp(Path(fdir) / name, ftmp)
+        os.replace(ftmp, shard / name)
+        written.add(str((shard / name).relative_to(sympart)))
+    sympart.mkdir(exist_ok=True)
+    fmanifest = get_manifest(sympart, fdir)
+    stale = read_manifest(fmanifest) - written
+    for fother in sympart.glob(".*.written"):
+        if fother != fmanifest:
+            stale -= read_manifest(fother)
+    for fname in stale:
+        sympart.joinpath(fname).unlink(missing_ok=True)
+    ftmp = fmanifest.with_name(f"{fmanifest.name}.{os.getpid()}.tmp")
+    ftmp.write_text("".join(f"{fname}\n" for fname in sorted(written)))
+    os.replace(ftmp, fmanifest)
+    nduplicate = (df["duplicate_of"] != "-").sum()
+    logger.info(f"{fdir}: {len(keep)} distinct structures with symmetry in {shard_spg.nunique()} shards of {sympart}, {nduplicate} duplicates dropped")
+
+
+@profiled("spg_one")
+def get_spg_one_file(args):
+    """pool worker, read the file here so parsing is parallel and no cell is pickled"""
+    key, fname, symprec_list, write_std, write_cif, short_circuit = args
+    with stage("read"):
+        cell = read_cell(fname)
+    return key, get_spg_one(fname, cell, symprec_list, write_std=write_std, write_cif=write_cif, short_circuit=short_circuit)
+
+
+def get_spg_dfs(fdirs, symprec_list=(0.5, 0.1, 0.01), write_std=True, write_cif=False, short_circuit=False, njobs=1, chunksize=16):
+    """Symmetry tables of several dirs from one shared pool
+
+    Yields (fdir, df) as soon as every file of fdir is done, only the
+    records of unfinished dirs are kept in memory.
+    """
     symprec_list = sorted(symprec_list, reverse=True)
-    ser_list = Parallel(-1, backend="multiprocessing")(
-        delayed(get_spg_one)(f, read(f), symprec_list)
-        for f in tqdm(flist, ncols=180, desc=f"{fdir}")
+    with stage("discover"):
+        flists = [glob_vasp(fdir) for fdir in fdirs]
+    for fdir in fdirs:
+        if write_std or write_cif:
+            for symprec in symprec_list:
+                get_std_dir(fdir, "{:.0e}".format(symprec)).mkdir(exist_ok=True)
+    ser_dicts = {idir: {} for idir in range(len(fdirs))}
+    for idir, flist in enumerate(flists):
+        if len(flist) == 0:
+            # written all the same, the shards of its previous run are removed
+            df = spg_df(fdirs[idir], [], symprec_list)
+            with stage("write_sympart", items=0):
+                write_sympart(fdirs[idir], df, symprec_list)
+            yield fdirs[idir], df
+            del ser_dicts[idir]
+    tasks = (
+        ((idir, i), f, symprec_list, write_std, write_cif, short_circuit)
+        for idir, flist in enumerate(flists)
+        for i, f in enumerate(flist)
     )
+    ntasks = sum(map(len, flists))
+    with multiprocessing.Pool(min(effective_n_jobs(njobs), max(ntasks, 1))) as pool:
+        # results stream back as each chunk finishes, keyed by (dir, position in the dir)
+        for (idir, i), ser in tqdm(pool.imap_unordered(get_spg_one_file, tasks, chunksize=chunksize), total=ntasks, ncols=180):
+            ser_dicts[idir][i] = ser
+            if len(ser_dicts[idir]) == len(flists[idir]):
+                ser_dict = ser_dicts.pop(idir)
+                df = mark_duplicates(spg_df(fdirs[idir], [ser_dict[i] for i in range(len(ser_dict))], symprec_list))
+                with stage("write_sympart", items=len(df)):
+                    write_sympart(fdirs[idir], df, symprec_list)
+                yield fdirs[idir], df
+
+
+def spg_df(fdir, ser_list, symprec_list):
     df = pd.DataFrame(ser_list)
-    df = df.sort_values(by=list(map("{:.0e}".format, symprec_list)), ascending=False)
-    return df
+    if len(df) == 0:
+        print(fdir, "No *.vasp found", file=sys.stderr)
+        return pd.DataFrame(columns=["name", *map("{:.0e}".format, symprec_list), "duplicate_of"])
+    return df.sort_values(by=list(map("{:.0e}".format, symprec_list)), ascending=False)
 
 
-def write_std_vasp(df: pd.DataFrame, indir):
-    cols = [col for col in df if col.endswith("_std_vasp")]
-    prec_list = [col[:-9] for col in cols]
-    for prec in prec_list:
-        prec_dir = Path(indir).with_name(f"std_{prec}")
-        prec_dir.mkdir(exist_ok=True)
-        for _, ser in df.iterrows():
-            with open(prec_dir / Path(ser['name']).name, "w") as fvasp:
-                fvasp.write(ser[prec + "_std_vasp"])
+def get_spg_df(fdir, symprec_list=(0.5, 0.1, 0.01), write_std=True, write_cif=False, short_circuit=False, njobs=1, chunksize=16):
+    for _, df in get_spg_dfs([fdir], symprec_list, write_std, write_cif, short_circuit, njobs, chunksize):
+        return df
 
 
 @logit()
-def find_spg(indirs, symprec, **kwargs):
-    spgdfdict = {}
-    for indir in indirs:
-        df = get_spg_df(indir, symprec)
-        table = to_format_table(
-            df[[col for col in df if not col.endswith(("_std_cif", "_std_vasp"))]]
-        )
-        with open(Path(indir).with_name("spg.txt"), 'w') as f:
-            f.write(table)
-        write_std_vasp(df, indir)
-        spgdfdict[Path(indir).parent.name] = df
-
-
-def add_subparser(subparsers):
-    subparser = subparsers.add_parser(
-        __name__.split(".")[-1],
-        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
-    )
-    subparser.set_defaults(func=find_spg)
-    subparser.add_argument("indirs", nargs="*", help="directiries containing *.vasp")
-    subparser.add_argument("-s", "--symprec", type=float, default=[0.5, 0.1, 0.01], nargs=-1, help="symprec, only one significant digits is kept")
-
+def find_spg(indirs, symprec, write_std=True, write_cif=False, short_circuit=False, njobs=1, chunksize=16, **kwargs):
+    if len(indirs) > 0:
+        set_report(Path(os.path.commonpath([Path(indir).resolve().parent for indir in indirs])) / "find_spg.profile.json")
+    for indir, df in get_spg_dfs(indirs, symprec, write_std, write_cif, short_circuit, njobs, chunksize):
+        with stage("write_table"):
+            write_format_table(df, Path(indir).with_name("spg.txt"))
@@ -1,25 +1,141 @@
-import subprocess
+import hashlib
+import logging
+import os
+from pathlib import Path
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+
+logger = logging.getLogger(__name__)
+
+TABLE_SEP = "  "
+
+
+def _format_column(ser: pd.Series, float_format="%.6f", na_rep="NaN") -> np.ndarray:
+    """cells of a column as to_csv(sep=" ") would write them, one token each"""
+    na = ser.isna().to_numpy()
+    if pd.api.types.is_float_dtype(ser.dtype):
+        cells = np.char.mod(float_format, ser.to_numpy(dtype=float, na_value=np.nan))
+    else:
+        cells = ser.astype(str).to_numpy(dtype=object).astype(str)
+        # keep empty cells and cells with blanks as one token, as to_csv quotes them
+        blank = (np.char.find(cells, " ") >= 0) | (np.char.str_len(cells) == 0)
+        if blank.any():
+            cells = np.where(blank, np.char.add(np.char.add('"', cells), '"'), cells)
+    return np.where(na, na_rep, cells)
+
+
+def iter_format_table(df: pd.DataFrame, index_label="index", float_format="%.6f", na_rep="NaN", chunk_rows=10000):
+    """Lines of the fixed-width table, same layout as `to_csv | column -t`
+
+    Columns are formatted once, vectorized, the lines are then produced
+    chunk by chunk so the whole table never sits in memory as one string.
+    """
+    header = [str(index_label)] + [str(c) for c in df.columns]
+    columns = [_format_column(df.index.to_series(), float_format, na_rep)]
+    columns += [_format_column(df.iloc[:, i], float_format, na_rep) for i in range(df.shape[1])]
+    widths = [max([len(h)] + ([int(np.char.str_len(c).max())] if len(c) else [])) for h, c in zip(header, columns)]
+    # the last column is not padded, as column -t does
+    pads = widths[:-1] + [0]
+    yield TABLE_SEP.join(h.ljust(w) for h, w in zip(header, pads)).rstrip() + "\n"
+    for start in range(0, len(df), chunk_rows):
+        padded = [np.char.ljust(c[start:start + chunk_rows], w) for c, w in zip(columns, pads)]
+        yield "".join(TABLE_SEP.join(row).rstrip() + "\n" for row in zip(*padded))
 
 
 def to_format_table(df: pd.DataFrame, index_label="index"):
-    csv_str = df.to_csv(
-        None, sep=" ", float_format="%.6f", na_rep="NaN", index_label=index_label
-    )
-    fmt_proc = subprocess.Popen(
-        ['column', '-t'],
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        universal_newlines=True,
-    )
-    table_str, _ = fmt_proc.communicate(csv_str)
-    return table_str
+    return "".join(iter_format_table(df, index_label))
+
+
+def _sidecar(ftable) -> Path:
+    ftable = Path(ftable)
+    return ftable.with_name(f".{ftable.name}.arrow")
+
+
+def write_format_table(df: pd.DataFrame, ftable, index_label="index", sidecar=True, chunk_rows=10000):
+    """Stream the fixed-width table to ftable, plus a typed Arrow sidecar
+
+    The sidecar `.<ftable>.arrow` keeps the dtypes and is read back by
+    read_format_table while the stamp of the text table is unchanged.
+    """
+    ftable = Path(ftable)
+    with open(ftable, "w") as f:
+        f.writelines(iter_format_table(df, index_label, chunk_rows=chunk_rows))
+    fsidecar = _sidecar(ftable)
+    if not sidecar:
+        fsidecar.unlink(missing_ok=True)
+        return
+    try:
+        table = pa.Table.from_pandas(df.rename_axis(index_label).reset_index(), preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as e:
+        logger.debug(f"no arrow sidecar for {ftable}: {e}")
+        fsidecar.unlink(missing_ok=True)
+        return
+    meta = dict(table.schema.metadata or {})
+    meta[b"cdakit.table_stamp"] = file_stamp(ftable).encode()
+    meta[b"cdakit.index_label"] = str(index_label).encode()
+    ftmp = fsidecar.with_name(f"{fsidecar.name}.{os.getpid()}.tmp")
+    feather.write_feather(table.replace_schema_metadata(meta), ftmp)
+    os.replace(ftmp, fsidecar)
 
 
 def read_format_table(ftable):
+    fsidecar = _sidecar(ftable)
+    if fsidecar.exists():
+        table = feather.read_table(fsidecar)
+        meta = table.schema.metadata or {}
+        if meta.get(b"cdakit.table_stamp", b"").decode() == file_stamp(ftable):
+            df = table.to_pandas()
+            index_label = meta[b"cdakit.index_label"].decode()
+            if index_label == "index" and "index" in df.columns:
+                df = df.set_index("index")
+            return df
+        logger.debug(f"{fsidecar} is stale, reading {ftable}")
     df = pd.read_table(ftable, sep=r"\s+", index_col=None)
     if "index" in df.columns:
         df = df.set_index("index")
     return df
 
+
+def index_to_stems(index: pd.Index) -> pd.Index:
+    """Structure names of a table index
+
+    Rows of match tables are keyed by the stem of *.vasp (int or str), rows of
+    parsed_outcar.table by <stem>/OUTCAR or <stem>.OUTCAR as the task dirs
+    written here.
+    """
+    index = pd.Index(index.astype(str), dtype=object)
+    name = index.str.rsplit("/", n=1).str[-1]
+    parent = index.str.rsplit("/", n=2).str[-2]
+    stems = np.where(
+        name == "OUTCAR", parent,
+        np.where(name.str.endswith(".OUTCAR"), name.str[:-len(".OUTCAR")],
+                 np.where(name.str.endswith(".vasp"), name.str[:-len(".vasp")], name)),
+    )
+    return pd.Index(stems, dtype=object)
+
+
+def natural_order(names: pd.Index) -> np.ndarray:
+    """positions sorting names numerically first (0, 1, 2, ..., 10), then the others alphabetically"""
+    names = names.astype(str)
+    numbers = pd.to_numeric(pd.Series(names, dtype=object).where(names.str.isdigit()), errors="coerce").to_numpy()
+    return np.lexsort((names.to_numpy(dtype=str), np.nan_to_num(numbers, nan=0), np.isnan(numbers)))
+
+
+def file_stamp(fname: Path, use_hash=False, stat=None) -> str:
+    """sha1 of the content if ``use_hash`` else '<size>-<mtime_ns>'
+
+    ``stat`` may be passed if the file is already stat-ed, e.g. by scandir
+    """
+    if use_hash:
+        sha1 = hashlib.sha1()
+        with open(fname, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha1.update(chunk)
+        return sha1.hexdigest()
+    if stat is None:
+        stat = Path(fname).stat()
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
@@ -0,0 +1,258 @@
+# energy landscape of a search, one typed row per structure
+#
+# parsed_outcar.table, spg.txt and match.<label>.table are joined on the stem of
+# the structure (<stem>/OUTCAR, <stem>.OUTCAR, <stem>.vasp all give <stem>),
+# columns of spg.txt are prefixed by spg_ and those of a match table by <label>_.
+# Then, from the per atom energy of the converged structures,
+#
+#   reduced_formula  composition of the formula divided by the gcd of its counts
+#   e_above_min      above the lowest structure of the same reduced formula
+#   rank             1 for the lowest structure of its reduced formula
+#   e_above_hull     above the lower convex hull of all compositions
+#   on_hull          e_above_hull is 0 within HULL_TOL
+#
+# The dataset is written to landscape.parquet with the stamps of its inputs, a
+# run with unchanged inputs returns it as is. Otherwise the join and rankings
+# are redone as a whole, they are vectorized over the rows and cost little next
+# to reading the tables, which come from their typed sidecars.
+
+import json
+import logging
+import math
+import re
+from functools import reduce
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from cdakit.iotools import file_stamp, index_to_stems, natural_order, read_format_table, write_format_table
+from cdakit.log import logit
+from cdakit.profiling import set_report, stage
+
+logger = logging.getLogger(__name__)
+
+LANDSCAPE_META = b"cdakit.landscape"
+HULL_TOL = 1e-8
+FORMULA_TOKEN = re.compile(r"([A-Z][a-z]*)(\d*)")
+
+
+def nullable(df: pd.DataFrame) -> pd.DataFrame:
+    """bool, int and str columns as their nullable dtypes, kept through outer joins"""
+    dtypes = {}
+    for col, dtype in df.dtypes.items():
+        if pd.api.types.is_bool_dtype(dtype):
+            dtypes[col] = "boolean"
+        elif pd.api.types.is_integer_dtype(dtype):
+            dtypes[col] = "Int64"
+        elif pd.api.types.is_object_dtype(dtype) or pd.api.types.is_string_dtype(dtype):
+            dtypes[col] = "string"
+    return df.astype(dtypes)
+
+
+def keyed_by_stem(df: pd.DataFrame, names=None) -> pd.DataFrame:
+    """df indexed by the structure stems of names, its own index if not given"""
+    stems = index_to_stems(pd.Index(df.index if names is None else names))
+    df = df.set_axis(stems.astype(str), axis=0).rename_axis("name")
+    duplicated = df.index.duplicated()
+    if duplicated.any():
+        logger.warning(f"{duplicated.sum()} duplicated structures, the first row of each is kept: {list(df.index[duplicated][:5])}")
+        df = df[~duplicated]
+    return df
+
+
+def load_outcar_table(ftable) -> pd.DataFrame:
+    return nullable(keyed_by_stem(read_format_table(ftable)))
+
+
+def load_spg_table(ftable) -> pd.DataFrame:
+    df = read_format_table(ftable)
+    df = keyed_by_stem(df.drop(columns="name"), df["name"])
+    return nullable(df.rename(columns=lambda col: col if col == "formula" else f"spg_{col}"))
+
+
+def match_label(ftable) -> str:
+    name = Path(ftable).name
+    return name[len("match."):-len(".table")] if name.startswith("match.") and name.endswith(".table") else Path(ftable).stem
+
+
+def load_match_table(ftable) -> pd.DataFrame:
+    df = keyed_by_stem(read_format_table(ftable))
+    label = match_label(ftable)
+    return nullable(df.drop(columns="formula", errors="ignore").rename(columns=lambda col: f"{label}_{col}"))
+
+
+def reduce_formula(formula: str) -> tuple[str, dict[str, int]]:
+    """(reduced formula, reduced counts) of a formula as ase writes it, elements in its order"""
+    counts = {}
+    for element, count in FORMULA_TOKEN.findall(formula):
+        counts[element] = counts.get(element, 0) + (int(count) if count else 1)
+    divisor = reduce(math.gcd, counts.values(), 0) or 1
+    counts = {element: count // divisor for element, count in counts.items()}
+    return "".join(f"{element}{count if count > 1 else ''}" for element, count in counts.items()), counts
+
+
+def rank_in_groups(codes: np.ndarray, energy: np.ndarray):
+    """(energy above the group minimum, 1-based rank in the group) of each row, by group codes 0..n-1"""
+    ngroups = codes.max() + 1 if len(codes) else 0
+    emin = np.full(ngroups, np.inf)
+    np.minimum.at(emin, codes, energy)
+    order = np.lexsort((energy, codes))
+    sorted_codes = codes[order]
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    first = np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order)) - first + 1
+    return energy - emin[codes], rank
+
+
+def hull_energies(fractions: np.ndarray, energy: np.ndarray, chunk=4096) -> np.ndarray:
+    """Energy of the lower convex hull of the points (fractions, energy) at each of the fractions
+
+    The compositions are projected on the affine space they span, so a binary
+    in a ternary dataset, or a single composition, is not degenerate for qhull.
+    Copies of the points lifted above the highest energy make the point set full
+    dimensional; they only add upper facets, which are not used.
+    """
+    centered = fractions - fractions.mean(axis=0)
+    _, sv, vt = np.linalg.svd(centered, full_matrices=False)
+    dim = int(np.sum(sv > 1e-9 * max(sv.max(initial=0), 1)))
+    if dim == 0:
+        return np.full(len(energy), energy.min())
+    projected = centered @ vt[:dim].T
+    lift = energy.max() + max(np.ptp(energy), 1.0)
+    points = np.vstack([np.column_stack([projected, energy]), np.column_stack([projected, np.full(len(energy), lift)])])
+
+    from scipy.spatial import ConvexHull
+
+    equations = ConvexHull(points).equations
+    # lower facets have an outward normal pointing to lower energy
+    lower = equations[equations[:, dim] < -HULL_TOL]
+    normal, de, offset = lower[:, :dim], lower[:, dim], lower[:, dim + 1]
+    ehull = np.empty(len(energy))
+    for start in range(0, len(energy), chunk):
+        planes = -(projected[start:start + chunk] @ normal.T + offset) / de
+        ehull[start:start + chunk] = planes.max(axis=1)
+    return ehull
+
+
+def rank_landscape(df: pd.DataFrame, energy="enthalpy_per_atom", include_unconverged=False) -> pd.DataFrame:
+    """Add reduced_formula, e_above_min, rank, e_above_hull and on_hull to df
+
+    Only rows with a finite energy, and converged unless include_unconverged,
+    are ranked; the others get NA.
+    """
+    if energy not in df.columns:
+        raise KeyError(f"no energy column {energy} in {list(df.columns)}")
+    evalues = df[energy].to_numpy(dtype=float, na_value=np.nan)
+    valid = np.isfinite(evalues)
+    if not include_unconverged and "converge" in df.columns:
+        valid &= df["converge"].fillna(False).to_numpy(dtype=bool)
+
+    formulas = df["formula"].astype("string")
+    codes, uniques = pd.factorize(formulas)
+    reduced = {formula: reduce_formula(formula) for formula in uniques}
+    reduced_formula = pd.array([None] * len(df), dtype="string")
+    if len(uniques):
+        reduced_formula = pd.array(np.array([reduced[f][0] for f in uniques], dtype=object)[codes], dtype="string")
+        reduced_formula[codes < 0] = pd.NA
+
+    valid &= codes >= 0
+    e_above_min = np.full(len(df), np.nan)
+    e_above_hull = np.full(len(df), np.nan)
+    rank = pd.array([None] * len(df), dtype="Int64")
+    if valid.any():
+        rcodes, runiques = pd.factorize(pd.Series(reduced_formula[valid], dtype="string"))
+        e_above_min[valid], rank_valid = rank_in_groups(rcodes, evalues[valid])
+        rank[valid] = rank_valid
+
+        # hull over the lowest energy of each composition
+        counts_of = dict(reduced.values())
+        compositions = [counts_of[r] for r in runiques]
+        elements = sorted({element for counts in compositions for element in counts})
+        fractions = np.array([[counts.get(element, 0) for element in elements] for counts in compositions], dtype=float)
+        fractions /= fractions.sum(axis=1, keepdims=True)
+        emin = evalues[valid] - e_above_min[valid]
+        lowest = np.full(len(runiques), np.inf)
+        lowest[rcodes] = emin
+        ehull = hull_energies(fractions, lowest)
+        e_above_hull[valid] = np.maximum(evalues[valid] - ehull[rcodes], 0)
+
+    df = df.copy()
+    df["reduced_formula"] = reduced_formula
+    df["e_above_min"] = e_above_min
+    df["rank"] = rank
+    df["e_above_hull"] = e_above_hull
+    df["on_hull"] = pd.array(np.where(valid, e_above_hull <= HULL_TOL, None), dtype="boolean")
+    return df
+
+
+def build_landscape(outcar_table, spg_table=None, match_tables=(), energy="enthalpy_per_atom", include_unconverged=False) -> pd.DataFrame:
+    """Join the tables on the structure stem and rank the structures"""
+    with stage("read_tables"):
+        frames = [load_outcar_table(outcar_table)]
+        if spg_table is not None:
+            frames.append(load_spg_table(spg_table))
+        frames += [load_match_table(ftable) for ftable in match_tables]
+    with stage("join"):
+        df = frames[0]
+        for frame in frames[1:]:
+            if "formula" in frame.columns:
+                # the formula of the relaxed structure wins, the other fills the missing
+                df = df.join(frame.rename(columns={"formula": "_formula"}), how="outer")
+                df["formula"] = df["formula"].fillna(df.pop("_formula"))
+            else:
+                df = df.join(frame, how="outer")
+        df = df.iloc[natural_order(df.index)]
+    with stage("rank", items=len(df)):
+        return rank_landscape(df, energy, include_unconverged)
+
+
+def read_landscape_meta(fdataset) -> dict:
+    try:
+        meta = pq.read_schema(fdataset).metadata or {}
+    except (OSError, pa.ArrowInvalid):
+        return {}
+    return json.loads(meta.get(LANDSCAPE_META, b"{}"))
+
+
+def write_landscape(df: pd.DataFrame, fdataset: Path, meta: dict):
+    table = pa.Table.from_pandas(df)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), LANDSCAPE_META: json.dumps(meta).encode()})
+    ftmp = fdataset.with_name(f".{fdataset.name}.tmp")
+    pq.write_table(table, ftmp)
+    ftmp.replace(fdataset)
+
+
+@logit()
+def landscape(outcar, spg=None, match=(), output=None, energy="enthalpy_per_atom", include_unconverged=False, rebuild=False, *args, **kwargs):
+    """Write <output>/landscape.parquet and landscape.table, output is the directory of outcar by default"""
+    outcar = Path(outcar)
+    outdir = Path(output) if output is not None else outcar.parent
+    outdir.mkdir(parents=True, exist_ok=True)
+    fdataset = outdir.joinpath("landscape.parquet")
+    set_report(outdir.joinpath("landscape.profile.json"))
+
+    sources = {"outcar": outcar} | ({"spg": Path(spg)} if spg is not None else {})
+    sources |= {f"match:{match_label(ftable)}": Path(ftable) for ftable in match or ()}
+    meta = {
+        "sources": {key: [str(fname.resolve()), file_stamp(fname)] for key, fname in sources.items()},
+        "energy": energy,
+        "include_unconverged": include_unconverged,
+    }
+    if not rebuild and fdataset.exists() and read_landscape_meta(fdataset) == meta:
+        logger.info(f"{fdataset} is up to date")
+        return pd.read_parquet(fdataset)
+
+    df = build_landscape(outcar, spg, match or (), energy, include_unconverged)
+    with stage("write", items=len(df)):
+        write_landscape(df, fdataset, meta)
+        write_format_table(df, outdir.joinpath("landscape.table"), index_label="name")
+    ranked = df["rank"].notna()
+    logger.info(
+        f"{len(df)} structures, {ranked.sum()} ranked in {df.loc[ranked, 'reduced_formula'].nunique()} compositions, "
+        f"{df['on_hull'].fillna(False).sum()} on the hull"
+    )
+    return df
@@ -4,13 +4,21 @@ from functools import wraps
 from multiprocessing import Queue
 from typing import Optional
 
+from cdakit.profiling import NoProfileFilter, ProfileCollector, profile_run
 
-def listener_configurer():
-    root = logging.getLogger()
+
+def stream_handler():
     h = logging.StreamHandler()
     f = logging.Formatter('|%(asctime)s|%(process)d|%(module)s|%(levelname)-8s| %(message)s', '%y/%m/%d %H:%M:%S')
     h.setFormatter(f)
-    root.addHandler(h)
+    h.addFilter(NoProfileFilter())
+    return h
+
+
+def listener_configurer():
+    root = logging.getLogger()
+    root.addHandler(stream_handler())
+    root.addHandler(ProfileCollector())
 
 
 def loglistener(queue: Queue):
@@ -28,12 +36,32 @@ def loglistener(queue: Queue):
             traceback.print_exc(file=sys.stderr)
 
 
+def threaded_loglistener(queue: Queue) -> logging.handlers.QueueListener:
+    """loglistener in a thread of this process, stop() it after the work is done
+
+    The records are handled by the listener's own handler instead of the root
+    logger, which holds the QueueHandler when the work runs in this process.
+    """
+    listener = logging.handlers.QueueListener(queue, stream_handler(), ProfileCollector())
+    listener.start()
+    return listener
+
+
+_worker_handler: Optional[logging.Handler] = None
+
+
 def worker_configurer(queue: Optional[Queue] = None, level=20):
+    global _worker_handler
     if queue is None:
         h = logging.StreamHandler()
+        h.addFilter(NoProfileFilter())
     else:
         h = logging.handlers.QueueHandler(queue)  # Just the one handler needed
     root = logging.getLogger()
+    # replace the handler of a previous call, a process may run many subcommands
+    if _worker_handler is not None:
+        root.removeHandler(_worker_handler)
+    _worker_handler = h
     root.addHandler(h)
     root.setLevel(level)
 
@@ -44,10 +72,17 @@ class logit:
 
     def __call__(self, func):
         @wraps(func)
-        def wrapper(logqueue: Optional[Queue] = None, logconf: dict = {}, *args, **kwargs):
+        def wrapper(logqueue: Optional[Queue] = None, logconf: Optional[dict] = None, *args, **kwargs):
+            logconf = {} if logconf is None else dict(logconf)
+            profile = logconf.pop("profile", False)
+            profiler = logconf.pop("profiler", None)
             if self.level is not None:
                 logconf["level"] = self.level
             worker_configurer(logqueue, **logconf)
-            return func(*args, **kwargs)
+            if not (profile or profiler):
+                return func(*args, **kwargs)
+            # stage timings of this process and its workers, reported next to the output
+            with profile_run(func.__name__, profiler):
+                return func(*args, **kwargs)
         return wrapper
 
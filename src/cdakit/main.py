@@ -2,25 +2,30 @@ import argparse
 import multiprocessing
 import logging
 
-import cdakit
-import cdakit.find_spg
-import cdakit.match_structure
-import cdakit.parse_outcar
-import cdakit.prepare_calypso
-import cdakit.prepare_vasp
-import cdakit.standardize
-from cdakit.log import loglistener
+from cdakit.log import loglistener, threaded_loglistener
+from cdakit.subcommands import SUBCOMMANDS
 
 
-def main(verbose: int, **kwargs):
+def main(verbose: int, exec_mode="auto", profile=False, profiler=None, **kwargs):
     queue = multiprocessing.Queue(-1)
     kwargs["logqueue"] = queue
-    kwargs["logconf"] = {"level": 20 - 10 * verbose}
+    kwargs["logconf"] = {"level": 20 - 10 * verbose, "profile": profile, "profiler": profiler}
+    func = kwargs.get("func", None)
+    if exec_mode == "auto":
+        exec_mode = "inprocess" if kwargs.get("njobs", 1) == 1 else "subprocess"
+    if exec_mode == "inprocess":
+        # small jobs: no process is spawned, the listener is a thread
+        listener = threaded_loglistener(queue)
+        try:
+            if func is not None:
+                func(**kwargs)
+        finally:
+            listener.stop()
+        return
     # log listener
     logproc = multiprocessing.Process(target=loglistener, args=(queue,))
     logproc.start()
     # worker
-    func = kwargs.get("func", None)
     if func is not None:
         worker = multiprocessing.Process(target=func, kwargs=kwargs)
         worker.start()
@@ -29,21 +34,27 @@ def main(verbose: int, **kwargs):
     logproc.join()
 
 
-def cli():
+def get_parser():
     parser = argparse.ArgumentParser(
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
     )
     parser.add_argument("-j", "--njobs", type=int, default=1, help="n core to parallel")
     parser.add_argument("-v", "--verbose", action="count", default=0)
-    # create subparsers
+    parser.add_argument(
+        "--exec", dest="exec_mode", choices=["auto", "inprocess", "subprocess"], default="auto",
+        help="run the subcommand in this process or in a separate one, auto runs serial (-j 1) jobs in this process",
+    )
+    parser.add_argument("--profile", action="store_true", help="write stage timings, worker throughput and peak RSS to <subcommand>.profile.json next to the output")
+    parser.add_argument("--profiler", choices=["cprofile", "pyinstrument"], help="also capture the main process by this profiler, implies --profile")
+    # create subparsers, the implementations are imported only when dispatched
     subparsers = parser.add_subparsers()
-    # add subparser to subparsers
-    cdakit.find_spg.add_subparser(subparsers)
-    cdakit.match_structure.add_subparser(subparsers)
-    cdakit.parse_outcar.add_subparser(subparsers)
-    cdakit.prepare_calypso.add_subparser(subparsers)
-    cdakit.prepare_vasp.add_subparser(subparsers)
-    cdakit.standardize.add_subparser(subparsers)
+    for add_subparser in SUBCOMMANDS.values():
+        add_subparser(subparsers)
+    return parser
+
+
+def cli():
+    parser = get_parser()
     # parse
     args, unknown_args = parser.parse_known_args()
     # calling main
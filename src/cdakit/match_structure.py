@@ -1,13 +1,23 @@
-import argparse
+import hashlib
+import json
 import logging
+from collections import defaultdict
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
+import spglib
+from joblib import Parallel, delayed
 from pymatgen.analysis.structure_matcher import StructureMatcher
+from pymatgen.core.lattice import Lattice
 from pymatgen.core.structure import Structure
+from scipy.optimize import linear_sum_assignment
+from tqdm import tqdm
 
-from cdakit.iotools import to_format_table
+from cdakit.iotools import read_format_table, write_format_table
 from cdakit.log import logit
+from cdakit.profiling import profiled, set_report, stage
+from cdakit.store import glob_vasp, read_cell, structure_stamp
 
 
 logger = logging.getLogger(__name__)
@@ -25,6 +35,101 @@ def get_matchers():
     return matchers
 
 
+def get_idxlist(indir: Path):
+    try:
+        idxlist = sorted([int(f.stem) for f in glob_vasp(indir)])
+    except Exception:
+        logger.warning("cannot sorted by digit, skip sorting")
+        idxlist = [f.stem for f in glob_vasp(indir)]
+    return idxlist
+
+
+def _lattice_within(latt, target_lattice, ltol, angle_tol):
+    ratio = np.asarray(latt.lengths) / np.asarray(target_lattice.lengths)
+    if np.any(ratio >= 1 + ltol) or np.any(ratio <= 1 / (1 + ltol)):
+        return False
+    return np.allclose(latt.angles, target_lattice.angles, atol=angle_tol, rtol=0)
+
+
+def match_levels(struct1: Structure, struct2: Structure, matchers: dict[str, StructureMatcher]):
+    """Answer fit and get_rms_dist of every matcher in a single lattice search
+
+    The search runs with the loosest matcher only. Every candidate mapping is
+    then checked against the ltol/angle_tol/stol of each tighter matcher, so
+    the result is the same as calling ``fit`` and ``get_rms_dist`` of each
+    matcher. All matchers must share the other settings (primitive_cell,
+    scale, attempt_supercell, comparator), as those of get_matchers do.
+
+    The steps of ``StructureMatcher._strict_match`` are taken from its private
+    methods, so the pymatgen version is bounded in pyproject.toml and
+    test/test_match_structure.py compares the result with ``fit`` and
+    ``get_rms_dist``.
+
+    Returns
+    -------
+    dict
+        {mat_name: (fit, normrms, maxrms)}, rms are pd.NA if not fit
+    """
+    levels = sorted(matchers.items(), key=lambda kv: (kv[1].ltol, kv[1].stol, kv[1].angle_tol), reverse=True)
+    loose = levels[0][1]
+    result = {mat_name: (False, pd.NA, pd.NA) for mat_name in matchers}
+
+    struct1, struct2 = loose._process_species([struct1, struct2])
+    if not loose._subset and loose._comparator.get_hash(struct1.composition) != loose._comparator.get_hash(struct2.composition):
+        return result
+    struct1, struct2, fu, s1_supercell = loose._preprocess(struct1, struct2)
+    # same orientation as StructureMatcher._match
+    ratio = fu if s1_supercell else 1 / fu
+    if len(struct1) * ratio < len(struct2):
+        struct1, struct2, s1_supercell = struct2, struct1, not s1_supercell
+
+    mask, s1_t_inds, s2_t_ind = loose._get_mask(struct1, struct2, fu, s1_supercell)
+    if (not loose._subset) and mask.shape[1] != mask.shape[0]:
+        return result
+    if mask[linear_sum_assignment(mask)].sum() > 0:
+        return result
+    sc_struct, target_lattice = (struct1, struct2.lattice) if s1_supercell else (struct2, struct1.lattice)
+
+    # per level: whether any candidate has max dist < stol, and the best rms candidate
+    fits = {mat_name: False for mat_name in matchers}
+    best = {mat_name: None for mat_name in matchers}
+    for s1fc, s2fc, avg_l, sc_m in loose._get_supercells(struct1, struct2, fu, s1_supercell):
+        latt = Lattice(np.dot(sc_m, sc_struct.lattice.matrix))
+        in_levels = [
+            (mat_name, matcher) for mat_name, matcher in levels
+            if _lattice_within(latt, target_lattice, matcher.ltol, matcher.angle_tol)
+        ]
+        normalization = (len(s1fc) / avg_l.volume) ** (1 / 3)
+        inv_abc = np.array(avg_l.reciprocal_lattice.abc)
+        inv_lll_abc = np.array(avg_l.get_lll_reduced_lattice().reciprocal_lattice.abc)
+        for s1i in s1_t_inds:
+            t_s2fc = s2fc + s1fc[s1i] - s2fc[s2_t_ind]
+            dist = None
+            for mat_name, matcher in in_levels:
+                frac_tol = inv_abc * matcher.stol / (np.pi * normalization)
+                if not loose._cmp_fstruct(s1fc, t_s2fc, frac_tol, mask):
+                    # tighter levels cannot pass either
+                    break
+                if dist is None:
+                    lll_frac_tol = inv_lll_abc * loose.stol / (np.pi * normalization)
+                    dist, _, _ = loose._cart_dists(s1fc, t_s2fc, avg_l, mask, normalization, lll_frac_tol)
+                    rms = np.linalg.norm(dist) / len(dist) ** 0.5
+                if max(dist) < matcher.stol:
+                    fits[mat_name] = True
+                if best[mat_name] is None or rms < best[mat_name][0]:
+                    best[mat_name] = (rms, max(dist))
+
+    for mat_name, matcher in matchers.items():
+        if fits[mat_name] and best[mat_name][0] < matcher.stol:
+            result[mat_name] = (True, *best[mat_name])
+    return result
+
+
+@profiled("match")
+def match_levels_file(gtst: Structure, fname: Path, matchers: dict[str, StructureMatcher]):
+    return match_levels(gtst, read_cell(fname).to_structure(), matchers)
+
+
 # match *.vasp with ground-truth structure(gtst) with each matcher in matchers
 # calculate average rms distance if matcher
 # return
@@ -36,62 +141,189 @@ def match_structure(
     gtst: Structure,
     matchers: dict[str, StructureMatcher],
     label,
+    njobs=1,
+    rematch=False,
+    use_hash=False,
 ):
     f_target = indir.with_name(f"{label}.vasp")
     f_matchtable = indir.with_name(f"match.{label}.table")
-    try:
-        idxlist = sorted([int(f.stem) for f in indir.glob("*.vasp")])
-    except Exception:
-        logger.warning("cannot sorted by digit, skip sorting")
-        idxlist = [f.stem for f in indir.glob("*.vasp")]
+    f_stamp = indir.with_name(f".match.{label}.stamp.json")
+    idxlist = get_idxlist(indir)
+    stamps = {f"{i}.vasp": structure_stamp(indir / f"{i}.vasp", use_hash) for i in idxlist}
+    stamps["target"] = hashlib.sha1(gtst.to(fmt="poscar").encode()).hexdigest()
 
-    if f_matchtable.exists():
-        df = pd.read_table(f_matchtable, sep=r"\s+", index_col="index")
-        if len(df) >= len(idxlist):
-            return df
+    # reuse rows whose *.vasp still exists with the same stamp, tables written
+    # before stamps were recorded are trusted as they are
+    olddf = pd.DataFrame()
+    if f_matchtable.exists() and not rematch:
+        olddf = read_format_table(f_matchtable)
+        oldstamps = json.loads(f_stamp.read_text()) if f_stamp.exists() else {}
+        if oldstamps.get("target", stamps["target"]) != stamps["target"]:
+            logger.info(f"target {label} changed, rematch all")
+            olddf = pd.DataFrame()
+        else:
+            keep = [
+                name in stamps and oldstamps.get(name, stamps[name]) == stamps[name]
+                for name in olddf.index
+            ]
+            olddf = olddf[keep]
+    todo = [i for i in idxlist if f"{i}.vasp" not in olddf.index]
+    if len(todo) == 0 and len(olddf) == len(idxlist) and f_stamp.exists():
+        return olddf.loc[[f"{i}.vasp" for i in idxlist]]
+    logger.info(f"{len(olddf)} structures reused, {len(todo)} to match")
 
-    st_dict = {f"{i}.vasp": Structure.from_file(indir / f"{i}.vasp") for i in idxlist}
+    matched = Parallel(njobs, backend="multiprocessing")(
+        delayed(match_levels_file)(gtst, indir / f"{i}.vasp", matchers)
+        for i in tqdm(todo, ncols=120, desc=label)
+    )
 
     data = {}
-    for mat_name, matcher in matchers.items():
-        fitdict = {i: matcher.fit(gtst, st) for i, st in st_dict.items()}
-        distdict = {
-            i: (matcher.get_rms_dist(gtst, st_dict[i]) if fit else (pd.NA, pd.NA))
-            for i, fit in fitdict.items()
-        }
+    for mat_name in matchers:
+        data[mat_name] = pd.Series(
+            {f"{i}.vasp": m[mat_name][0] for i, m in zip(todo, matched)}
+        )
+        data[f"{mat_name}_normrms"] = pd.Series(
+            {f"{i}.vasp": m[mat_name][1] for i, m in zip(todo, matched)}
+        )
+        data[f"{mat_name}_maxrms"] = pd.Series(
+            {f"{i}.vasp": m[mat_name][2] for i, m in zip(todo, matched)}
+        )
+
+    df = pd.concat([olddf, pd.DataFrame(data)]) if len(olddf) > 0 else pd.DataFrame(data)
+    df = df.loc[[f"{i}.vasp" for i in idxlist]]
+
+    gtst.to(str(f_target), fmt="poscar")
+    with stage("write_table"):
+        write_format_table(df, f_matchtable)
+    with open(f_stamp, "w") as f:
+        json.dump(stamps, f)
+
+    return df
 
-        data[mat_name] = pd.Series(fitdict)
-        data[f"{mat_name}_normrms"] = pd.Series({k: v[0] for k, v in distdict.items()})
-        data[f"{mat_name}_maxrms"] = pd.Series({k: v[1] for k, v in distdict.items()})
 
+def get_fingerprint(st: Structure, symprec=0.5):
+    """Cheap invariants used to bucket structures before StructureMatcher.fit
+
+    Returns reduced formula, space group number under ``symprec``, volume per
+    atom and quantiles of the nearest-neighbour distance of each site scaled by
+    (V/N)^(1/3), which is invariant to supercells and isotropic scaling.
+    """
+    cell = (st.lattice.matrix, st.frac_coords, st.atomic_numbers)
+    symds = spglib.get_symmetry_dataset(cell, symprec) if symprec > 0 else None
+    vpa = st.volume / len(st)
+    dmat = st.lattice.get_all_distances(st.frac_coords, st.frac_coords)
+    np.fill_diagonal(dmat, min(st.lattice.abc))
+    nndist = dmat.min(axis=1) / vpa ** (1 / 3)
+    return {
+        "formula": st.composition.reduced_formula,
+        "spg": symds.number if symds is not None else 0,
+        "vpa": vpa,
+        "nnfp": np.quantile(nndist, [0, 0.25, 0.5, 0.75, 1]),
+    }
+
+
+@profiled("load")
+def load_with_fingerprint(fname: Path, symprec):
+    st = read_cell(fname).to_structure()
+    return st, get_fingerprint(st, symprec)
+
+
+def is_similar(fp1, fp2, vtol, fptol):
+    """Prefilter of a pair before StructureMatcher.fit
+
+    The matchers scale the volumes and allow ltol/stol distortions, so finite
+    vtol or fptol may reject pairs they fit and change the groups, not only
+    save work. Both are inf by default, which never rejects.
+    """
+    if abs(fp1["vpa"] - fp2["vpa"]) > vtol * min(fp1["vpa"], fp2["vpa"]):
+        return False
+    return np.abs(fp1["nnfp"] - fp2["nnfp"]).max() <= fptol
+
+
+# group one bucket of structures hierarchically, the tolerances of matchers are
+# nested, so the medium level is only searched inside each loose group and the
+# strict level inside each medium group
+# return {name: {mat_name: representative name}}
+@profiled("group_bucket")
+def group_bucket(entries, matchers: dict[str, StructureMatcher], vtol, fptol):
+    groups = defaultdict(list)
+    grouped = {}
+    for name, st, fp in entries:
+        grouped[name] = {}
+        parent = None
+        for mat_name, matcher in matchers.items():
+            reps = groups[(mat_name, parent)]
+            for rep_name, rep_st, rep_fp in reps:
+                if is_similar(rep_fp, fp, vtol, fptol) and matcher.fit(rep_st, st):
+                    parent = rep_name
+                    break
+            else:
+                reps.append((name, st, fp))
+                parent = name
+            grouped[name][mat_name] = parent
+    return grouped
+
+
+# group all *.vasp in indir into equivalence classes with each matcher
+# return
+#   formula spg vpa matcher_lo matcher_lo_group matcher_md ... matcher_st_group
+# 0     ...  ... ...        T/F           <name>        T/F  ...           <name>
+# matcher_* is True only for the representative (first) structure of a group
+def match_unique(
+    indir: Path,
+    matchers: dict[str, StructureMatcher],
+    njobs=1,
+    symprec=0.5,
+    vtol=np.inf,
+    fptol=np.inf,
+):
+    f_matchtable = indir.with_name("match.uniq.table")
+    idxlist = get_idxlist(indir)
+
+    loaded = Parallel(njobs, backend="multiprocessing")(
+        delayed(load_with_fingerprint)(indir / f"{i}.vasp", symprec)
+        for i in tqdm(idxlist, ncols=120, desc="fingerprint")
+    )
+    buckets = defaultdict(list)
+    for i, (st, fp) in zip(idxlist, loaded):
+        buckets[(fp["formula"], fp["spg"])].append((i, st, fp))
+    logger.info(f"{len(idxlist)} structures in {len(buckets)} buckets")
+
+    grouped = {}
+    for bucket_grouped in Parallel(njobs, backend="multiprocessing")(
+        delayed(group_bucket)(entries, matchers, vtol, fptol)
+        for entries in tqdm(buckets.values(), ncols=120, desc="match")
+    ):
+        grouped.update(bucket_grouped)
+
+    data = {
+        "formula": pd.Series({i: fp["formula"] for i, (_, fp) in zip(idxlist, loaded)}),
+        "spg": pd.Series({i: fp["spg"] for i, (_, fp) in zip(idxlist, loaded)}),
+        "vpa": pd.Series({i: fp["vpa"] for i, (_, fp) in zip(idxlist, loaded)}),
+    }
+    for mat_name in matchers:
+        group = pd.Series({i: grouped[i][mat_name] for i in idxlist})
+        data[mat_name] = group == group.index
+        data[f"{mat_name}_group"] = group
+        logger.info(f"{mat_name}: {data[mat_name].sum()} unique")
     df = pd.DataFrame(data)
 
-    gtst.to(str(f_target), fmt="poscar")
-    table_str = to_format_table(df)
-    with open(f_matchtable, "w") as f:
-        f.write(table_str)
+    with stage("write_table"):
+        write_format_table(df, f_matchtable)
 
     return df
 
 
 @logit()
-def matchtarget(indir, target, **kwargs):
+def matchtarget(indir, target, unique=False, njobs=1, symprec=0.5, vtol=np.inf, fptol=np.inf, rematch=False, use_hash=False, **kwargs):
     indir = Path(indir).resolve()
+    set_report(indir.with_name("match_structure.profile.json"))
+    matchers = get_matchers()
+    if unique:
+        return match_unique(indir, matchers, njobs, symprec, vtol, fptol)
+
     target = Path(target).resolve()
     targetst = Structure.from_file(target)
-    matchers = get_matchers()
 
-    matchdf = match_structure(indir, targetst, matchers, target.stem)
+    matchdf = match_structure(indir, targetst, matchers, target.stem, njobs, rematch, use_hash)
     return matchdf
-
-
-def add_subparser(subparsers):
-    subparser = subparsers.add_parser(
-        __name__.split(".")[-1],
-        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
-        description="match structures to target by pymatgen, write to match.<target>.table",
-    )
-    subparser.set_defaults(func=matchtarget)
-    subparser.add_argument("indir", help="directory containing *.vasp")
-    subparser.add_argument("-t", "--target", required=True, help="target structure in vasp format")
-
@@ -1,20 +1,208 @@
-import argparse
+import io
+import json
 import logging
-import pickle
+import mmap
+import multiprocessing
+import os
+import re
+import uuid
 import warnings
-from itertools import chain
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
-from ase.io import read
-from joblib import Parallel, delayed
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from joblib import Parallel, delayed, effective_n_jobs
 from tqdm import tqdm
 
-from cdakit.iotools import to_format_table
+from cdakit.iotools import file_stamp, write_format_table
 from cdakit.log import logit
+from cdakit.poscar import read_poscar
+from cdakit.profiling import profiled, set_report, stage
 
 logger = logging.getLogger(__name__)
 
+# markers of the per-step lines, in the priority of the original line-by-line
+# parser: a line is classified by the first marker it contains
+OUTCAR_STEP_MARKERS = (b"energy  without", b"P V=", b"volume of cell", b"external pressure")
+OUTCAR_NIONS = re.compile(rb"NIONS =\s*(\d+)")
+OUTCAR_FORCE = re.compile(rb"POSITION\s+TOTAL-FORCE[^\n]*\n[^\n]*\n")
+OUTCAR_STRESS = re.compile(rb"\n  in kB([^\n]*)")
+OUTCAR_LATTICE = re.compile(rb"direct lattice vectors[^\n]*\n")
+
+
+@contextmanager
+def open_outcar(foutcar: Path):
+    """Map OUTCAR read-only into memory, yield bytes for an empty file"""
+    with open(foutcar, "rb") as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # cannot mmap an empty file
+            yield b""
+            return
+        try:
+            yield mm
+        finally:
+            mm.close()
+
+
+def _line_at(buf, pos):
+    start = buf.rfind(b"\n", 0, pos) + 1
+    end = buf.find(b"\n", pos)
+    return start, (len(buf) if end < 0 else end)
+
+
+def _last_line_with(buf, marker, higher_markers):
+    pos = buf.rfind(marker)
+    while pos >= 0:
+        start, end = _line_at(buf, pos)
+        line = buf[start:end]
+        if not any(m in line for m in higher_markers):
+            return line
+        pos = buf.rfind(marker, 0, start)
+    return None
+
+
+def _first_line_with(buf, marker, higher_markers):
+    pos = buf.find(marker)
+    while pos >= 0:
+        start, end = _line_at(buf, pos)
+        line = buf[start:end]
+        if not any(m in line for m in higher_markers):
+            return line
+        pos = buf.find(marker, end)
+    return None
+
+
+def _count(buf, marker):
+    n = 0
+    pos = buf.find(marker)
+    while pos >= 0:
+        n += 1
+        pos = buf.find(marker, pos + len(marker))
+    return n
+
+
+def _to_float(token: bytes):
+    try:
+        return float(token)
+    except ValueError:  # overflowed fields like '*******'
+        return np.nan
+
+
+def scan_outcar_scalars(buf):
+    """Collect the per-step values of OUTCAR
+
+    Each marker is located with ``find`` over the whole buffer instead of
+    testing every line, then only the marked lines are split. The convergence
+    and CPU time lines are searched backward from the end of file.
+    """
+    linestarts = set()
+    for marker in OUTCAR_STEP_MARKERS:
+        pos = buf.find(marker)
+        while pos >= 0:
+            linestarts.add(buf.rfind(b"\n", 0, pos) + 1)
+            pos = buf.find(marker, pos + 1)
+    energylist = []  # eV
+    Vlist = []
+    PVlist = []  # eV
+    extpres = []  # kbar
+    for start in sorted(linestarts):
+        end = buf.find(b"\n", start)
+        line = buf[start:(len(buf) if end < 0 else end)]
+        if b"energy  without" in line:
+            energylist.append(float(line.split()[-1]))
+        elif b"P V=" in line:
+            PVlist.append(float(line.split()[-1]))
+        elif b"volume of cell" in line:
+            Vlist.append(_to_float(line.split()[-1]))
+        elif b"external pressure" in line:
+            extpres.append(_to_float(line.split()[3]))
+    converge = _last_line_with(buf, b"reached required", OUTCAR_STEP_MARKERS) is not None
+    cpuline = _last_line_with(buf, b"CPU", OUTCAR_STEP_MARKERS + (b"reached required",))
+    cputime = pd.NA if cpuline is None else float(cpuline.split()[-1])
+    return energylist, Vlist, PVlist, extpres, converge, cputime
+
+
+def _floats(raw: bytes, shape):
+    try:
+        return np.array(raw.split(), dtype=float).reshape(shape)
+    except ValueError:  # overflowed fields like '*******'
+        return np.full(shape, np.nan)
+
+
+def _floats_many(chunks: list, shape):
+    if len(chunks) == 0:
+        return np.empty((0, *shape))
+    try:
+        # a single C-level parse of all blocks
+        return np.loadtxt(io.BytesIO(b"".join(chunks)), ndmin=2).reshape(-1, *shape)
+    except ValueError:
+        return np.array([_floats(chunk, shape) for chunk in chunks])
+
+
+def scan_outcar_arrays(buf, nsteps=None):
+    """Per ionic step arrays of OUTCAR
+
+    Returns
+    -------
+    dict
+        natoms, positions (nsteps, natoms, 3), forces (nsteps, natoms, 3),
+        stress (nsteps, 6) in kB as XX YY ZZ XY YZ ZX, lattice (nsteps, 3, 3).
+        The first lattice (printed before the first step) is dropped, all
+        arrays are truncated to ``nsteps`` if given.
+    """
+    m = OUTCAR_NIONS.search(buf)
+    natoms = int(m.group(1)) if m is not None else 0
+    forcechunks = []
+    for m in OUTCAR_FORCE.finditer(buf):
+        forcechunks.append(buf[m.end():buf.find(b" ---", m.end())] + b"\n")
+    stresschunks = [m.group(1) + b"\n" for m in OUTCAR_STRESS.finditer(buf)]
+    latticechunks = []
+    for m in OUTCAR_LATTICE.finditer(buf):
+        end = m.end()
+        for _ in range(3):
+            end = buf.find(b"\n", end) + 1
+        latticechunks.append(buf[m.end():end])
+    posforces = _floats_many(forcechunks[:nsteps], (natoms, 6))
+    return {
+        "natoms": natoms,
+        "positions": posforces[:, :, :3],
+        "forces": posforces[:, :, 3:],
+        "stress": _floats_many(stresschunks[:nsteps], (6,)),
+        "lattice": _floats_many(latticechunks[1:][:nsteps], (3, 6))[:, :, :3],
+    }
+
+
+def read_outcar_arrays(foutcar: Path) -> dict:
+    """Read OUTCAR to NumPy arrays of each ionic step
+
+    Returns
+    -------
+    dict
+        energy, PV, volume, extpressure of shape (nsteps,), converge, cputime
+        and the arrays of :func:`scan_outcar_arrays`
+    """
+    with open_outcar(foutcar) as mm:
+        energylist, Vlist, PVlist, extpres, converge, cputime = scan_outcar_scalars(mm)
+        nsteps = len(energylist)
+        arrays = scan_outcar_arrays(mm, nsteps)
+    arrays.update(
+        {
+            "energy": np.array(energylist, dtype=float),
+            "PV": np.array(PVlist[:nsteps] if PVlist else [0] * nsteps, dtype=float),
+            "volume": np.array(Vlist[1:][:nsteps], dtype=float),
+            "extpressure": np.array(extpres[:nsteps], dtype=float),
+            "converge": converge,
+            "cputime": np.nan if cputime is pd.NA else cputime,
+        }
+    )
+    return arrays
+
 
 def parse_one_outcar(foutcar: Path) -> pd.DataFrame:
     """Parse OUTCAR to pandas DataFrame
@@ -38,30 +226,12 @@ def parse_one_outcar(foutcar: Path) -> pd.DataFrame:
     """
     foutcar = Path(foutcar)
     try:
-        atoms = read(foutcar.with_name("CONTCAR"), format="vasp")
+        contcar = read_poscar(foutcar.with_name("CONTCAR"))
     except Exception:
         raise ValueError("read CONTCAR error!")
-    formula = atoms.get_chemical_formula("metal")
-    energylist = []  # eV
-    Vlist = []
-    PVlist = []  # eV
-    extpres = []  # kbar
-    converge = False
-    cputime = pd.NA
-    with open(foutcar, "r") as f:
-        for line in f:
-            if "energy  without" in line:
-                energylist.append(float(line.strip().split()[-1]))
-            elif "P V=" in line:
-                PVlist.append(float(line.strip().split()[-1]))
-            elif "volume of cell" in line:
-                Vlist.append(line.strip().split()[-1])
-            elif "external pressure" in line:
-                extpres.append(line.strip().split()[3])
-            elif "reached required" in line:
-                converge = True
-            elif "CPU" in line:
-                cputime = float(line.strip().split()[-1])
+    formula = contcar.formula
+    with open_outcar(foutcar) as mm:
+        energylist, Vlist, PVlist, extpres, converge, cputime = scan_outcar_scalars(mm)
     if len(energylist) == 0:
         energylist = [pd.NA]
         Vlist = [pd.NA]
@@ -77,7 +247,7 @@ def parse_one_outcar(foutcar: Path) -> pd.DataFrame:
     convergelist = [False] * len(energylist)
     convergelist[-1] = converge
     cputime = [cputime] * len(energylist)
-    natoms = [len(atoms)] * len(energylist)
+    natoms = [len(contcar.numbers)] * len(energylist)
     formula = [formula] * len(energylist)
     parsed_df = pd.DataFrame(
         {
@@ -98,6 +268,68 @@ def parse_one_outcar(foutcar: Path) -> pd.DataFrame:
     return parsed_df
 
 
+@profiled("summarize_outcar")
+def summarize_one_outcar(foutcar: Path) -> pd.Series:
+    """Summarize OUTCAR without parsing every ionic step
+
+    The initial energy is read from the head of file, the final energy, P V,
+    convergence and CPU time backward from the end, and the steps are only
+    counted. The P V of the last step is taken from the last P V line.
+
+    Returns
+    -------
+    pd.Series
+        the same fields as a row of :func:`stat_outcar_dfdict`
+    """
+    foutcar = Path(foutcar)
+    try:
+        contcar = read_poscar(foutcar.with_name("CONTCAR"))
+    except Exception:
+        raise ValueError("read CONTCAR error!")
+    energy_marker, pv_marker = OUTCAR_STEP_MARKERS[:2]
+    with open_outcar(foutcar) as mm:
+        nsteps = _count(mm, energy_marker)
+        if nsteps == 0:
+            decreased_enth = last_enth = pd.NA
+        else:
+            first_pv = _first_line_with(mm, pv_marker, (energy_marker,))
+            last_pv = _last_line_with(mm, pv_marker, (energy_marker,))
+            first_enth = float(mm[slice(*_line_at(mm, mm.find(energy_marker)))].split()[-1])
+            last_enth = float(mm[slice(*_line_at(mm, mm.rfind(energy_marker)))].split()[-1])
+            if first_pv is not None:
+                first_enth += float(first_pv.split()[-1])
+                last_enth += float(last_pv.split()[-1])
+            decreased_enth = first_enth - last_enth
+        converge = _last_line_with(mm, b"reached required", OUTCAR_STEP_MARKERS) is not None
+    return pd.Series(
+        {
+            "formula": contcar.formula,
+            "converge": converge,
+            "decreased_enth": decreased_enth,
+            "ion_steps": max(nsteps, 1),  # a failed OUTCAR is one NA step as in parse_one_outcar
+            "natoms": len(contcar.numbers),
+            "nsites": len(contcar.numbers),
+            "enthalpy": last_enth,
+        }
+    )
+
+
+# columns of parsed_outcar.table, enthalpy is that of the last step
+STAT_COLUMNS = ["formula", "converge", "decreased_enth", "ion_steps", "natoms", "nsites",
+                "decreased_enth_per_atom", "enthalpy", "enthalpy_per_atom"]
+
+
+def stat_outcar_serlist(serlist: list[pd.Series]) -> pd.DataFrame:
+    stat_df = pd.DataFrame(serlist)
+    stat_df["decreased_enth"] = pd.to_numeric(stat_df["decreased_enth"])
+    stat_df["decreased_enth_per_atom"] = stat_df["decreased_enth"] / stat_df["natoms"]
+    stat_df["enthalpy"] = pd.to_numeric(stat_df["enthalpy"])
+    stat_df["enthalpy_per_atom"] = stat_df["enthalpy"] / stat_df["natoms"]
+    stat_df = stat_df[STAT_COLUMNS]
+    stat_df.index.name = "fname"
+    return stat_df
+
+
 def stat_outcar_dfdict(dfdict: dict[str, pd.DataFrame]) -> pd.DataFrame:
     serlist = []
     for fname, df in dfdict.items():
@@ -109,47 +341,282 @@ def stat_outcar_dfdict(dfdict: dict[str, pd.DataFrame]) -> pd.DataFrame:
                 "ion_steps": len(df),
                 "natoms": df.at[0, "natoms"],
                 "nsites": df.at[0, "nsites"],
+                "enthalpy": df.at[len(df) - 1, "enthalpy"],
             },
             name=fname
         )
         serlist.append(ser)
-    stat_df = pd.DataFrame(serlist)
+    return stat_outcar_serlist(serlist)
+
+
+PARSED_OUTCAR_SCHEMA = pa.schema(
+    [
+        ("fname", pa.string()),
+        ("stamp", pa.string()),
+        ("step", pa.int64()),
+        ("formula", pa.string()),
+        ("energy", pa.float64()),
+        ("volume", pa.float64()),
+        ("PV", pa.float64()),
+        ("extpressure", pa.float64()),
+        ("converge", pa.bool_()),
+        ("cputime", pa.float64()),
+        ("natoms", pa.int64()),
+        ("nsites", pa.int64()),
+        ("enthalpy", pa.float64()),
+        ("enthalpy_per_atom", pa.float64()),
+    ]
+)
+
+
+@profiled("parse_outcar")
+def parse_one_outcar_keyed(args):
+    fname, stamp, foutcar = args
+    parsed_df = parse_one_outcar(foutcar).reset_index()
+    parsed_df.insert(0, "fname", fname)
+    parsed_df.insert(1, "stamp", stamp)
+    return parsed_df
+
+
+def walk_outcars(indir: Path, skipdirs=None, nthreads=8):
+    """Find OUTCAR and *.OUTCAR under indir in a single pass
+
+    Directories are listed by ``os.scandir`` in a thread pool and the found
+    files are yielded as soon as their directory is listed, so the consumer
+    can start before the walk ends.
+
+    Parameters
+    ----------
+    indir : Path
+        root directory
+    skipdirs : dict[str, list[str]], optional
+        directories relative to indir whose OUTCAR are not listed, with the
+        OUTCAR names known in each of them, their subdirectories are still
+        walked
+    nthreads : int
+        number of directories listed concurrently
+
+    Yields
+    ------
+    tuple[Path, os.stat_result | None]
+        path of OUTCAR, and its stat or None if it is from ``skipdirs``
+    """
+    skipdirs = {} if skipdirs is None else skipdirs
+
+    def scan(dirpath, skip=False):
+        files, subdirs = [], []
+        with os.scandir(dirpath) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif skip:
+                    continue
+                elif entry.name == "OUTCAR" or entry.name.endswith(".OUTCAR"):
+                    files.append((Path(entry.path), entry.stat()))
+        return files, subdirs
+
+    with ThreadPoolExecutor(nthreads) as executor:
+        pending = {executor.submit(scan, indir)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, subdirs = future.result()
+                yield from files
+                for subdir in subdirs:
+                    relsubdir = os.path.relpath(subdir, indir)
+                    skip = relsubdir in skipdirs
+                    if skip:
+                        for name in skipdirs[relsubdir]:
+                            yield Path(subdir, name), None
+                    pending.add(executor.submit(scan, subdir, skip))
+
+
+def load_outcar_index(findex: Path) -> dict[str, list[str]]:
+    if not findex.exists():
+        return {}
+    with open(findex) as f:
+        return json.load(f)
+
+
+def save_outcar_index(findex: Path, steps: pd.DataFrame):
+    """Record directories whose OUTCAR have all finished (CPU time printed)"""
+    last = steps.sort_values(["fname", "step"]).drop_duplicates("fname", keep="last")
+    dirnames = last["fname"].map(os.path.dirname)
+    index = {}
+    for dirname, group in last.groupby(dirnames):
+        if dirname != "" and group["cputime"].notna().all():
+            index[dirname] = [os.path.basename(fname) for fname in group["fname"]]
+    tmp = findex.with_name(f".{findex.name}.tmp")
+    with open(tmp, "w") as f:
+        json.dump(index, f)
+    tmp.replace(findex)
+
+
+def write_parsed_part(dsdir: Path, dflist: list[pd.DataFrame]):
+    """Write one part file of the parsed_outcar.parquet dataset atomically"""
+    table = pa.Table.from_pandas(pd.concat(dflist), schema=PARSED_OUTCAR_SCHEMA, preserve_index=False)
+    fpart = dsdir / f"part-{uuid.uuid4().hex}.parquet"
+    tmp = dsdir / f".{fpart.name}.tmp"  # hidden from dataset readers until renamed
+    pq.write_table(table, tmp)
+    tmp.replace(fpart)
+    return fpart
+
+
+def load_parsed_stamps(dsdir: Path):
+    """Stamp of each fname in the dataset, and the fnames found with several stamps
+
+    A run stopped between writing a new part and evicting the old rows leaves
+    both versions of an OUTCAR, those fnames are not trusted and parsed again.
+    """
+    if not any(dsdir.glob("part-*.parquet")):
+        return {}, set()
+    stamps = pd.read_parquet(dsdir, columns=["fname", "stamp"]).drop_duplicates()
+    multiple = stamps["fname"].duplicated(keep=False)
+    known = dict(zip(stamps.loc[~multiple, "fname"], stamps.loc[~multiple, "stamp"]))
+    return known, set(stamps.loc[multiple, "fname"])
+
+
+def drop_parsed_fnames(dsdir: Path, fnames: set, exclude=()):
+    """Remove all rows of ``fnames`` from the part files except ``exclude``"""
+    drop = pa.array(list(fnames), type=pa.string())
+    for fpart in set(dsdir.glob("part-*.parquet")) - set(exclude):
+        keep = pc.invert(pc.is_in(pq.read_table(fpart, columns=["fname"])["fname"], value_set=drop))
+        if pc.all(keep).as_py():
+            continue
+        table = pq.read_table(fpart).filter(keep)
+        if table.num_rows == 0:
+            fpart.unlink()
+        else:
+            tmp = dsdir / f".{fpart.name}.tmp"
+            pq.write_table(table, tmp)
+            tmp.replace(fpart)
+
+
+def read_parsed_outcar(indir, columns=None, filters=None) -> pd.DataFrame:
+    """Read the parsed_outcar.parquet dataset written by parse_outcar
+
+    Parameters
+    ----------
+    indir : Path
+        directory passed to parse_outcar
+    columns : list[str], optional
+        columns to load besides fname and step, all but the internal stamp
+        if not given
+    filters : list, optional
+        row filters pushed down to pyarrow, e.g. ``[("converge", "==", True)]``
+
+    Returns
+    -------
+    pd.DataFrame
+        indexed by (fname, step), same layout as the former parsed_outcar.pkl
+    """
+    dsdir = Path(indir).joinpath("parsed_outcar.parquet")
+    if columns is None:
+        columns = [col for col in PARSED_OUTCAR_SCHEMA.names if col != "stamp"]
+    columns = ["fname", "step", *[col for col in columns if col not in ("fname", "step")]]
+    df = pd.read_parquet(dsdir, columns=columns, filters=filters)
+    return df.set_index(["fname", "step"]).sort_index()
+
+
+def stat_parsed_steps(steps: pd.DataFrame) -> pd.DataFrame:
+    """Vectorized :func:`stat_outcar_dfdict` over the long (fname, step) table"""
+    steps = steps.sort_values(["fname", "step"])
+    first = steps.drop_duplicates("fname", keep="first").set_index("fname")
+    last = steps.drop_duplicates("fname", keep="last").set_index("fname")
+    stat_df = pd.DataFrame(
+        {
+            "formula": first["formula"],
+            "converge": last["converge"],
+            "decreased_enth": first["enthalpy"] - last["enthalpy"],
+            "ion_steps": steps.groupby("fname").size(),
+            "natoms": first["natoms"],
+            "nsites": first["nsites"],
+            "enthalpy": last["enthalpy"],
+        }
+    )
     stat_df["decreased_enth_per_atom"] = stat_df["decreased_enth"] / stat_df["natoms"]
+    stat_df["enthalpy_per_atom"] = stat_df["enthalpy"] / stat_df["natoms"]
+    stat_df = stat_df[STAT_COLUMNS]
     stat_df.index.name = "fname"
     return stat_df
 
 
 @logit()
-def parse_outcar(indir, njobs, *args, **kwargs):
+def parse_outcar(indir, njobs, summary_only=False, use_cache=True, use_hash=False, batch_rows=100000, skip_finished=False, walk_threads=8, *args, **kwargs):
     indir = Path(indir)
-    outcars = list(chain(indir.rglob("OUTCAR"), indir.rglob("*.OUTCAR")))
-    if len(outcars) == 0:
+    set_report(indir.joinpath("parse_outcar.profile.json"))
+    if summary_only:
+        outcars = [foutcar for foutcar, _ in walk_outcars(indir, nthreads=walk_threads)]
+        if len(outcars) == 0:
+            raise ValueError("No OUTCAR or *.OUTCAR found")
+        serlist = Parallel(njobs, backend="multiprocessing")(
+            delayed(summarize_one_outcar)(foutcar)
+            for foutcar in tqdm(outcars, ncols=120)
+        )
+        for foutcar, ser in zip(outcars, serlist):
+            ser.name = str(foutcar.relative_to(indir))
+        stat_df = stat_outcar_serlist(serlist).sort_index()
+        print(stat_df)
+        logger.info("summary only, parsed_outcar.parquet is not updated")
+        with stage("write_table"):
+            write_format_table(stat_df, indir.joinpath("parsed_outcar.table"))
+        return
+
+    dsdir = indir.joinpath("parsed_outcar.parquet")
+    findex = indir.joinpath("parsed_outcar.index.json")
+    dsdir.mkdir(exist_ok=True)
+    if not use_cache:
+        for fpart in dsdir.glob("part-*.parquet"):
+            fpart.unlink()
+        findex.unlink(missing_ok=True)
+    known, conflicted = load_parsed_stamps(dsdir)
+    skipdirs = load_outcar_index(findex) if skip_finished else {}
+
+    # the walk feeds the pool directly, unchanged OUTCAR are filtered on the way
+    found = {}
+
+    def todo():
+        for foutcar, stat in walk_outcars(indir, skipdirs, walk_threads):
+            fname = str(foutcar.relative_to(indir))
+            if stat is None and fname in known:
+                stamp = known[fname]
+            else:
+                stamp = file_stamp(foutcar, use_hash, stat)
+            found[fname] = stamp
+            if known.get(fname, None) != stamp:
+                yield fname, stamp, foutcar
+
+    # stream parsed DataFrame to part files as workers finish
+    newparts = []
+    nparsed = 0
+    with multiprocessing.Pool(effective_n_jobs(njobs)) as pool:
+        batch, nrows = [], 0
+        for parsed_df in tqdm(pool.imap_unordered(parse_one_outcar_keyed, todo()), ncols=120):
+            nparsed += 1
+            batch.append(parsed_df)
+            nrows += len(parsed_df)
+            if nrows >= batch_rows:
+                with stage("write_part", items=nrows):
+                    newparts.append(write_parsed_part(dsdir, batch))
+                batch, nrows = [], 0
+        if len(batch) > 0:
+            with stage("write_part", items=nrows):
+                newparts.append(write_parsed_part(dsdir, batch))
+    if len(found) == 0:
         raise ValueError("No OUTCAR or *.OUTCAR found")
-    parsed_dflist = Parallel(njobs, backend="multiprocessing")(
-        delayed(parse_one_outcar)(foutcar)
-        for foutcar in tqdm(outcars, ncols=120)
-    )
-    parsed_dfdict = {
-        str(foutcar.relative_to(indir)): parsed_df
-        for foutcar, parsed_df in zip(outcars, parsed_dflist)
-    }
-    stat_df = stat_outcar_dfdict(parsed_dfdict)
-    print(stat_df)
 
-    with open(indir.joinpath("parsed_outcar.pkl"), "wb") as f:
-        parsed_df = pd.concat(parsed_dfdict, keys=parsed_dfdict.keys())
-        parsed_df.index.names = ["fname", "step"]
-        pickle.dump(parsed_df, f)
-    with open(indir.joinpath("parsed_outcar.table"), "w") as f:
-        f.write(to_format_table(stat_df))
+    # entries whose OUTCAR is changed or no longer found are evicted
+    stale = {fname for fname, stamp in known.items() if found.get(fname, None) != stamp} | conflicted
+    if len(stale) > 0:
+        with stage("evict"):
+            drop_parsed_fnames(dsdir, stale, exclude=newparts)
+    logger.info(f"{len(found) - nparsed} OUTCAR cached, {nparsed} parsed, {len(stale)} entries evicted or outdated")
 
+    with stage("stat"):
+        steps = pd.read_parquet(dsdir, columns=["fname", "step", "formula", "converge", "cputime", "enthalpy", "natoms", "nsites"])
+        stat_df = stat_parsed_steps(steps).loc[sorted(found)]
+    print(stat_df)
 
-def add_subparser(subparsers):
-    subparser = subparsers.add_parser(
-        __name__.split(".")[-1],
-        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
-        description="""Parse all OUTCAR and *.OUTCAR, return list of DataFrame
-to parsed_outcar.pkl and summary to parsed_outcar.table"""
-    )
-    subparser.set_defaults(func=parse_outcar)
-    subparser.add_argument("indir", help="directory containing OUTCAR or *.OUTCAR")
+    with stage("write_table"):
+        write_format_table(stat_df, indir.joinpath("parsed_outcar.table"))
+        save_outcar_index(findex, steps)
@@ -0,0 +1,98 @@
+# minimal POSCAR/CONTCAR reader giving the spglib cell without ase or pymatgen objects
+#
+# Only the lattice, scaled positions and atomic numbers are read, selective
+# dynamics flags, velocities and predictor-corrector data are skipped. Atoms or
+# Structure are built from the cell when a caller needs them.
+
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+from ase.data import atomic_numbers, chemical_symbols
+from ase.formula import Formula
+
+
+class Cell(NamedTuple):
+    """spglib style cell, unpacks as (lattice, positions, numbers)"""
+
+    lattice: np.ndarray  # (3, 3), rows are the lattice vectors
+    positions: np.ndarray  # (n, 3), scaled
+    numbers: np.ndarray  # (n,)
+
+    def to_atoms(self):
+        from ase import Atoms
+
+        return Atoms(self.numbers, cell=self.lattice, scaled_positions=self.positions, pbc=True)
+
+    def to_structure(self):
+        from pymatgen.core.structure import Structure
+
+        return Structure(self.lattice, self.numbers, self.positions)
+
+    @property
+    def formula(self) -> str:
+        return chemical_formula(self.numbers)
+
+    @property
+    def reduced_formula(self) -> str:
+        return chemical_formula(self.numbers, reduce=True)
+
+
+def chemical_formula(numbers, reduce=False) -> str:
+    """formula as ase get_chemical_formula("metal") gives it, counts divided by their gcd if reduce"""
+    formula = Formula.from_list([chemical_symbols[z] for z in np.asarray(numbers).tolist()])
+    if reduce:
+        formula, _ = formula.reduce()
+    return formula.format("metal")
+
+
+def _symbol(token: str) -> str:
+    # VASP 5.4+ writes "Fe_pv/<hash>" from the POTCAR titles
+    return token.split("/")[0].split("_")[0]
+
+
+def parse_poscar(text: str) -> Cell:
+    lines = text.splitlines()
+    scale = np.array(lines[1].split(), dtype=float)
+    lattice = np.array([line.split()[:3] for line in lines[2:5]], dtype=float)
+    tokens = lines[5].split()
+    if all(t.isdigit() for t in tokens):
+        # VASP 4, the symbols are taken from the comment line as ase does
+        counts = [int(t) for t in tokens]
+        symbols = [_symbol(t) for t in lines[0].split()[:len(counts)]]
+        iline = 6
+    else:
+        symbols = [_symbol(t) for t in tokens]
+        counts = [int(t) for t in lines[6].split()[:len(symbols)]]
+        iline = 7
+    if len(symbols) != len(counts) or any(sym not in atomic_numbers for sym in symbols):
+        raise ValueError(f"cannot find the species of the POSCAR: {symbols}")
+    if lines[iline].lstrip().startswith(("s", "S")):  # selective dynamics
+        iline += 1
+    cartesian = lines[iline].lstrip().startswith(("c", "C", "k", "K"))
+    natoms = sum(counts)
+    block = lines[iline + 1:iline + 1 + natoms]
+    if len(block) < natoms:
+        raise ValueError(f"POSCAR has {len(block)} positions, {natoms} expected")
+    flat = " ".join(block).split()
+    if len(flat) == 3 * natoms:
+        positions = np.array(flat, dtype=float).reshape(natoms, 3)
+    else:  # flags or symbols after the coordinates
+        positions = np.array([line.split()[:3] for line in block], dtype=float)
+
+    if len(scale) == 3:
+        lattice = lattice * scale
+    elif scale[0] < 0:  # the volume of the cell
+        scale = (-scale[0] / abs(np.linalg.det(lattice))) ** (1 / 3)
+        lattice = lattice * scale
+    else:
+        lattice = lattice * scale[0]
+    if cartesian:
+        positions = np.linalg.solve(lattice.T, (positions * scale).T).T
+    numbers = np.repeat([atomic_numbers[sym] for sym in symbols], counts)
+    return Cell(lattice, positions, numbers)
+
+
+def read_poscar(fname) -> Cell:
+    """(lattice, scaled positions, numbers) of a POSCAR/CONTCAR"""
+    return parse_poscar(Path(fname).read_text())
@@ -1,17 +1,22 @@
-import argparse
+import asyncio
+import json
 import logging
 import os
+import shlex
+import signal
 import warnings
 import shutil
-import subprocess
+from contextlib import suppress
 from itertools import product
 from pathlib import Path
+from typing import Optional
 
 import numpy as np
 from pymatgen.io.vasp import Poscar, Potcar
 from joblib import Parallel, delayed
 
 from cdakit.log import logit
+from cdakit.profiling import profiled, set_report, stage
 
 
 logger = logging.getLogger(__name__)
@@ -56,17 +61,27 @@ def vasp2inputdat(poscar, potcar, dist_ratio, popsize):
     return inputdat
 
 
-@logit()
-def prepare_calypso(njobs, indir, dist_ratio, popsize, calypsocmd, calypsotimeout, **kwargs):
-    indir = Path(indir)
-    Parallel(njobs, backend="multiprocessing")(
-        delayed(prepare_calypso_one)(indir, fposcar, dist_ratio, popsize, calypsocmd, calypsotimeout)
-        for fposcar in indir.rglob("POSCAR")
-    )
+STATE_FILE = "calypso.state.jsonl"
 
 
-def prepare_calypso_one(indir, fposcar, dist_ratio, popsize, calypsocmd, calypsotimeout):
-    outdir = indir.with_name(f"{indir.name}.calypso")
+def load_state(fstate: Path) -> dict[str, dict]:
+    """last record of each calypso dir in the state file, a torn last line is ignored"""
+    state = {}
+    if not fstate.exists():
+        return state
+    with open(fstate) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            state[record["dir"]] = record
+    return state
+
+
+@profiled("calypso_prepare")
+def prepare_calypso_dir(indir, fposcar, outdir, dist_ratio, popsize):
+    """Write input.dat and copy INCAR/POTCAR/KPOINTS of fposcar to its calypso dir"""
     logger.info(f"Processing {fposcar.parent}")
     with warnings.catch_warnings():
         warnings.simplefilter("ignore")
@@ -82,48 +97,165 @@ def prepare_calypso_one(indir, fposcar, dist_ratio, popsize, calypsocmd, calypso
             shutil.copy(fposcar.with_name(f), calypsodir)
         except FileNotFoundError:
             logger.warning(f"{str(fposcar.with_name(f))} not found")
-    # run calypso
-    try:
-        os.remove(calypsodir.joinpath("step"))
-    except FileNotFoundError:
-        pass
-    with open(calypsodir.joinpath("caly.log"), "w") as calylog:
-        try:
-            proc = subprocess.run(
-                calypsocmd, stdout=calylog, stderr=subprocess.STDOUT, cwd=calypsodir,
-                timeout=calypsotimeout,
+    return calypsodir
+
+
+def split_calypso_poscars(calypsodir: Path, popsize):
+    """move POSCAR_* written by CALYPSO to calc/<i>/POSCAR along with the VASP inputs"""
+    for popi in range(1, popsize + 1):
+        calcdir = calypsodir.joinpath(f"calc/{popi}")
+        calcdir.mkdir(parents=True, exist_ok=True)
+        shutil.move(calypsodir / f"POSCAR_{popi}", calcdir / "POSCAR")
+        for f in ["INCAR", "POTCAR", "KPOINTS"]:
+            try:
+                shutil.copy(calypsodir / f, calcdir)
+            except FileNotFoundError:
+                pass
+
+
+class CalypsoScheduler:
+    """Run CALYPSO in many dirs from one process, at most concurrency at a time
+
+    Each run gets timeout seconds, a failed or timed out run is tried again up
+    to retries times. The outcome of every dir is appended to the state file,
+    dirs already done there are skipped by the next run.
+    """
+
+    def __init__(self, cmd: list[str], popsize, concurrency=1, timeout=180, retries=2, fstate: Optional[Path] = None):
+        self.cmd = cmd
+        self.popsize = popsize
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self.retries = retries
+        self.fstate = fstate
+        self.results = {}
+
+    def key(self, calypsodir: Path) -> str:
+        """key of calypsodir in the state file, relative to the state file dir if below it"""
+        calypsodir = Path(calypsodir).resolve()
+        if self.fstate is not None:
+            with suppress(ValueError):
+                return str(calypsodir.relative_to(Path(self.fstate).parent.resolve()))
+        return str(calypsodir)
+
+    def record(self, calypsodir: Path, status: str, attempts: int, returncode=None):
+        record = {"dir": self.key(calypsodir), "status": status, "attempts": attempts, "returncode": returncode}
+        self.results[record["dir"]] = record
+        if self.fstate is not None:
+            with open(self.fstate, "a") as f:
+                f.write(json.dumps(record) + "\n")
+
+    async def run_once(self, calypsodir: Path):
+        """returncode of one CALYPSO run, None if it timed out"""
+        for fstep in (calypsodir / "step", *calypsodir.glob("POSCAR_*")):
+            fstep.unlink(missing_ok=True)
+        with open(calypsodir.joinpath("caly.log"), "w") as calylog:
+            # own session, so a timed out CALYPSO is killed with the jobs it started
+            proc = await asyncio.create_subprocess_exec(
+                *self.cmd, stdout=calylog, stderr=asyncio.subprocess.STDOUT, cwd=calypsodir,
+                start_new_session=True,
             )
-        except subprocess.TimeoutExpired:
-            logger.error(f"CALYPSO failed in {str(calypsodir)}")
-        else:
-            # split POSCAR_* to subdir
-            if proc.returncode != 0:
-                logger.error(f"Calling {calypsocmd} failed in {calypsodir}")
+            try:
+                return await asyncio.wait_for(proc.wait(), self.timeout)
+            except asyncio.TimeoutError:
+                return None
+            finally:
+                # also on cancellation or Ctrl-C, CALYPSO in its own session
+                # does not get the SIGINT of the terminal
+                if proc.returncode is None:
+                    with suppress(ProcessLookupError):
+                        os.killpg(proc.pid, signal.SIGKILL)
+                    await proc.wait()
+                # clean dir
+                for pyfile in calypsodir.glob("*.py"):
+                    os.remove(pyfile)
+
+    async def run_one(self, calypsodir: Path):
+        for attempt in range(1, self.retries + 2):
+            returncode = await self.run_once(calypsodir)
+            if returncode == 0:
+                try:
+                    split_calypso_poscars(calypsodir, self.popsize)
+                except FileNotFoundError as e:
+                    logger.error(f"CALYPSO did not write {e.filename} in {calypsodir}")
+                    returncode = "missing POSCAR"
+                else:
+                    self.record(calypsodir, "done", attempt, returncode)
+                    return
+            if returncode is None:
+                logger.error(f"CALYPSO timed out after {self.timeout} s in {calypsodir}, attempt {attempt}")
             else:
-                for popi in range(1, popsize + 1):
-                    calcdir = calypsodir.joinpath(f"calc/{popi}")
-                    calcdir.mkdir(parents=True, exist_ok=True)
-                    shutil.move(calypsodir / f"POSCAR_{popi}", calcdir / "POSCAR")
-                    for f in ["INCAR", "POTCAR", "KPOINTS"]:
-                        try:
-                            shutil.copy(calypsodir / f, calcdir)
-                        except FileNotFoundError:
-                            pass
+                logger.error(f"Calling {' '.join(self.cmd)} failed ({returncode}) in {calypsodir}, attempt {attempt}")
+        self.record(calypsodir, "failed", attempt, returncode)
+
+    async def worker(self, queue: asyncio.Queue):
+        while True:
+            calypsodir = await queue.get()
+            try:
+                await self.run_one(calypsodir)
+            except Exception as e:
+                # e.g. CALYPSO cannot be started or its POSCAR not moved, the
+                # worker goes on with the next dir so the queue is drained
+                logger.error(f"CALYPSO in {calypsodir} failed: {e!r}")
+                self.record(calypsodir, "failed", None, f"{type(e).__name__}: {e}")
+            finally:
+                queue.task_done()
+
+    async def run_all(self, calypsodirs):
+        queue = asyncio.Queue()
+        for calypsodir in calypsodirs:
+            queue.put_nowait(calypsodir)
+        workers = [asyncio.create_task(self.worker(queue)) for _ in range(min(self.concurrency, queue.qsize()))]
+        try:
+            await queue.join()
         finally:
-            # clean dir
-            for pyfile in calypsodir.glob("*.py"):
-                os.remove(pyfile)
+            for w in workers:
+                w.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
 
+    def run(self, calypsodirs) -> dict[str, dict]:
+        asyncio.run(self.run_all(calypsodirs))
+        return self.results
 
-def add_subparser(subparsers):
-    subparser = subparsers.add_parser(
-        __name__.split(".")[-1],
-        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
-        description="generate input.dat follow each POSCAR in subdir",
+
+@logit()
+def prepare_calypso(njobs, indir, dist_ratio, popsize, calypsocmd, calypsotimeout,
+                    concurrency=None, retries=2, restart=False, **kwargs):
+    indir = Path(indir)
+    outdir = indir.with_name(f"{indir.name}.calypso")
+    set_report(indir.with_name("prepare_calypso.profile.json"))
+    cmd = shlex.split(calypsocmd)
+    executable = shutil.which(cmd[0])
+    if executable is None:
+        raise FileNotFoundError(f"CALYPSO executable '{cmd[0]}' not found")
+    cmd[0] = os.path.abspath(executable)  # CALYPSO runs in each calypso dir
+
+    outdir.mkdir(parents=True, exist_ok=True)
+    fstate = outdir / STATE_FILE
+    if restart:
+        fstate.unlink(missing_ok=True)
+    state = load_state(fstate)
+    scheduler = CalypsoScheduler(
+        cmd, popsize, concurrency if concurrency is not None else njobs, calypsotimeout, retries, fstate,
     )
-    subparser.set_defaults(func=prepare_calypso)
-    subparser.add_argument("indir", help="directory with each POSCAR/POTCAR/KPOINTS in a subdir")
-    subparser.add_argument("-r", "--dist_ratio", type=float, default=0.7, help="distance ratio multipied on RCORE to generate DistanceOfIon")
-    subparser.add_argument("-p", "--popsize", type=int, default=10, help="PopSize")
-    subparser.add_argument("-c", "--calypsocmd", default="calypso.x", help="CALYPSO executable file")
-    subparser.add_argument("-t", "--calypsotimeout", type=float, default=180, help="maxtime for each calypso subprocess")
+    fposcars = []
+    for fposcar in sorted(indir.rglob("POSCAR")):
+        calypsodir = outdir.joinpath(fposcar.parent.relative_to(indir))
+        if state.get(scheduler.key(calypsodir), {}).get("status") == "done":
+            continue
+        fposcars.append(fposcar)
+    ndone = sum(record["status"] == "done" for record in state.values())
+    if ndone > 0:
+        logger.info(f"{ndone} dirs already done in {fstate}, {len(fposcars)} to run")
+
+    with stage("prepare"):
+        calypsodirs = Parallel(njobs, backend="multiprocessing")(
+            delayed(prepare_calypso_dir)(indir, fposcar, outdir, dist_ratio, popsize)
+            for fposcar in fposcars
+        )
+    with stage("calypso", items=len(calypsodirs)):
+        results = scheduler.run(calypsodirs)
+    failed = [record["dir"] for record in results.values() if record["status"] != "done"]
+    logger.info(f"CALYPSO done in {len(results) - len(failed)} dirs, failed in {len(failed)}")
+    if len(failed) > 0:
+        logger.warning(f"failed dirs are run again by the next call: {' '.join(failed[:10])}")
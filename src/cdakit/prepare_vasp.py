@@ -1,21 +1,94 @@
-import argparse
 import logging
+import os
+import shutil
 import warnings
+from itertools import groupby
 from pathlib import Path
+from typing import Optional
 
+import pandas as pd
 from joblib import Parallel, delayed
-from pymatgen.core.structure import Structure
-from pymatgen.io.vasp import VaspInput
 from pymatgen.io.vasp.sets import MPRelaxSet
 from tqdm import tqdm
 
-from cdakit.iotools import read_format_table
+from cdakit.iotools import index_to_stems, read_format_table
 from cdakit.log import logit
+from cdakit.profiling import profiled, set_report
+from cdakit.store import glob_vasp, is_store, read_structure, vasp_exists
 
 logger = logging.getLogger(__name__)
 
 
-def prepare_task(structure, relax_path, vaspargs):
+# per worker process caches, filled by the first structure of each key
+_incar_cache = {}  # (site symbols, functional, user settings) -> Incar template
+_potcar_cache = {}  # (potcar symbols, functional) -> (Potcar, shared POTCAR file)
+
+POTCAR_FUNCTIONAL = "PBE_54"
+USER_POTCAR_SETTINGS = {"W": "W_sv"}
+
+
+def _settings_key(settings: dict):
+    return tuple(sorted((k, repr(v)) for k, v in settings.items()))
+
+
+def get_incar(mp_set: MPRelaxSet, user_incar_settings: dict):
+    """INCAR of mp_set, from the cached template of its elements and settings
+
+    Only MAGMOM and EDIFF (from EDIFF_PER_ATOM) depend on the structure
+    itself once the elements and settings are fixed, they are filled per
+    structure. Structures with magmom or oxidation states go the full way.
+    """
+    structure = mp_set.structure
+    if "magmom" in structure.site_properties or any(hasattr(sp, "oxi_state") for sp in structure.types_of_species):
+        return mp_set.incar
+    symbols = tuple(sym for sym, _ in groupby(site.species_string for site in structure))
+    key = (symbols, mp_set.user_potcar_functional, _settings_key(user_incar_settings))
+    if key not in _incar_cache:
+        _incar_cache[key] = mp_set.incar
+        return _incar_cache[key].copy()
+    incar = _incar_cache[key].copy()
+    config = mp_set.CONFIG["INCAR"]
+    if "MAGMOM" in incar:
+        magmom = config.get("MAGMOM", {})
+        incar["MAGMOM"] = [magmom.get(site.species_string, 0.6) for site in structure]
+    if "EDIFF" not in user_incar_settings and "EDIFF" not in config and "EDIFF_PER_ATOM" in config:
+        incar["EDIFF"] = float(config["EDIFF_PER_ATOM"]) * len(structure)
+    return incar
+
+
+def get_potcar(mp_set: MPRelaxSet, shared_dir: Path):
+    """POTCAR of mp_set loaded once per worker, and its copy in shared_dir to link from"""
+    symbols = tuple(mp_set.potcar_symbols)
+    key = (symbols, mp_set.user_potcar_functional)
+    if key not in _potcar_cache:
+        potcar = mp_set.potcar
+        fshared = shared_dir / f"POTCAR.{mp_set.user_potcar_functional}.{'-'.join(symbols)}"
+        if not fshared.exists():
+            shared_dir.mkdir(parents=True, exist_ok=True)
+            # another worker may write the same file, both are complete when renamed
+            tmp = fshared.with_name(f".{fshared.name}.{os.getpid()}.tmp")
+            potcar.write_file(tmp)
+            tmp.replace(fshared)
+        _potcar_cache[key] = (potcar, fshared)
+    return _potcar_cache[key]
+
+
+def link_file(src: Path, dst: Path, mode="hard"):
+    """Link dst to src by mode hard/sym/copy, falling back to a copy"""
+    dst.unlink(missing_ok=True)
+    if mode == "hard":
+        try:
+            os.link(src, dst)
+            return
+        except OSError:  # another filesystem, or no hardlinks
+            pass
+    elif mode == "sym":
+        os.symlink(os.path.relpath(src, dst.parent), dst)
+        return
+    shutil.copyfile(src, dst)
+
+
+def prepare_task(structure, relax_path, vaspargs, potcar_link="hard"):
     user_incar_settings = {
         'LREAL': False,
         'ISMEAR': 0,
@@ -36,64 +109,90 @@ def prepare_task(structure, relax_path, vaspargs):
         mp_set = MPRelaxSet(
             structure,
             user_incar_settings=user_incar_settings,
-            user_potcar_settings={"W": "W_sv"},
-            user_potcar_functional="PBE_54",
-        )
-        vasp = VaspInput(
-            incar=mp_set.incar,
-            kpoints=mp_set.kpoints,
-            poscar=mp_set.poscar,
-            potcar=mp_set.potcar,
+            user_potcar_settings=USER_POTCAR_SETTINGS,
+            user_potcar_functional=POTCAR_FUNCTIONAL,
         )
-        vasp.write_input(relax_path)
+        relax_path = Path(relax_path)
+        get_incar(mp_set, user_incar_settings).write_file(relax_path / "INCAR")
+        kpoints = mp_set.kpoints
+        if kpoints is not None:
+            kpoints.write_file(relax_path / "KPOINTS")
+        mp_set.poscar.write_file(relax_path / "POSCAR")
+        potcar, fshared = get_potcar(mp_set, relax_path.parent / ".potcar")
+        if potcar_link == "copy":
+            potcar.write_file(relax_path / "POTCAR")
+        else:
+            link_file(fshared, relax_path / "POTCAR", potcar_link)
+
+
+def select_stems(ftable, column: str, top: Optional[int] = None, largest=False) -> list[str]:
+    """Stems of the rows selected from ftable by column
+
+    A boolean column selects the rows that are True, a numeric one with top
+    selects the top rows of the smallest (largest) values, NaN excluded.
+    """
+    df = read_format_table(ftable)
+    if column not in df.columns:
+        raise KeyError(f"column '{column}' not in {ftable}, choose from {list(df.columns)}")
+    values = df[column]
+    if top is None:
+        if not pd.api.types.is_bool_dtype(values):
+            raise ValueError(f"column '{column}' of {ftable} is not boolean, give --top to rank by it")
+        selected = values[values]
+    else:
+        if not pd.api.types.is_numeric_dtype(values):
+            raise ValueError(f"column '{column}' of {ftable} is not numeric, it can not be ranked")
+        values = values.dropna()
+        selected = values.nlargest(top) if largest else values.nsmallest(top)
+    stems = index_to_stems(selected.index)
+    return list(stems[~stems.duplicated()])
+
 
+def selection_label(column: str, uniqlevel: str, top: Optional[int]) -> str:
+    """suffix of the output dir for the selection, .uniq.<level> for the unique flags"""
+    if top is not None:
+        return f".top{top}.{column}"
+    if column == f"matcher_{uniqlevel}":
+        return f".uniq.{uniqlevel}"
+    return f".{column}"
 
-def wrapped_prepare_task(indir, uniq, uniqlevel, sf, vaspargs):
-    runtype = ".scf" if vaspargs["nsw"] <= 1 else ".opt"
-    if uniq is not None:
-        runtype = f".uniq.{uniqlevel}" + runtype
-    relax_path = indir.with_suffix(runtype).joinpath(sf.stem)
+
+@profiled("prepare_task")
+def wrapped_prepare_task(outdir: Path, sf: Path, vaspargs, potcar_link="hard"):
+    relax_path = outdir.joinpath(sf.stem)
     relax_path.mkdir(exist_ok=True, parents=True)
 
-    structure = Structure.from_file(sf)
-    prepare_task(structure, relax_path, vaspargs)
+    structure = read_structure(sf)
+    prepare_task(structure, relax_path, vaspargs, potcar_link)
 
 
 @logit()
-def prepare_vasp_batch(indir, uniqfile, uniqlevel, njobs, ediff, ediffg, nsw, pstress, kspacing, sym, **kwargs):
+def prepare_vasp_batch(indir, uniqfile, uniqlevel, njobs, ediff, ediffg, nsw, pstress, kspacing, sym,
+                       potcar_link="hard", column=None, top=None, largest=False, chunksize=16, **kwargs):
     vaspargs = {"ediff": ediff, "ediffg": ediffg, "nsw": nsw,
                "pstress": pstress, "kspacing": kspacing, "sym": sym}
     logger.info("You are using " + " ".join(f"{k}={v}" for k, v in vaspargs.items()))
     logger.warning("W POTCAR is replaced by W_sv")
     indir = Path(indir)
-    flist = list(indir.glob("*.vasp"))
-    if uniqfile is not None:
-        lv = f"matcher_{uniqlevel}"
-        uniqdf = read_format_table(uniqfile)
-        if lv not in uniqdf.columns:
-            raise KeyError(f"key '{uniqlevel}' not in {uniqfile}")
-        logger.info(f"using unique key '{lv}' in {uniqfile}")
-        uniqlist = list(uniqdf[uniqdf[lv]].index)
-        flist = [fi for fi in flist if int(fi.stem) in uniqlist]
-    Parallel(njobs, backend="multiprocessing")(
-        delayed(wrapped_prepare_task)(indir, uniqfile, uniqlevel, sf, vaspargs)
+    if is_store(indir):
+        logger.warning(f"{indir} is a structure store, selective dynamics flags of the packed *.vasp are not kept")
+    set_report(indir.with_name("prepare_vasp.profile.json"))
+    runtype = ".scf" if nsw <= 1 else ".opt"
+    if uniqfile is None:
+        flist = sorted(glob_vasp(indir))
+    else:
+        column = column if column is not None else f"matcher_{uniqlevel}"
+        stems = select_stems(uniqfile, column, top, largest)
+        logger.info(f"{len(stems)} structures selected by '{column}' in {uniqfile}")
+        runtype = selection_label(column, uniqlevel, top) + runtype
+        # only the selected files are looked up, the directory is not listed
+        flist = [indir / f"{stem}.vasp" for stem in stems]
+        missing = [sf.name for sf in flist if not vasp_exists(sf)]
+        if len(missing) > 0:
+            logger.warning(f"{len(missing)} selected structures not in {indir}: {' '.join(missing[:10])}")
+            flist = [sf for sf in flist if vasp_exists(sf)]
+    outdir = indir.with_suffix(runtype)
+    Parallel(njobs, backend="multiprocessing", batch_size=chunksize)(
+        delayed(wrapped_prepare_task)(outdir, sf, vaspargs, potcar_link)
         for sf in tqdm(flist, ncols=120)
     )
-
-
-def add_subparser(subparsers):
-    subparser = subparsers.add_parser(
-        __name__.split(".")[-1],
-        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
-    )
-    subparser.set_defaults(func=prepare_vasp_batch)
-    subparser.add_argument("indir", help="directory containing *.vasp")
-    subparser.add_argument("-u", "--uniqfile",                                            help="unique file to read")
-    subparser.add_argument("-l", "--uniqlevel", choices=["lo", "md", "st"], default="lo", help="unique level of matcher used in uniqfile")
-    subparser.add_argument("-e", "--ediff", type=float,                                   help="EDIFF, autogenerate by pyamtgen if None")
-    subparser.add_argument("-eg", "--ediffg", type=float,                                 help="EDIFFG")
-    subparser.add_argument("-n", "--nsw", type=int , default=0,                          help="NSW")
-    subparser.add_argument("-p", "--pstress", type=float, default=0,                      help="PSTRESS(kbar)")
-    subparser.add_argument("-ks", "--kspacing",                                           help="KSPACING")
-    subparser.add_argument("-s", "--sym", type=int, default=0,                            help="ISYM, suggest 0/2")
-
@@ -0,0 +1,212 @@
+# per-stage timers, worker throughput and peak RSS of a subcommand
+#
+# Enabled by `cdakit --profile`, the env var CDAKIT_PROFILE carries the switch
+# to worker processes. Workers send their timings as records of the
+# "cdakit.profile" logger through the log queue, the ProfileCollector on the
+# listener side sums them up and writes the JSON report when the subcommand
+# sends its own timings at the end.
+
+import json
+import logging
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+from typing import Optional
+
+PROFILE_ENV = "CDAKIT_PROFILE"
+
+logger = logging.getLogger("cdakit.profile")
+logger.setLevel(logging.DEBUG)  # records are dropped by NoProfileFilter, not by level
+
+_stages: dict[str, list] = {}  # name -> [calls, seconds, items]
+_task_stages: set[str] = set()  # stages of whole tasks, the others are nested in them
+_report: Optional[Path] = None
+_main_pid: Optional[int] = None  # the process running profile_run, its stages go to the report
+
+
+def _reset_in_child():
+    # a forked worker must not report the stages its parent recorded before the fork
+    _stages.clear()
+    _task_stages.clear()
+
+
+os.register_at_fork(after_in_child=_reset_in_child)
+
+
+def enabled() -> bool:
+    return os.environ.get(PROFILE_ENV, "") != ""
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF) -> float:
+    # ru_maxrss is in KiB on Linux, bytes on macOS
+    maxrss = resource.getrusage(who).ru_maxrss
+    return maxrss / 2**20 if sys.platform == "darwin" else maxrss / 2**10
+
+
+def add_stage(name: str, seconds: float, items: int = 0):
+    calls_seconds_items = _stages.setdefault(name, [0, 0.0, 0])
+    calls_seconds_items[0] += 1
+    calls_seconds_items[1] += seconds
+    calls_seconds_items[2] += items
+
+
+@contextmanager
+def stage(name: str, items: int = 0):
+    """Time the block as stage name, nothing is recorded unless profiling is on"""
+    if not enabled():
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stage(name, time.perf_counter() - t0, items)
+
+
+def _stages_dict(stages) -> dict:
+    return {name: {"calls": c, "seconds": s, "items": i} for name, (c, s, i) in stages.items()}
+
+
+def flush_worker():
+    """Send the timings of this worker process through the log queue and reset them"""
+    if len(_stages) == 0 or os.getpid() == _main_pid:
+        return
+    payload = {
+        "kind": "worker",
+        "pid": os.getpid(),
+        "stages": _stages_dict(_stages),
+        "task_stages": sorted(_task_stages),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    _stages.clear()
+    logger.debug("profile", extra={"profile": payload})
+
+
+def profiled(name: str):
+    """Decorate the function run by pool workers, one call is one task of stage name"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled():
+                return func(*args, **kwargs)
+            _task_stages.add(name)
+            with stage(name, items=1):
+                ret = func(*args, **kwargs)
+            flush_worker()
+            return ret
+        return wrapper
+    return decorator
+
+
+def set_report(fname):
+    """Where the JSON report of the running subcommand is written, next to its output"""
+    global _report
+    _report = Path(fname)
+
+
+@contextmanager
+def profile_run(subcommand: str, profiler: Optional[str] = None):
+    """Profile a subcommand run in this process, then send the report request"""
+    global _report, _main_pid
+    os.environ[PROFILE_ENV] = "1"
+    _stages.clear()
+    _report = None
+    _main_pid = os.getpid()
+    capture = None
+    if profiler == "cprofile":
+        import cProfile
+        capture = cProfile.Profile()
+        capture.enable()
+    elif profiler == "pyinstrument":
+        try:
+            import pyinstrument
+        except ImportError:
+            logging.getLogger(__name__).warning("pyinstrument is not installed, profiling without it")
+        else:
+            capture = pyinstrument.Profiler()
+            capture.start()
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - t0
+        fname = _report if _report is not None else Path(f"{subcommand}.profile.json")
+        payload = {
+            "kind": "report",
+            "fname": str(fname),
+            "subcommand": subcommand,
+            "wall_seconds": wall,
+            "stages": _stages_dict(_stages),
+            "peak_rss_mb": {"main": peak_rss_mb(), "children": peak_rss_mb(resource.RUSAGE_CHILDREN)},
+        }
+        if profiler == "cprofile" and capture is not None:
+            capture.disable()
+            payload["profiler_output"] = str(fname.with_suffix(".prof"))
+            capture.dump_stats(payload["profiler_output"])
+        elif profiler == "pyinstrument" and capture is not None:
+            capture.stop()
+            payload["profiler_output"] = str(fname.with_suffix(".html"))
+            with open(payload["profiler_output"], "w") as f:
+                f.write(capture.output_html())
+        _stages.clear()
+        _main_pid = None
+        del os.environ[PROFILE_ENV]
+        logger.debug("profile", extra={"profile": payload})
+
+
+class NoProfileFilter(logging.Filter):
+    """Keep the profile records out of the text log"""
+
+    def filter(self, record):
+        return not hasattr(record, "profile")
+
+
+class ProfileCollector(logging.Handler):
+    """Sum up worker timings from the log queue, write the report on request"""
+
+    def __init__(self):
+        super().__init__()
+        self.workers = {}
+
+    def emit(self, record):
+        payload = getattr(record, "profile", None)
+        if payload is None:
+            return
+        if payload["kind"] == "worker":
+            worker = self.workers.setdefault(payload["pid"], {"stages": {}, "task_stages": [], "peak_rss_mb": 0.0})
+            worker["peak_rss_mb"] = max(worker["peak_rss_mb"], payload["peak_rss_mb"])
+            worker["task_stages"] = sorted(set(worker["task_stages"]) | set(payload["task_stages"]))
+            for name, st in payload["stages"].items():
+                total = worker["stages"].setdefault(name, {"calls": 0, "seconds": 0.0, "items": 0})
+                for key in total:
+                    total[key] += st[key]
+        elif payload["kind"] == "report":
+            try:
+                self.write_report(payload)
+            finally:
+                self.workers = {}
+
+    def write_report(self, payload):
+        worker_stages = {}
+        for worker in self.workers.values():
+            for name, st in worker["stages"].items():
+                total = worker_stages.setdefault(name, {"calls": 0, "seconds": 0.0, "items": 0})
+                for key in total:
+                    total[key] += st[key]
+            tasks = sum(worker["stages"][name]["items"] for name in worker["task_stages"])
+            busy = sum(worker["stages"][name]["seconds"] for name in worker["task_stages"])
+            worker["tasks"] = tasks
+            worker["busy_seconds"] = busy
+            worker["tasks_per_second"] = tasks / busy if busy > 0 else None
+        for st in worker_stages.values():
+            st["items_per_second"] = st["items"] / st["seconds"] if st["items"] > 0 and st["seconds"] > 0 else None
+        report = {key: payload[key] for key in payload if key not in ("kind", "fname")}
+        report["worker_stages"] = worker_stages
+        report["workers"] = {str(pid): worker for pid, worker in self.workers.items()}
+        fname = Path(payload["fname"])
+        with open(fname, "w") as f:
+            json.dump(report, f, indent=2)
@@ -1,43 +1,155 @@
-import argparse
+import glob
 import logging
+import multiprocessing
+from contextlib import ExitStack
 from pathlib import Path
 
 from ase import Atoms
-from ase.io import read, write
-from spglib import standardize_cell
+from ase.io import iread, write
+from joblib import effective_n_jobs
+from tqdm import tqdm
 
 from cdakit.log import logit
+from cdakit.poscar import Cell
+from cdakit.profiling import profiled, set_report, stage
+from cdakit.store import glob_vasp, is_store, read_cell
+from cdakit.symmetry import atoms2cell, std_cell, symmetry_ladder
 
 
 logger = logging.getLogger(__name__)
 
+# read frame by frame with ase, any other file is one structure in vasp format
+MULTIFRAME_SUFFIXES = {".extxyz", ".xyz", ".traj"}
+CELLTAGS = ("ucell", "pcell")
 
-@logit()
-def standardize(vaspfile, symprec, *args, **kwargs):
-    vaspfile = Path(vaspfile)
-    atoms = read(vaspfile, format="vasp")
-    bulk = (atoms.get_cell(), atoms.get_scaled_positions(), atoms.get_atomic_numbers())
-    for isymprec in symprec:
-        stddir = Path(vaspfile).parent.joinpath(f"{vaspfile}.std/{isymprec}")
-        stddir.mkdir(parents=True, exist_ok=True)
-        ucell = standardize_cell(bulk, False, symprec=isymprec)
-        pcell = standardize_cell(bulk, True, symprec=isymprec)
-        for celltag, stdcell in zip(["ucell", "pcell"], [ucell, pcell], strict=True):
-            if stdcell is None:
-                logger.warning(f"{vaspfile} cannot find standard {celltag} under symprec={isymprec}, using itself to replace")
-                stdcell = atoms
+
+def expand_inputs(paths):
+    """(fname, frame, cell) of every structure in paths
+
+    A directory gives its *.vasp, a store its entries, a pattern the files
+    it matches, a multi-frame file each of its frames, of which the cell is
+    read here; frame and cell are None for a single structure read by the
+    worker.
+    """
+    for path in paths:
+        path = Path(path)
+        if is_store(path):
+            fnames = glob_vasp(path)
+        elif path.is_dir():
+            fnames = sorted(path.glob("*.vasp"))
+        elif path.exists():
+            fnames = [path]
+        else:
+            fnames = sorted(map(Path, glob.glob(str(path))))
+            if len(fnames) == 0:
+                logger.warning(f"{path} matches no file")
+        for fname in fnames:
+            if fname.suffix in MULTIFRAME_SUFFIXES:
+                with stage("read"):
+                    for frame, atoms in enumerate(iread(fname, index=":")):
+                        yield fname, frame, atoms2cell(atoms)
             else:
-                lattice, scaled_positions, numbers = stdcell
-                stdcell = Atoms(numbers, cell=lattice, scaled_positions=scaled_positions)
-            write(stddir.joinpath(f"{vaspfile.stem}.{celltag}.vasp"), stdcell)
+                yield fname, None, None
+
+
+def std_dir(fname: Path, symprec) -> Path:
+    if is_store(fname.parent):
+        # entries of a store share <store>.std
+        return fname.parent.parent.joinpath(f"{fname.parent.name}.std/{symprec}")
+    return fname.parent.joinpath(f"{fname.name}.std/{symprec}")
+
+
+def standardize_cells(cell: Cell, symprec, short_circuit=False):
+    """{symprec: (spg number, {celltag: (lattice, positions, numbers)})}
 
+    The cells are the Atoms of cell itself, with spg number 0, if spglib
+    finds no symmetry.
+    """
+    with stage("spglib"):
+        datasets = symmetry_ladder(cell, symprec, angle_tolerance=-1.0, short_circuit=short_circuit)
+    cells = {}
+    for isymprec, symds in datasets.items():
+        if symds is None:
+            atoms = cell.to_atoms()
+            cells[isymprec] = (0, {celltag: atoms for celltag in CELLTAGS})
+        else:
+            # both cells come from the same dataset, spglib is not asked twice
+            cells[isymprec] = (symds.number, {
+                "ucell": std_cell(symds, to_primitive=False),
+                "pcell": std_cell(symds, to_primitive=True),
+            })
+    return cells
+
+
+def cell2atoms(cell) -> Atoms:
+    if isinstance(cell, Atoms):
+        return cell.copy()
+    lattice, scaled_positions, numbers = cell
+    return Atoms(numbers, cell=lattice, scaled_positions=scaled_positions, pbc=True)
+
+
+@profiled("standardize_one")
+def standardize_one(args):
+    """pool worker, standardize one structure and write its per-file layout"""
+    key, fname, frame, cell, symprec, short_circuit, per_file = args
+    if cell is None:
+        with stage("read"):
+            cell = read_cell(fname)
+    cells = standardize_cells(Cell(*cell), symprec, short_circuit)
+    name = fname.stem if frame is None else f"{fname.stem}.{frame}"
+    for isymprec, (number, stdcells) in cells.items():
+        if number == 0:
+            logger.warning(f"{fname}{'' if frame is None else f'@{frame}'} cannot find standard cells under symprec={isymprec}, using itself to replace")
+        if per_file:
+            with stage("write"):
+                stddir = std_dir(fname, isymprec)
+                stddir.mkdir(parents=True, exist_ok=True)
+                for celltag, stdcell in stdcells.items():
+                    write(stddir.joinpath(f"{name}.{celltag}.vasp"), cell2atoms(stdcell), format="vasp")
+    return key, cells
+
+
+@logit()
+def standardize(paths, symprec, short_circuit=False, output=None, per_file=True, njobs=1, chunksize=16, *args, **kwargs):
+    """Standardize every structure in paths
 
-def add_subparser(subparsers):
-    subparser = subparsers.add_parser(
-        __name__.split(".")[-1],
-        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
-        description="match structures to target by pymatgen, write to match.<target>.table",
+    Each structure is written to <file>.std/<symprec>/<name>.<celltag>.vasp,
+    or <store>.std/<symprec>/ for the entries of a store, unless per_file is
+    False, and to <output>/std_<symprec>.<celltag>.extxyz
+    in input order if output is given.
+    """
+    paths = [paths] if isinstance(paths, (str, Path)) else list(paths)
+    first = Path(paths[0])
+    set_report(Path(output) / "standardize.profile.json" if output is not None else first.with_name(f"{first.name}.profile.json"))
+    if output is None and not per_file:
+        logger.warning("no output is written without --output and with --no-per-file")
+    tasks = (
+        ((fname, frame), fname, frame, cell, symprec, short_circuit, per_file)
+        for fname, frame, cell in expand_inputs(paths)
     )
-    subparser.set_defaults(func=standardize)
-    subparser.add_argument("vaspfile", help="vaspfile to analysis, recommanded to name as *.vasp")
-    subparser.add_argument("-s", "--symprec", type=float, nargs="+", default=[0.5, 0.1, 0.01], help="symprec tolerence")
+    with ExitStack() as stack:
+        outfiles = {}
+        if output is not None:
+            Path(output).mkdir(parents=True, exist_ok=True)
+            for isymprec in symprec:
+                for celltag in CELLTAGS:
+                    fout = Path(output) / f"std_{isymprec}.{celltag}.extxyz"
+                    outfiles[isymprec, celltag] = stack.enter_context(open(fout, "w"))
+        if effective_n_jobs(njobs) > 1:
+            pool = stack.enter_context(multiprocessing.Pool(effective_n_jobs(njobs)))
+            results = pool.imap(standardize_one, tasks, chunksize=chunksize)
+        else:
+            results = map(standardize_one, tasks)
+        nstructures = 0
+        for (fname, frame), cells in tqdm(results, ncols=120, disable=len(paths) == 1 and first.is_file() and first.suffix not in MULTIFRAME_SUFFIXES):
+            nstructures += 1
+            if output is None:
+                continue
+            with stage("write_extxyz"):
+                source = str(fname) if frame is None else f"{fname}@{frame}"
+                for isymprec, (number, stdcells) in cells.items():
+                    for celltag, stdcell in stdcells.items():
+                        atoms = cell2atoms(stdcell)
+                        atoms.info.update({"source": source, "spg": number, "symprec": isymprec})
+                        write(outfiles[isymprec, celltag], atoms, format="extxyz")
+    logger.info(f"{nstructures} structures standardized")
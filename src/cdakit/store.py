@@ -0,0 +1,259 @@
+# packed structure store, a whole *.vasp collection in one memory-mappable file
+#
+# Layout: 8 bytes magic, 8 bytes little endian length of a JSON header, the
+# header, then the flat arrays at 64 bytes aligned offsets given in the header
+#
+#   lattices      float64 (n, 3, 3)
+#   offsets       int64   (n + 1,)   sites of structure i are offsets[i]:offsets[i + 1]
+#   positions     float64 (m, 3)     scaled, as in the POSCAR, not wrapped
+#   numbers       int32   (m,)       atomic numbers
+#   names         uint8   (nbytes,)  utf-8 names joined, split by name_offsets
+#   name_offsets  int64   (n + 1,)
+#
+# Every subcommand taking a directory of *.vasp also takes a store, its entries
+# are addressed as <store>/<name>.vasp, so outputs are laid out as for the
+# directory, except the per-file output of standardize, shared by the entries
+# in <store>.std/<symprec>/. Selective dynamics flags, velocities and the
+# comment line are not stored. Workers open the store by mmap and slice their
+# entries from it.
+
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+from ase import Atoms
+from ase.io import write
+from joblib import effective_n_jobs
+from tqdm import tqdm
+
+from cdakit.iotools import file_stamp
+from cdakit.log import logit
+from cdakit.poscar import Cell, read_poscar
+from cdakit.profiling import set_report, stage
+
+logger = logging.getLogger(__name__)
+
+STORE_SUFFIX = ".cdastore"
+MAGIC = b"CDASTOR1"
+ALIGN = 64
+ARRAYS = {
+    "lattices": np.float64,
+    "offsets": np.int64,
+    "positions": np.float64,
+    "numbers": np.int32,
+    "names": np.uint8,
+    "name_offsets": np.int64,
+}
+
+_open_stores: dict[str, "StructureStore"] = {}  # per process, by resolved path
+
+
+class StructureStore:
+    """Read-only view of a store, the arrays are memory-mapped"""
+
+    def __init__(self, fstore):
+        self.fname = Path(fstore)
+        with open(self.fname, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{self.fname} is not a structure store")
+            header = json.loads(f.read(int.from_bytes(f.read(8), "little")))
+        self.arrays = {
+            key: np.memmap(self.fname, dtype=spec["dtype"], mode="r", offset=spec["offset"], shape=tuple(spec["shape"]))
+            if np.prod(spec["shape"]) > 0 else np.empty(spec["shape"], dtype=spec["dtype"])
+            for key, spec in header["arrays"].items()
+        }
+        self._index = None
+
+    def __len__(self):
+        return len(self.arrays["lattices"])
+
+    @property
+    def names(self) -> list[str]:
+        blob = self.arrays["names"].tobytes()
+        bounds = self.arrays["name_offsets"]
+        return [blob[bounds[i]:bounds[i + 1]].decode() for i in range(len(self))]
+
+    def index(self, name: str) -> int:
+        if self._index is None:
+            self._index = {name: i for i, name in enumerate(self.names)}
+        return self._index[name]
+
+    def cell(self, i: int):
+        """(lattice, scaled positions, numbers) of entry i, views of the mapped arrays"""
+        start, stop = self.arrays["offsets"][i:i + 2]
+        return self.arrays["lattices"][i], self.arrays["positions"][start:stop], self.arrays["numbers"][start:stop]
+
+    def atoms(self, i: int) -> Atoms:
+        lattice, positions, numbers = self.cell(i)
+        return Atoms(numbers, cell=lattice, scaled_positions=positions, pbc=True)
+
+    def structure(self, i: int):
+        from pymatgen.core.structure import Structure
+
+        lattice, positions, numbers = self.cell(i)
+        return Structure(lattice, numbers, positions)
+
+
+def write_store(fstore, names, cells):
+    """Write cells [(lattice, scaled positions, numbers)] named names as a store"""
+    fstore = Path(fstore)
+    natoms = np.array([len(numbers) for _, _, numbers in cells], dtype=np.int64)
+    encoded = [name.encode() for name in names]
+    arrays = {
+        "lattices": np.array([lattice for lattice, _, _ in cells], dtype=np.float64).reshape(-1, 3, 3),
+        "offsets": np.concatenate([[0], np.cumsum(natoms)]),
+        "positions": np.concatenate([positions for _, positions, _ in cells]).reshape(-1, 3) if len(cells) else np.empty((0, 3)),
+        "numbers": np.concatenate([numbers for _, _, numbers in cells]) if len(cells) else np.empty(0),
+        "names": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+        "name_offsets": np.concatenate([[0], np.cumsum([len(b) for b in encoded], dtype=np.int64)]),
+    }
+    arrays = {key: np.ascontiguousarray(arrays[key], dtype=dtype) for key, dtype in ARRAYS.items()}
+    # offsets depend on the header length, fix them with a header padded to ALIGN
+    specs = {key: {"dtype": np.dtype(arr.dtype).str, "shape": list(arr.shape), "offset": 0} for key, arr in arrays.items()}
+    header_size = ALIGN
+    while True:
+        offset = header_size
+        for key, arr in arrays.items():
+            specs[key]["offset"] = offset
+            offset += -(-arr.nbytes // ALIGN) * ALIGN
+        header = json.dumps({"version": 1, "arrays": specs}).encode()
+        if len(MAGIC) + 8 + len(header) <= header_size:
+            break
+        header_size = -(-(len(MAGIC) + 8 + len(header)) // ALIGN) * ALIGN
+    tmp = fstore.with_name(f".{fstore.name}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(MAGIC + len(header).to_bytes(8, "little") + header)
+        for key, arr in arrays.items():
+            f.seek(specs[key]["offset"])
+            f.write(arr.tobytes())
+    tmp.replace(fstore)
+    _open_stores.pop(os.path.realpath(fstore), None)
+
+
+def is_store(path) -> bool:
+    return Path(path).suffix == STORE_SUFFIX
+
+
+def open_store(fstore) -> StructureStore:
+    """the store of fstore, opened once per process"""
+    key = os.path.realpath(fstore)
+    store = _open_stores.get(key)
+    if store is None:
+        store = _open_stores[key] = StructureStore(fstore)
+    return store
+
+
+def _member(fname):
+    """(store, index) if fname is <store>/<name>.vasp, else None"""
+    fname = Path(fname)
+    if not is_store(fname.parent):
+        return None
+    store = open_store(fname.parent)
+    return store, store.index(fname.stem)
+
+
+def glob_vasp(indir) -> list[Path]:
+    """*.vasp of a directory, or the entries of a store as <store>/<name>.vasp"""
+    indir = Path(indir)
+    if is_store(indir):
+        return [indir / f"{name}.vasp" for name in open_store(indir).names]
+    return list(indir.glob("*.vasp"))
+
+
+def vasp_exists(fname) -> bool:
+    fname = Path(fname)
+    if is_store(fname.parent):
+        try:
+            return _member(fname) is not None
+        except KeyError:
+            return False
+    return fname.is_file()
+
+
+def read_cell(fname) -> Cell:
+    """(lattice, scaled positions, numbers) of a *.vasp or of a store entry"""
+    member = _member(fname)
+    if member is None:
+        return read_poscar(fname)
+    store, i = member
+    return Cell(*store.cell(i))
+
+
+def read_structure(fname):
+    """pymatgen Structure of a *.vasp or of a store entry"""
+    member = _member(fname)
+    if member is None:
+        from pymatgen.core.structure import Structure
+
+        return Structure.from_file(fname)
+    store, i = member
+    return store.structure(i)
+
+
+def structure_stamp(fname, use_hash=False) -> str:
+    """file_stamp of a *.vasp, or sha1 of the arrays of a store entry"""
+    member = _member(fname)
+    if member is None:
+        return file_stamp(fname, use_hash)
+    store, i = member
+    h = hashlib.sha1()
+    for arr in store.cell(i):
+        h.update(np.ascontiguousarray(arr).tobytes())
+    return h.hexdigest()
+
+
+def copy_vasp(fname, dst):
+    """copy a *.vasp, or write a store entry as one"""
+    member = _member(fname)
+    if member is None:
+        shutil.copy(fname, dst)
+    else:
+        store, i = member
+        dst = Path(dst)
+        write(dst / Path(fname).name if dst.is_dir() else dst, store.atoms(i), format="vasp", direct=True)
+
+
+def _sort_key(name: str):
+    return (0, int(name), "") if name.isdigit() else (1, 0, name)
+
+
+@logit()
+def pack(indir, output=None, njobs=1, chunksize=64, **kwargs):
+    """Pack <indir>/*.vasp into the store output, <indir>.cdastore by default"""
+    indir = Path(indir)
+    fstore = Path(output) if output is not None else indir.with_name(indir.name + STORE_SUFFIX)
+    set_report(fstore.with_name(f"{fstore.name}.profile.json"))
+    with stage("discover"):
+        flist = sorted(indir.glob("*.vasp"), key=lambda f: _sort_key(f.stem))
+    with stage("read", items=len(flist)):
+        with multiprocessing.Pool(min(effective_n_jobs(njobs), max(len(flist), 1))) as pool:
+            cells = list(tqdm(pool.imap(read_poscar, flist, chunksize=chunksize), total=len(flist), ncols=120))
+    with stage("write"):
+        write_store(fstore, [f.stem for f in flist], cells)
+    logger.info(f"{len(flist)} structures packed into {fstore}")
+
+
+def _write_entry(args):
+    fstore, i, fname = args
+    write(fname, open_store(fstore).atoms(i), format="vasp", direct=True)
+
+
+@logit()
+def unpack(store, output=None, njobs=1, chunksize=64, **kwargs):
+    """Write every entry of store as <output>/<name>.vasp, output is the store without suffix by default"""
+    fstore = Path(store)
+    outdir = Path(output) if output is not None else fstore.with_suffix("")
+    set_report(fstore.with_name(f"{fstore.name}.profile.json"))
+    outdir.mkdir(parents=True, exist_ok=True)
+    names = open_store(fstore).names
+    tasks = [(fstore, i, outdir / f"{name}.vasp") for i, name in enumerate(names)]
+    with stage("write", items=len(tasks)):
+        with multiprocessing.Pool(min(effective_n_jobs(njobs), max(len(tasks), 1))) as pool:
+            for _ in tqdm(pool.imap_unordered(_write_entry, tasks, chunksize=chunksize), total=len(tasks), ncols=120):
+                pass
+    logger.info(f"{len(names)} structures unpacked into {outdir}")
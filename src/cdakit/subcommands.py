@@ -0,0 +1,189 @@
+# arguments of every subcommand, declared without importing the implementations
+#
+# Only argparse is imported here, the module of a subcommand (and pymatgen,
+# ase, spglib, pandas ... behind it) is imported when the subcommand is run.
+
+import argparse
+import importlib
+
+
+class LazyFunc:
+    """Picklable reference to ``module:name``, imported at the first call"""
+
+    def __init__(self, module: str, name: str):
+        self.module = module
+        self.name = name
+
+    def resolve(self):
+        return getattr(importlib.import_module(self.module), self.name)
+
+    def __call__(self, *args, **kwargs):
+        return self.resolve()(*args, **kwargs)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.module}:{self.name})"
+
+
+def add_find_spg(subparsers):
+    subparser = subparsers.add_parser(
+        "find_spg",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description="write the space group under each symprec and a fingerprint of each structure to spg.txt, "
+        "structures with symmetry, less exact duplicates, to sympart/spg_<number>/gen",
+    )
+    subparser.set_defaults(func=LazyFunc("cdakit.find_spg", "find_spg"))
+    subparser.add_argument("indirs", nargs="*", help="directiries containing *.vasp, or structure stores")
+    subparser.add_argument("-s", "--symprec", type=float, default=[0.5, 0.1, 0.01], nargs="+", help="symprec, only one significant digits is kept")
+    subparser.add_argument("--no-std", dest="write_std", action="store_false", help="do not write standardized cells to std_<symprec>")
+    subparser.add_argument("--cif", dest="write_cif", action="store_true", help="also write standardized cells as cif to std_<symprec>")
+    subparser.add_argument("--chunksize", type=int, default=16, help="files sent to a worker at a time")
+    subparser.add_argument("--short-circuit", action="store_true", help="reuse P1 found at a looser symprec for the tighter ones instead of searching again")
+
+
+def add_landscape(subparsers):
+    subparser = subparsers.add_parser(
+        "landscape",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description="join parsed_outcar.table, spg.txt and match tables by structure into landscape.parquet "
+        "and landscape.table, with the energy above the lowest structure of each reduced formula and above the convex hull; "
+        "nothing is redone while the input tables are unchanged",
+    )
+    subparser.set_defaults(func=LazyFunc("cdakit.landscape", "landscape"))
+    subparser.add_argument("outcar", help="parsed_outcar.table written by parse_outcar")
+    subparser.add_argument("-s", "--spg", help="spg.txt written by find_spg")
+    subparser.add_argument("-m", "--match", nargs="+", default=[], help="match.<label>.table written by match_structure, columns are prefixed by <label>_")
+    subparser.add_argument("-o", "--output", help="directory to write, the directory of outcar if not given")
+    subparser.add_argument("-e", "--energy", default="enthalpy_per_atom", help="per atom energy column of outcar to rank by")
+    subparser.add_argument("--include-unconverged", dest="include_unconverged", action="store_true", help="also rank structures whose relaxation did not converge")
+    subparser.add_argument("--rebuild", action="store_true", help="rebuild even if the input tables are unchanged")
+
+
+def add_match_structure(subparsers):
+    subparser = subparsers.add_parser(
+        "match_structure",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description="match structures to target by pymatgen, write to match.<target>.table; "
+        "or group all structures into unique classes, write to match.uniq.table",
+    )
+    subparser.set_defaults(func=LazyFunc("cdakit.match_structure", "matchtarget"))
+    subparser.add_argument("indir", help="directory containing *.vasp, or a structure store")
+    mode = subparser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("-t", "--target", help="target structure in vasp format")
+    mode.add_argument("-u", "--unique", action="store_true", help="all-vs-all deduplication")
+    subparser.add_argument("--rematch", action="store_true", help="ignore existing match.<target>.table and match all structures")
+    subparser.add_argument("--hash", dest="use_hash", action="store_true", help="detect changed *.vasp by content hash instead of size and mtime")
+    subparser.add_argument("-s", "--symprec", type=float, default=0.5, help="symprec of spglib to bucket structures in unique mode, 0 to disable")
+    subparser.add_argument("--vtol", type=float, default=float("inf"), help="relative window of volume per atom to prefilter pairs in unique mode, lossy as the matchers ignore the volume")
+    subparser.add_argument("--fptol", type=float, default=float("inf"), help="tolerance of nearest-neighbour distance fingerprint in unique mode, lossy if below what the loose stol allows")
+
+
+def add_pack(subparsers):
+    subparser = subparsers.add_parser(
+        "pack",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description="pack <indir>/*.vasp into one memory-mappable structure store, "
+        "which find_spg, match_structure, prepare_vasp and standardize take in place of the directory; "
+        "selective dynamics flags are not stored",
+    )
+    subparser.set_defaults(func=LazyFunc("cdakit.store", "pack"))
+    subparser.add_argument("indir", help="directory containing *.vasp")
+    subparser.add_argument("-o", "--output", help="store to write, <indir>.cdastore if not given")
+    subparser.add_argument("--chunksize", type=int, default=64, help="files sent to a worker at a time")
+
+
+def add_parse_outcar(subparsers):
+    subparser = subparsers.add_parser(
+        "parse_outcar",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description="""Parse all OUTCAR and *.OUTCAR, write steps to the parquet
+dataset parsed_outcar.parquet and summary to parsed_outcar.table, unchanged
+OUTCAR already in the dataset are not parsed again"""
+    )
+    subparser.set_defaults(func=LazyFunc("cdakit.parse_outcar", "parse_outcar"))
+    subparser.add_argument("indir", help="directory containing OUTCAR or *.OUTCAR")
+    subparser.add_argument("--no-cache", dest="use_cache", action="store_false", help="drop parsed_outcar.parquet and parse every OUTCAR")
+    subparser.add_argument("--hash", dest="use_hash", action="store_true", help="identify unchanged OUTCAR by content hash instead of size and mtime")
+    subparser.add_argument("--summary-only", dest="summary_only", action="store_true", help="only refresh parsed_outcar.table from the head and tail of each OUTCAR")
+    subparser.add_argument("--batch-rows", dest="batch_rows", type=int, default=100000, help="steps per part file of parsed_outcar.parquet")
+    subparser.add_argument("--skip-finished", dest="skip_finished", action="store_true", help="do not enter directories whose OUTCAR all finished in the previous run, see parsed_outcar.index.json")
+    subparser.add_argument("--walk-threads", dest="walk_threads", type=int, default=8, help="directories listed concurrently when searching OUTCAR")
+
+
+def add_unpack(subparsers):
+    subparser = subparsers.add_parser(
+        "unpack",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description="write every structure of a store as <output>/<name>.vasp",
+    )
+    subparser.set_defaults(func=LazyFunc("cdakit.store", "unpack"))
+    subparser.add_argument("store", help="structure store written by pack")
+    subparser.add_argument("-o", "--output", help="directory to write, the store without .cdastore if not given")
+    subparser.add_argument("--chunksize", type=int, default=64, help="structures sent to a worker at a time")
+
+
+def add_prepare_calypso(subparsers):
+    subparser = subparsers.add_parser(
+        "prepare_calypso",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description="generate input.dat follow each POSCAR in subdir",
+    )
+    subparser.set_defaults(func=LazyFunc("cdakit.prepare_calypso", "prepare_calypso"))
+    subparser.add_argument("indir", help="directory with each POSCAR/POTCAR/KPOINTS in a subdir")
+    subparser.add_argument("-r", "--dist_ratio", type=float, default=0.7, help="distance ratio multipied on RCORE to generate DistanceOfIon")
+    subparser.add_argument("-p", "--popsize", type=int, default=10, help="PopSize")
+    subparser.add_argument("-c", "--calypsocmd", default="calypso.x", help="CALYPSO executable file")
+    subparser.add_argument("-t", "--calypsotimeout", type=float, default=180, help="maxtime for each calypso subprocess")
+    subparser.add_argument("--concurrency", type=int, help="CALYPSO runs at a time, --njobs if not given")
+    subparser.add_argument("--retries", type=int, default=2, help="times a failed or timed out CALYPSO run is tried again")
+    subparser.add_argument("--restart", action="store_true", help="forget the dirs done in <indir>.calypso/calypso.state.jsonl and run all again")
+
+
+def add_prepare_vasp(subparsers):
+    subparser = subparsers.add_parser(
+        "prepare_vasp",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    subparser.set_defaults(func=LazyFunc("cdakit.prepare_vasp", "prepare_vasp_batch"))
+    subparser.add_argument("indir", help="directory containing *.vasp, or a structure store, which drops selective dynamics")
+    subparser.add_argument("-u", "--uniqfile",                                            help="table to select structures from by its index, e.g. match.uniq.table or parsed_outcar.table")
+    subparser.add_argument("-l", "--uniqlevel", choices=["lo", "md", "st"], default="lo", help="unique level of matcher used in uniqfile, if no --column")
+    subparser.add_argument("-c", "--column",                                              help="boolean column of uniqfile to select by, or numeric one to rank by with --top")
+    subparser.add_argument("-k", "--top", type=int,                                       help="select the k smallest values of --column, e.g. -c enthalpy_per_atom -k 50")
+    subparser.add_argument("--largest", action="store_true",                              help="--top selects the largest values instead")
+    subparser.add_argument("-e", "--ediff", type=float,                                   help="EDIFF, autogenerate by pyamtgen if None")
+    subparser.add_argument("-eg", "--ediffg", type=float,                                 help="EDIFFG")
+    subparser.add_argument("-n", "--nsw", type=int , default=0,                          help="NSW")
+    subparser.add_argument("-p", "--pstress", type=float, default=0,                      help="PSTRESS(kbar)")
+    subparser.add_argument("-ks", "--kspacing",                                           help="KSPACING")
+    subparser.add_argument("-s", "--sym", type=int, default=0,                            help="ISYM, suggest 0/2")
+    subparser.add_argument("--chunksize", type=int, default=16,                           help="structures sent to a worker at a time")
+    subparser.add_argument("--potcar-link", choices=["hard", "sym", "copy"], default="hard", help="how each task gets the POTCAR shared by its elements, hard falls back to copy across filesystems")
+
+
+def add_standardize(subparsers):
+    subparser = subparsers.add_parser(
+        "standardize",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description="standardize structures under each symprec, write <file>.std/<symprec>/<name>.<ucell|pcell>.vasp "
+        "and/or <output>/std_<symprec>.<ucell|pcell>.extxyz",
+    )
+    subparser.set_defaults(func=LazyFunc("cdakit.standardize", "standardize"))
+    subparser.add_argument("paths", nargs="+", help="vasp files, directories of *.vasp, structure stores, glob patterns or multi-frame extxyz/xyz/traj")
+    subparser.add_argument("-s", "--symprec", type=float, nargs="+", default=[0.5, 0.1, 0.01], help="symprec tolerence")
+    subparser.add_argument("-o", "--output", help="directory to write all standardized cells to, one extxyz per symprec and cell")
+    subparser.add_argument("--no-per-file", dest="per_file", action="store_false", help="do not write <file>.std/<symprec>/, <store>.std/<symprec>/ for the entries of a store")
+    subparser.add_argument("--chunksize", type=int, default=16, help="structures sent to a worker at a time")
+    subparser.add_argument("--short-circuit", action="store_true", help="reuse P1 found at a looser symprec for the tighter ones instead of searching again")
+
+
+SUBCOMMANDS = {
+    "find_spg": add_find_spg,
+    "landscape": add_landscape,
+    "match_structure": add_match_structure,
+    "pack": add_pack,
+    "parse_outcar": add_parse_outcar,
+    "prepare_calypso": add_prepare_calypso,
+    "prepare_vasp": add_prepare_vasp,
+    "standardize": add_standardize,
+    "unpack": add_unpack,
+}
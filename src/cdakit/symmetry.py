@@ -0,0 +1,120 @@
+# symmetry datasets of a cell over a ladder of symprec, shared by find_spg and standardize
+
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+import spglib
+
+
+# per process memo, hit when standardize runs in-process (njobs=1) again over
+# the same structures from the api, and by repeated frames of a trajectory
+DATASET_CACHE_SIZE = 4096
+_dataset_cache = OrderedDict()
+
+# columns are the primitive basis in the conventional standardized basis, as in spglib
+CENTERING_TO_PRIMITIVE = {
+    "P": np.eye(3),
+    "A": np.array([[1, 0, 0], [0, 1 / 2, -1 / 2], [0, 1 / 2, 1 / 2]]),
+    "C": np.array([[1 / 2, 1 / 2, 0], [-1 / 2, 1 / 2, 0], [0, 0, 1]]),
+    "I": np.array([[-1 / 2, 1 / 2, 1 / 2], [1 / 2, -1 / 2, 1 / 2], [1 / 2, 1 / 2, -1 / 2]]),
+    "F": np.array([[0, 1 / 2, 1 / 2], [1 / 2, 0, 1 / 2], [1 / 2, 1 / 2, 0]]),
+    "R": np.array([[2 / 3, -1 / 3, -1 / 3], [1 / 3, 1 / 3, -2 / 3], [1 / 3, 1 / 3, 1 / 3]]),
+}
+
+
+def atoms2cell(atoms):
+    return (atoms.cell[:], atoms.get_scaled_positions(), atoms.get_atomic_numbers())
+
+
+def cell_hash(cell) -> str:
+    """sha1 of the exact lattice, positions and numbers of a spglib cell"""
+    lattice, positions, numbers = cell
+    h = hashlib.sha1()
+    for arr, dtype in ((lattice, np.float64), (positions, np.float64), (numbers, np.int64)):
+        h.update(np.ascontiguousarray(arr, dtype=dtype).tobytes())
+    return h.hexdigest()
+
+
+def get_symmetry_dataset(cell, symprec, angle_tolerance=10, key=None):
+    """spglib.get_symmetry_dataset memoized on (cell hash, symprec, angle_tolerance)"""
+    if key is None:
+        key = cell_hash(cell)
+    cachekey = (key, float(symprec), float(angle_tolerance))
+    if cachekey in _dataset_cache:
+        _dataset_cache.move_to_end(cachekey)
+        return _dataset_cache[cachekey]
+    symds = spglib.get_symmetry_dataset(cell, symprec, angle_tolerance)
+    _dataset_cache[cachekey] = symds
+    if len(_dataset_cache) > DATASET_CACHE_SIZE:
+        _dataset_cache.popitem(last=False)
+    return symds
+
+
+def symmetry_ladder(cell, symprec_list, angle_tolerance=10, short_circuit=False):
+    """Symmetry datasets of cell under each symprec
+
+    The ladder is walked from the loosest to the tightest tolerance. With
+    short_circuit, once a tolerance gives P1 the P1 dataset is reused for the
+    tighter ones instead of asking spglib again. spglib is not strictly
+    monotonic in symprec (a loose symprec merging atoms may lose operations a
+    tighter one keeps), so this is an opt-in approximation.
+
+    Returns
+    -------
+    dict
+        {symprec: symds}, symds is None if spglib cannot find the symmetry
+    """
+    key = cell_hash(cell)
+    datasets = {}
+    p1 = None
+    for symprec in sorted(symprec_list, reverse=True):
+        if p1 is not None:
+            datasets[symprec] = p1
+            continue
+        symds = get_symmetry_dataset(cell, symprec, angle_tolerance, key=key)
+        datasets[symprec] = symds
+        if short_circuit and symds is not None and symds.number == 1:
+            p1 = symds
+    return {symprec: datasets[symprec] for symprec in symprec_list}
+
+
+def std_cell(symds, to_primitive=False):
+    """Standardized (lattice, scaled_positions, numbers) from a dataset
+
+    Same as spglib.standardize_cell(cell, to_primitive), without searching the
+    symmetry again.
+    """
+    lattice, positions, numbers = symds.std_lattice, symds.std_positions, symds.std_types
+    if not to_primitive:
+        return lattice, positions, numbers
+    tmat = CENTERING_TO_PRIMITIVE[symds.international[0]]
+    _, first = np.unique(symds.std_mapping_to_primitive, return_index=True)
+    positions = positions[first] @ np.linalg.inv(tmat).T
+    positions = positions - np.floor(positions)
+    return tmat.T @ lattice, positions, numbers[first]
+
+
+def wyckoff_sequence(symds, numbers) -> str:
+    """Sorted <element>:<letter> of each crystallographic orbit, e.g. 'O:c,O:c,Si:a'"""
+    from ase.data import chemical_symbols
+
+    _, first = np.unique(symds.equivalent_atoms, return_index=True)
+    return ",".join(sorted(f"{chemical_symbols[numbers[i]]}:{symds.wyckoffs[i]}" for i in first))
+
+
+def std_digest(stdcell, decimals=3) -> str:
+    """sha1 of a standardized cell rounded to decimals, sites sorted
+
+    Equal for copies of a structure whose standardized cells agree to the
+    rounding, whatever the order of their sites.
+    """
+    lattice, positions, numbers = stdcell
+    lattice = np.round(np.asarray(lattice, dtype=np.float64), decimals) + 0.0
+    positions = np.round(np.asarray(positions, dtype=np.float64) % 1, decimals) % 1 + 0.0
+    sites = np.column_stack([np.asarray(numbers, dtype=np.float64), positions])
+    sites = sites[np.lexsort(sites.T[::-1])]
+    h = hashlib.sha1()
+    h.update(lattice.tobytes())
+    h.update(np.ascontiguousarray(sites).tobytes())
+    return h.hexdigest()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# stand-in of CALYPSO in split mode for testing prepare_calypso, no CALYPSO needed
+#
+#   cdakit prepare_calypso test/calypso_in -c test/calypso.x
+#
+# Reads input.dat in the working directory and writes POSCAR_1 ... POSCAR_<PopSize>
+# of random sites in a cubic cell of the given volume, and the step file.
+# The environment variables make it misbehave:
+#   FAKE_CALYPSO_SLEEP   seconds to sleep before writing, to hit the timeout
+#   FAKE_CALYPSO_FAIL    probability to exit 1 without writing anything
+#   FAKE_CALYPSO_SEED    seed of the random sites and failures
+
+import os
+import random
+import sys
+import time
+
+
+def read_inputdat(fname="input.dat"):
+    params = {}
+    with open(fname) as f:
+        for line in f:
+            if "=" in line:
+                key, value = line.split("=", 1)
+                params[key.strip()] = value.strip()
+    return params
+
+
+def main():
+    params = read_inputdat()
+    rng = random.Random(os.environ.get("FAKE_CALYPSO_SEED"))
+    print(f"fake CALYPSO for {params['SystemName']} in {os.getcwd()}", flush=True)
+    time.sleep(float(os.environ.get("FAKE_CALYPSO_SLEEP", 0)))
+    if rng.random() < float(os.environ.get("FAKE_CALYPSO_FAIL", 0)):
+        print("fake CALYPSO failed", flush=True)
+        sys.exit(1)
+
+    names = params["NameOfAtoms"].split()
+    counts = params["NumberOfAtoms"].split()
+    a = float(params["Volume"]) ** (1 / 3)
+    natoms = sum(map(int, counts))
+    for i in range(1, int(params["PopSize"]) + 1):
+        with open(f"POSCAR_{i}", "w") as f:
+            f.write(f"{params['SystemName']} {i}\n1.0\n")
+            f.write(f"{a:.6f} 0 0\n0 {a:.6f} 0\n0 0 {a:.6f}\n")
+            f.write(" ".join(names) + "\n" + " ".join(counts) + "\nDirect\n")
+            for _ in range(natoms):
+                f.write(" ".join(f"{rng.random():.6f}" for _ in range(3)) + "\n")
+    with open("step", "w") as f:
+        f.write("1\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from cdakit.find_spg import fingerprint, get_spg_cells, get_spg_df, mark_duplicates, write_sympart
+from cdakit.poscar import Cell
+
+SYMPREC_LIST = [0.1, 0.01]
+POSCAR = "x\n1.0\n3 0 0\n0 3 0\n0 0 3\nCu\n1\nDirect\n0 0 0\n"
+
+
+def spg_rows(names, spg):
+    return pd.DataFrame({"name": names, "1e-01": spg, "1e-02": spg, "duplicate_of": "-"})
+
+
+def shard_files(sympart: Path):
+    return sorted(str(fname.relative_to(sympart)) for fname in sympart.glob("spg_*/gen/*.vasp"))
+
+
+def test_write_sympart_keeps_other_dirs(tmp_path):
+    for fdir in ("a", "b"):
+        tmp_path.joinpath(fdir).mkdir()
+        tmp_path.joinpath(fdir, "1.vasp").write_text(POSCAR)
+    write_sympart(tmp_path / "a", spg_rows(["1.vasp"], 227), SYMPREC_LIST)
+    write_sympart(tmp_path / "b", spg_rows(["1.vasp"], 1), SYMPREC_LIST)
+    assert shard_files(tmp_path / "sympart") == ["spg_227/gen/1.vasp"]
+
+
+def test_write_sympart_removes_own_stale(tmp_path):
+    tmp_path.joinpath("a").mkdir()
+    for name in ("1.vasp", "2.vasp"):
+        tmp_path.joinpath("a", name).write_text(POSCAR)
+    write_sympart(tmp_path / "a", spg_rows(["1.vasp", "2.vasp"], 227), SYMPREC_LIST)
+    write_sympart(tmp_path / "a", spg_rows(["1.vasp", "2.vasp"], [225, 1]), SYMPREC_LIST)
+    assert shard_files(tmp_path / "sympart") == ["spg_225/gen/1.vasp"]
+
+
+def test_empty_dir_removes_own_shards(tmp_path):
+    tmp_path.joinpath("a").mkdir()
+    tmp_path.joinpath("a", "1.vasp").write_text(POSCAR)
+    write_sympart(tmp_path / "a", spg_rows(["1.vasp"], 221), SYMPREC_LIST)
+    tmp_path.joinpath("a", "1.vasp").unlink()
+    df = get_spg_df(tmp_path / "a", SYMPREC_LIST, write_std=False)
+    assert len(df) == 0
+    assert shard_files(tmp_path / "sympart") == []
+    assert tmp_path.joinpath("sympart", ".a.written").read_text() == ""
+
+def test_fingerprint_of_supercell():
+    bcc = Cell(2.87 * np.array([[-0.5, 0.5, 0.5], [0.5, -0.5, 0.5], [0.5, 0.5, -0.5]]), np.zeros((1, 3)), np.array([26]))
+    conventional = Cell(2.87 * np.eye(3), np.array([[0, 0, 0], [0.5, 0.5, 0.5]]), np.array([26, 26]))
+    rows = []
+    for name, cell in (("1.vasp", bcc), ("2.vasp", conventional)):
+        rows.append({"name": name, **fingerprint(cell, get_spg_cells(cell, SYMPREC_LIST))})
+    df = mark_duplicates(pd.DataFrame(rows))
+    assert df["fp_spg"].tolist() == [229, 229]
+    assert df["duplicate_of"].tolist() == ["-", "1.vasp"]
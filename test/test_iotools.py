@@ -0,0 +1,68 @@
+import shutil
+import subprocess
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from cdakit.iotools import read_format_table, to_format_table, write_format_table
+
+TABLE = (
+    "index    spg  energy     symbol  converge\n"
+    "1.vasp   227  -1.500000  Fd-3m   True\n"
+    "10.vasp  1    NaN        P1      False\n"
+    "2.vasp   12   0.250000   C2/m    True\n"
+)
+
+
+def spg_table():
+    return pd.DataFrame(
+        {
+            "spg": [227, 1, 12],
+            "energy": [-1.5, np.nan, 0.25],
+            "symbol": ["Fd-3m", "P1", "C2/m"],
+            "converge": [True, False, True],
+        },
+        index=["1.vasp", "10.vasp", "2.vasp"],
+    )
+
+
+def test_format_table_layout():
+    assert to_format_table(spg_table()) == TABLE
+
+
+@pytest.mark.skipif(shutil.which("column") is None, reason="no column command")
+def test_format_table_as_column_t():
+    df = pd.concat([spg_table()] * 50, ignore_index=True)
+    csv_str = df.to_csv(None, sep=" ", float_format="%.6f", na_rep="NaN", index_label="index")
+    legacy = subprocess.run(["column", "-t"], input=csv_str, capture_output=True, text=True, check=True).stdout
+    assert to_format_table(df) == legacy
+
+
+def test_write_read_format_table(tmp_path):
+    ftable = tmp_path / "spg.txt"
+    df = spg_table()
+    write_format_table(df, ftable)
+    assert ftable.read_text() == TABLE
+    assert (tmp_path / ".spg.txt.arrow").exists()
+    pd.testing.assert_frame_equal(read_format_table(ftable), df.rename_axis("index"))
+
+
+def test_read_format_table_stale_sidecar(tmp_path):
+    ftable = tmp_path / "spg.txt"
+    write_format_table(spg_table(), ftable)
+    # edited by hand, the sidecar no longer describes the text
+    ftable.write_text(TABLE + "3.vasp   2    -0.750000  P-1     False\n")
+    df = read_format_table(ftable)
+    assert list(df.index) == ["1.vasp", "10.vasp", "2.vasp", "3.vasp"]
+    assert df.loc["3.vasp", "energy"] == -0.75
+    assert np.isnan(df.loc["10.vasp", "energy"])
+    assert df["spg"].tolist() == [227, 1, 12, 2]
+
+
+def test_write_format_table_without_sidecar(tmp_path):
+    ftable = tmp_path / "spg.txt"
+    write_format_table(spg_table(), ftable)
+    write_format_table(spg_table(), ftable, sidecar=False)
+    assert not (tmp_path / ".spg.txt.arrow").exists()
+    assert read_format_table(ftable)["symbol"].tolist() == ["Fd-3m", "P1", "C2/m"]
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+from pymatgen.core.lattice import Lattice
+from pymatgen.core.structure import Structure
+
+from cdakit.match_structure import get_matchers, match_levels, match_unique
+
+
+def si_diamond(scale=1.0, perturb=0.0, seed=0) -> Structure:
+    st = Structure.from_spacegroup("Fd-3m", Lattice.cubic(5.43), ["Si"], [[0, 0, 0]]).get_primitive_structure()
+    st.scale_lattice(st.volume * scale)
+    if perturb > 0:
+        rng = np.random.default_rng(seed)
+        for i in range(len(st)):
+            st.translate_sites([i], rng.normal(0, perturb, 3), frac_coords=False)
+    return st
+
+
+def test_unique_ignores_volume(tmp_path):
+    indir = tmp_path / "gen"
+    indir.mkdir()
+    for i, scale in enumerate([0.85, 0.95, 1.0, 1.1, 1.2, 1.3]):
+        si_diamond(scale, 0.01, seed=i).to(str(indir / f"{i}.vasp"), fmt="poscar")
+    df = match_unique(indir, get_matchers())
+    for mat_name in get_matchers():
+        assert df[mat_name].sum() == 1
+
+
+def perturbed_cases():
+    rng = np.random.default_rng(0)
+    base = si_diamond()
+    rocksalt = Structure.from_spacegroup("Fm-3m", Lattice.cubic(5.64), ["Na", "Cl"], [[0, 0, 0], [0.5, 0.5, 0.5]])
+    for ref in (base, rocksalt):
+        for perturb in (0.0, 0.05, 0.2, 0.5):
+            for strain in (0.0, 0.1, 0.25, 0.4):
+                st = ref.copy()
+                st.apply_strain(rng.uniform(-strain, strain, 3))
+                if perturb > 0:
+                    st.perturb(perturb)
+                yield ref, st
+                yield ref, st * (2, 1, 1)
+
+
+def test_match_levels_agrees_with_matchers():
+    matchers = get_matchers()
+    for ref, st in perturbed_cases():
+        levels = match_levels(ref, st, matchers)
+        for mat_name, matcher in matchers.items():
+            fit, normrms, maxrms = levels[mat_name]
+            assert fit == matcher.fit(ref, st), mat_name
+            if fit:
+                assert np.allclose((normrms, maxrms), matcher.get_rms_dist(ref, st)), mat_name
+            else:
+                assert normrms is pd.NA
@@ -0,0 +1,89 @@
+from pathlib import Path
+
+import pandas as pd
+
+from cdakit.parse_outcar import (
+    PARSED_OUTCAR_SCHEMA,
+    load_outcar_index,
+    load_parsed_stamps,
+    read_parsed_outcar,
+    save_outcar_index,
+    walk_outcars,
+    write_parsed_part,
+)
+
+NESTED = ["0/OUTCAR", "0/sub/OUTCAR", "0/sub/deep/1.OUTCAR", "1/OUTCAR"]
+
+
+def make_tree(root: Path, fnames):
+    for fname in fnames:
+        root.joinpath(fname).parent.mkdir(parents=True, exist_ok=True)
+        root.joinpath(fname).write_text("")
+
+
+def finished_steps(fnames):
+    return pd.DataFrame({"fname": fnames, "step": 0, "cputime": 1.0})
+
+
+def walked(root: Path, skipdirs=None):
+    return {str(foutcar.relative_to(root)): stat for foutcar, stat in walk_outcars(root, skipdirs, 2)}
+
+
+def test_walk_outcars(tmp_path):
+    make_tree(tmp_path, NESTED + ["0/CONTCAR", "1/OUTCAR.bak"])
+    found = walked(tmp_path)
+    assert sorted(found) == sorted(NESTED)
+    assert all(stat is not None for stat in found.values())
+
+
+def test_skip_finished_walks_subdirectories(tmp_path):
+    make_tree(tmp_path, NESTED)
+    findex = tmp_path / "parsed_outcar.index.json"
+    save_outcar_index(findex, finished_steps(NESTED))
+    skipdirs = load_outcar_index(findex)
+    assert skipdirs == {"0": ["OUTCAR"], "0/sub": ["OUTCAR"], "0/sub/deep": ["1.OUTCAR"], "1": ["OUTCAR"]}
+
+    found = walked(tmp_path, skipdirs)
+    assert sorted(found) == sorted(NESTED)
+    assert all(stat is None for stat in found.values())
+
+
+def test_skip_finished_finds_new_nested_outcar(tmp_path):
+    make_tree(tmp_path, ["0/OUTCAR"])
+    findex = tmp_path / "parsed_outcar.index.json"
+    save_outcar_index(findex, finished_steps(["0/OUTCAR"]))
+    make_tree(tmp_path, ["0/sub/OUTCAR"])
+
+    found = walked(tmp_path, load_outcar_index(findex))
+    assert found["0/OUTCAR"] is None
+    assert found["0/sub/OUTCAR"] is not None
+
+
+def parsed_steps(fname, stamp, nsteps=2):
+    parsed_df = pd.DataFrame({"fname": fname, "stamp": stamp, "step": range(nsteps), "formula": "Si2"})
+    for col in PARSED_OUTCAR_SCHEMA.names[4:]:
+        parsed_df[col] = PARSED_OUTCAR_SCHEMA.field(col).type.to_pandas_dtype()(1)
+    return parsed_df
+
+
+def test_read_parsed_outcar_drops_stamp(tmp_path):
+    dsdir = tmp_path / "parsed_outcar.parquet"
+    dsdir.mkdir()
+    write_parsed_part(dsdir, [parsed_steps("0/OUTCAR", "1-1")])
+
+    df = read_parsed_outcar(tmp_path)
+    assert df.index.names == ["fname", "step"]
+    assert list(df.columns) == PARSED_OUTCAR_SCHEMA.names[3:]
+    assert list(read_parsed_outcar(tmp_path, columns=["stamp"]).columns) == ["stamp"]
+
+
+def test_parsed_stamps_of_interrupted_run(tmp_path):
+    dsdir = tmp_path / "parsed_outcar.parquet"
+    dsdir.mkdir()
+    write_parsed_part(dsdir, [parsed_steps("0/OUTCAR", "1-1"), parsed_steps("1/OUTCAR", "2-2")])
+    # the grown 0/OUTCAR was written again, the run stopped before the old rows were evicted
+    write_parsed_part(dsdir, [parsed_steps("0/OUTCAR", "3-3", nsteps=3)])
+    known, conflicted = load_parsed_stamps(dsdir)
+    assert known == {"1/OUTCAR": "2-2"}
+    assert conflicted == {"0/OUTCAR"}
+    assert load_parsed_stamps(tmp_path / "none") == ({}, set())
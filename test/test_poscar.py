@@ -0,0 +1,127 @@
+import numpy as np
+import pytest
+from ase.io import read
+
+from cdakit.poscar import parse_poscar, read_poscar
+
+VASP5 = """rutile
+1.0
+4.59 0 0
+0 4.59 0
+0 0 2.96
+Ti O
+2 4
+Direct
+0 0 0
+0.5 0.5 0.5
+0.305 0.305 0
+0.695 0.695 0
+0.805 0.195 0.5
+0.195 0.805 0.5
+"""
+
+VASP4 = """Ti O
+1.0
+4.59 0 0
+0 4.59 0
+0 0 2.96
+2 4
+Direct
+0 0 0
+0.5 0.5 0.5
+0.305 0.305 0
+0.695 0.695 0
+0.805 0.195 0.5
+0.195 0.805 0.5
+"""
+
+SELECTIVE = """relaxed top
+1.0
+3.6 0 0
+0 3.6 0
+0.5 0.2 7.2
+Cu_pv/abc123 O
+2 1
+Selective dynamics
+Direct
+0 0 0 F F F
+0.5 0.5 0.5 T T T
+0.25 0.25 0.75 T T F
+"""
+
+CARTESIAN = """cartesian
+2.0
+2.0 0 0
+0 2.0 0
+0.2 0 2.5
+Na Cl
+1 1
+Cartesian
+0 0 0
+2.1 2.0 2.3
+"""
+
+NEGATIVE_VOLUME = """volume
+-125.0
+1.0 0 0
+0.1 1.0 0
+0 0 1.2
+Fe
+2
+direct
+0 0 0
+0.5 0.5 0.5
+"""
+
+THREE_SCALES = """three scales
+3.0 3.5 4.0
+1.0 0 0
+0 1.0 0
+0 0 1.0
+Mg
+2
+Cartesian
+0 0 0
+0.5 0.25 0.5
+"""
+
+
+POSCARS = {
+    "vasp5": VASP5,
+    "vasp4": VASP4,
+    "selective": SELECTIVE,
+    "cartesian": CARTESIAN,
+    "negative_volume": NEGATIVE_VOLUME,
+    "three_scales": THREE_SCALES,
+}
+
+
+@pytest.mark.parametrize("text", POSCARS.values(), ids=list(POSCARS))
+def test_read_poscar_as_ase(tmp_path, text):
+    fposcar = tmp_path / "POSCAR"
+    fposcar.write_text(text)
+    cell = read_poscar(fposcar)
+    atoms = read(fposcar, format="vasp")
+    assert np.allclose(cell.lattice, atoms.cell[:])
+    assert np.allclose(cell.positions, atoms.get_scaled_positions(wrap=False))
+    assert np.array_equal(cell.numbers, atoms.numbers)
+    assert cell.formula == atoms.get_chemical_formula("metal")
+
+
+def test_blank_coordinate_line_is_direct():
+    lines = VASP5.splitlines()
+    lines[7] = "   "
+    cell = parse_poscar("\n".join(lines))
+    assert np.allclose(cell.positions, parse_poscar(VASP5).positions)
+
+
+def test_reduced_formula():
+    text = SELECTIVE.replace("2 1\n", "4 2\n") + "0.75 0.75 0.25 T T F\n" * 3
+    cell = parse_poscar(text)
+    assert cell.formula == "Cu4O2"
+    assert cell.reduced_formula == "Cu2O"
+
+
+def test_wrong_species():
+    with pytest.raises(ValueError):
+        parse_poscar(VASP5.replace("Ti O", "Ti Xx"))
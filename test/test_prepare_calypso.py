@@ -0,0 +1,113 @@
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+from cdakit.prepare_calypso import STATE_FILE, CalypsoScheduler, load_state
+
+CALYPSO = [sys.executable, str(Path(__file__).with_name("calypso.x"))]
+POPSIZE = 3
+
+
+def make_calypsodir(outdir: Path, name: str) -> Path:
+    calypsodir = outdir / name
+    calypsodir.mkdir(parents=True)
+    calypsodir.joinpath("input.dat").write_text(
+        f"SystemName = {name}\n"
+        "NameOfAtoms = Si\n"
+        "NumberOfAtoms = 2\n"
+        "Volume = 40.0\n"
+        f"PopSize = {POPSIZE}\n"
+    )
+    return calypsodir
+
+
+def test_run(tmp_path):
+    calypsodirs = [make_calypsodir(tmp_path, name) for name in "abc"]
+    scheduler = CalypsoScheduler(CALYPSO, POPSIZE, concurrency=2, timeout=30, fstate=tmp_path / STATE_FILE)
+    results = scheduler.run(calypsodirs)
+    assert {record["status"] for record in results.values()} == {"done"}
+    for calypsodir in calypsodirs:
+        for popi in range(1, POPSIZE + 1):
+            assert calypsodir.joinpath(f"calc/{popi}/POSCAR").exists()
+        assert not any(calypsodir.glob("POSCAR_*"))
+    assert set(load_state(tmp_path / STATE_FILE)) == {"a", "b", "c"}
+
+
+def test_timeout(tmp_path, monkeypatch):
+    monkeypatch.setenv("FAKE_CALYPSO_SLEEP", "30")
+    calypsodir = make_calypsodir(tmp_path, "a")
+    scheduler = CalypsoScheduler(CALYPSO, POPSIZE, timeout=0.5, retries=1)
+    record = scheduler.run([calypsodir])[scheduler.key(calypsodir)]
+    assert record == {"dir": str(calypsodir.resolve()), "status": "failed", "attempts": 2, "returncode": None}
+
+
+def test_retry(tmp_path):
+    # fails at the first attempt only
+    cmd = ["sh", "-c", 'test -e tried || { touch tried; exit 1; }; exec "$0" "$1"', *CALYPSO]
+    calypsodir = make_calypsodir(tmp_path, "a")
+    record = CalypsoScheduler(cmd, POPSIZE, timeout=30, retries=1).run([calypsodir])[str(calypsodir.resolve())]
+    assert record["status"] == "done"
+    assert record["attempts"] == 2
+
+
+def test_retry_exhausted(tmp_path, monkeypatch):
+    monkeypatch.setenv("FAKE_CALYPSO_FAIL", "1")
+    calypsodir = make_calypsodir(tmp_path, "a")
+    record = CalypsoScheduler(CALYPSO, POPSIZE, timeout=30, retries=2).run([calypsodir])[str(calypsodir.resolve())]
+    assert record["status"] == "failed"
+    assert record["attempts"] == 3
+    assert record["returncode"] == 1
+
+
+def test_resume_key(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    outdir = Path("in.calypso")
+    calypsodir = make_calypsodir(outdir, "a")
+    CalypsoScheduler(CALYPSO, POPSIZE, timeout=30, fstate=outdir / STATE_FILE).run([calypsodir])
+
+    # the same dirs written another way by the resumed run
+    scheduler = CalypsoScheduler(CALYPSO, POPSIZE, fstate=tmp_path / "in.calypso" / STATE_FILE)
+    state = load_state(tmp_path / "in.calypso" / STATE_FILE)
+    for other in (tmp_path / "in.calypso" / "a", Path("./in.calypso/a"), Path("in.calypso/../in.calypso/a")):
+        assert state[scheduler.key(other)]["status"] == "done"
+
+
+def test_cancel_kills_calypso(tmp_path):
+    calypsodir = make_calypsodir(tmp_path, "a")
+    cmd = ["sh", "-c", "echo $$ > pid; exec sleep 30"]
+    scheduler = CalypsoScheduler(cmd, POPSIZE, timeout=60)
+
+    async def cancel_when_started():
+        task = asyncio.create_task(scheduler.run_all([calypsodir]))
+        fpid = calypsodir / "pid"
+        while not (fpid.exists() and fpid.read_text().strip()):
+            await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return int(fpid.read_text())
+
+    pid = asyncio.run(cancel_when_started())
+    with pytest.raises(ProcessLookupError):
+        os.kill(pid, 0)
+    assert scheduler.results == {}
+
+
+def test_command_not_started(tmp_path):
+    calypsodirs = [make_calypsodir(tmp_path, name) for name in "ab"]
+    scheduler = CalypsoScheduler([str(tmp_path / "no_calypso.x")], POPSIZE, timeout=30, fstate=tmp_path / STATE_FILE)
+    results = scheduler.run(calypsodirs)
+    assert [results[name]["status"] for name in "ab"] == ["failed", "failed"]
+    assert results["a"]["returncode"].startswith("FileNotFoundError")
+    assert set(load_state(tmp_path / STATE_FILE)) == {"a", "b"}
+
+
+def test_split_fails(tmp_path):
+    calypsodirs = [make_calypsodir(tmp_path, name) for name in "ab"]
+    calypsodirs[0].joinpath("calc").write_text("")  # calc/<i> cannot be made
+    results = CalypsoScheduler(CALYPSO, POPSIZE, timeout=30, fstate=tmp_path / STATE_FILE).run(calypsodirs)
+    assert results["a"]["status"] == "failed"
+    assert results["b"]["status"] == "done"
@@ -0,0 +1,49 @@
+import warnings
+
+import pytest
+from pymatgen.core.lattice import Lattice
+from pymatgen.core.structure import Structure
+from pymatgen.io.vasp.sets import MPRelaxSet
+
+from cdakit import prepare_vasp
+from cdakit.prepare_vasp import POTCAR_FUNCTIONAL, USER_POTCAR_SETTINGS, get_incar
+
+SETTINGS = {
+    "default": {"LREAL": False, "ISMEAR": 0, "NCORE": 4, "NSW": 100, "PSTRESS": 0, "ISYM": 0},
+    "ediff": {"LREAL": False, "ISMEAR": 0, "NCORE": 4, "NSW": 100, "PSTRESS": 100, "ISYM": 0, "EDIFF": 1e-6, "EDIFFG": -0.01},
+    "kspacing": {"LREAL": False, "ISMEAR": 0, "NCORE": 4, "NSW": 1, "PSTRESS": 0, "ISYM": 2, "KSPACING": 0.2},
+}
+
+# compositions, magnetic and +U ones included, as (species, fractional coords)
+COMPOSITIONS = {
+    "Si": (["Si", "Si"], [[0, 0, 0], [0.25, 0.25, 0.25]]),
+    "Fe2O3": (["Fe", "Fe", "O", "O", "O"], [[0, 0, 0], [0.5, 0.5, 0.5], [0.5, 0, 0], [0, 0.5, 0], [0, 0, 0.5]]),
+    "NiO": (["Ni", "O"], [[0, 0, 0], [0.5, 0.5, 0.5]]),
+    "LiCoO2": (["Li", "Co", "O", "O"], [[0, 0, 0], [0.5, 0.5, 0.5], [0.25, 0.25, 0.25], [0.75, 0.75, 0.75]]),
+    "MnW": (["Mn", "W"], [[0, 0, 0], [0.5, 0.5, 0.5]]),
+}
+
+
+def mp_set(structure, settings):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        return MPRelaxSet(
+            structure,
+            user_incar_settings=settings,
+            user_potcar_settings=USER_POTCAR_SETTINGS,
+            user_potcar_functional=POTCAR_FUNCTIONAL,
+        )
+
+
+@pytest.mark.parametrize("settings", SETTINGS.values(), ids=list(SETTINGS))
+@pytest.mark.parametrize("composition", COMPOSITIONS)
+def test_incar_template(monkeypatch, composition, settings):
+    monkeypatch.setattr(prepare_vasp, "_incar_cache", {})
+    structure = Structure(Lattice.cubic(4.2), *COMPOSITIONS[composition])
+    # the first fills the template, the others are built from it
+    for st in (structure, structure * (1, 1, 2), structure * (2, 2, 1)):
+        vasp_set = mp_set(st, settings)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            assert get_incar(vasp_set, settings) == vasp_set.incar
+    assert len(prepare_vasp._incar_cache) == 1
@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+from ase.build import bulk
+from ase.io import write
+
+from cdakit.find_spg import find_spg
+from cdakit.iotools import read_format_table
+from cdakit.poscar import read_poscar
+from cdakit.store import glob_vasp, pack, read_cell, read_structure, structure_stamp, unpack
+
+SYMPREC_LIST = [0.1, 0.01]
+# selective dynamics and Cartesian coordinates, not as ase writes them
+TRICLINIC = """triclinic
+1.0
+3.1 0.1 0.2
+0.3 3.4 0.1
+0.2 0.4 3.8
+Ga As
+1 2
+Selective dynamics
+Cartesian
+0.3 0.4 0.5 T T T
+1.6 1.9 2.1 T T F
+2.4 0.9 1.3 F F F
+"""
+
+
+def shard_files(sympart):
+    return sorted(str(fname.relative_to(sympart)) for fname in sympart.glob("spg_*/gen/*.vasp"))
+
+
+def make_vasp_dir(indir):
+    indir.mkdir()
+    write(indir / "1.vasp", bulk("Cu", "fcc", a=3.6, cubic=True), format="vasp", direct=True)
+    write(indir / "2.vasp", bulk("NaCl", "rocksalt", a=5.64), format="vasp", direct=True)
+    write(indir / "10.vasp", bulk("Fe", "bcc", a=2.87), format="vasp", direct=True)
+    indir.joinpath("a.vasp").write_text(TRICLINIC)
+    return indir
+
+
+def test_pack_unpack(tmp_path):
+    indir = make_vasp_dir(tmp_path / "raw")
+    pack(indir=indir)
+    fstore = tmp_path / "raw.cdastore"
+    members = glob_vasp(fstore)
+    assert [f.name for f in members] == ["1.vasp", "2.vasp", "10.vasp", "a.vasp"]
+    for member in members:
+        cell, orig = read_cell(member), read_poscar(indir / member.name)
+        assert np.array_equal(cell.lattice, orig.lattice)
+        assert np.array_equal(cell.positions, orig.positions)
+        assert np.array_equal(cell.numbers, orig.numbers)
+        assert read_structure(member) == read_structure(indir / member.name)
+
+    unpack(store=fstore, output=tmp_path / "unpacked")
+    for member in members:
+        cell, orig = read_poscar(tmp_path / "unpacked" / member.name), read_poscar(indir / member.name)
+        assert np.allclose(cell.lattice, orig.lattice)
+        assert np.allclose(cell.positions, orig.positions)
+        assert np.array_equal(cell.numbers, orig.numbers)
+
+
+def test_structure_stamp(tmp_path):
+    indir = make_vasp_dir(tmp_path / "raw")
+    pack(indir=indir)
+    stamps = [structure_stamp(f) for f in glob_vasp(tmp_path / "raw.cdastore")]
+    assert len(set(stamps)) == len(stamps)
+    # written again, the store is reopened
+    pack(indir=indir)
+    assert [structure_stamp(f) for f in glob_vasp(tmp_path / "raw.cdastore")] == stamps
+
+    write(indir / "2.vasp", bulk("NaCl", "rocksalt", a=5.5), format="vasp", direct=True)
+    pack(indir=indir)
+    changed = [a != b for a, b in zip(stamps, map(structure_stamp, glob_vasp(tmp_path / "raw.cdastore")))]
+    assert changed == [False, True, False, False]
+
+
+def test_find_spg_of_store(tmp_path):
+    make_vasp_dir(tmp_path / "dir" / "raw")
+    tmp_path.joinpath("store").mkdir()
+    pack(indir=tmp_path / "dir" / "raw", output=tmp_path / "store" / "raw.cdastore")
+    for indir in (tmp_path / "dir" / "raw", tmp_path / "store" / "raw.cdastore"):
+        find_spg(indirs=[indir], symprec=SYMPREC_LIST)
+    df = read_format_table(tmp_path / "store" / "spg.txt")
+    pd.testing.assert_frame_equal(df, read_format_table(tmp_path / "dir" / "spg.txt"))
+    assert df.set_index("name").loc[["1.vasp", "2.vasp", "10.vasp"], "1e-01"].tolist() == [225, 225, 229]
+    for prec in ("1e-01", "1e-02"):
+        names = sorted(f.name for f in tmp_path.joinpath("store", f"std_{prec}").glob("*.vasp"))
+        assert names == ["1.vasp", "10.vasp", "2.vasp", "a.vasp"]
+    assert shard_files(tmp_path / "store" / "sympart") == shard_files(tmp_path / "dir" / "sympart") != []
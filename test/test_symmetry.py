@@ -0,0 +1,38 @@
+import numpy as np
+import spglib
+
+from cdakit import symmetry
+from cdakit.symmetry import get_symmetry_dataset, std_cell, symmetry_ladder
+
+# rutile TiO2
+RUTILE = (
+    np.diag([4.59, 4.59, 2.96]),
+    np.array([[0, 0, 0], [0.5, 0.5, 0.5], [0.305, 0.305, 0], [0.695, 0.695, 0], [0.805, 0.195, 0.5], [0.195, 0.805, 0.5]]),
+    np.array([22, 22, 8, 8, 8, 8]),
+)
+FCC = (3.6 * np.eye(3), np.array([[0, 0, 0], [0.5, 0.5, 0], [0.5, 0, 0.5], [0, 0.5, 0.5]]), np.array([29] * 4))
+
+
+def test_std_cell_as_spglib():
+    for cell in (RUTILE, FCC):
+        symds = spglib.get_symmetry_dataset(cell, 0.01)
+        for to_primitive in (False, True):
+            lattice, positions, numbers = spglib.standardize_cell(cell, to_primitive, symprec=0.01)
+            std_lattice, std_positions, std_numbers = std_cell(symds, to_primitive)
+            assert np.allclose(std_lattice, lattice)
+            assert np.array_equal(std_numbers, numbers)
+            shift = std_positions - positions
+            assert np.allclose(shift - np.round(shift), 0)
+
+
+def test_symmetry_ladder_memo(monkeypatch):
+    monkeypatch.setattr(symmetry, "_dataset_cache", type(symmetry._dataset_cache)())
+    monkeypatch.setattr(symmetry, "DATASET_CACHE_SIZE", 4)
+    first = symmetry_ladder(RUTILE, [0.1, 0.01])
+    assert [symds.number for symds in first.values()] == [136, 136]
+    again = symmetry_ladder(RUTILE, [0.1, 0.01])
+    assert all(again[symprec] is first[symprec] for symprec in first)
+    symmetry_ladder(FCC, [0.5, 0.1, 0.01])
+    # bounded, the oldest dataset is dropped
+    assert len(symmetry._dataset_cache) == 4
+    assert get_symmetry_dataset(RUTILE, 0.1) is not first[0.1]